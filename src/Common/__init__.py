@@ -1,4 +1,4 @@
 #导出基础类型与数据结构
 from .base import *
 # 导出eval部分
-from .eval import execute_script
\ No newline at end of file
+from .eval import execute_script, code_cache, code_cache_info, Budget, BudgetExceeded, Progress, ScriptResult
\ No newline at end of file
@@ -1,5 +1,43 @@
+import sys
+from datetime import datetime, timedelta
 from typing import Dict
 
+# entry 紧凑存储 lastSavedTime 时使用的纪元（按 naive 时间直接相减，不涉及时区换算）
+_EPOCH = datetime(1970, 1, 1)
+
+
+class _CompactMarker:
+    """标记 value 以 (_text, _saved) 紧凑形式保存；pickle / copy 时保持单例"""
+    
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return "_COMPACT"
+
+
+_COMPACT = _CompactMarker()
+
+
+def _to_epoch(saved):
+    """lastSavedTime -> 纪元秒数；无法无损转换时返回 None"""
+    if isinstance(saved, str):
+        try:
+            parsed = datetime.fromisoformat(saved)
+        except ValueError:
+            return None
+        # 只接受能原样写回的字符串，保证 to_dict / to_line 输出不变
+        if parsed.isoformat() != saved:
+            return None
+        saved = parsed
+    if type(saved) is not datetime or saved.tzinfo is not None:
+        return None
+    seconds = (saved - _EPOCH).total_seconds()
+    return seconds if _from_epoch(seconds) == saved else None
+
+
+def _from_epoch(seconds):
+    return _EPOCH + timedelta(seconds=seconds)
+
 class Access:
     """HTTP请求到内部访问对象的转换"""
     
@@ -63,8 +101,16 @@ class entry:
     
     纯数据类，专注于持久化存储。
     通过 to_renderee() 方法可转换为 Renderee 对象用于渲染。
+    
+    大多数记录是 {"text": str, "lastSavedTime": datetime} 形式的文本，
+    这类 value 以 (text, 纪元秒数) 紧凑保存，读取 value 时再生成字典和 datetime。
+    因此 value 应视为只读：修改时构造新的 value 重新赋值（或新的 entry）。
+    
+    每次给 value 赋值 _version 加一，备份时据此判断缓存的序列化结果是否仍然有效。
     """
     
+    __slots__ = ("mime", "_value", "_text", "_saved", "lastModifiedTime", "_version")
+    
     def __init_subclass__(cls, mime: str = None, **kwargs):
         """子类初始化时自动注册到备份系统
         
@@ -79,13 +125,69 @@ class entry:
             register_entry_class(mime, cls)
     
     def __init__(self, mime: str = "", value: any = None):
-        self.mime = mime
+        # 同一种 mime 的大量记录共享一个字符串对象
+        self.mime = sys.intern(mime) if type(mime) is str else mime
+        # 子类可能覆写 value 属性而不经过下面的 setter
+        self._value = None
+        self._version = 0
         self.value = value
         self.lastModifiedTime = None
     
+    @property
+    def value(self):
+        if self._value is not _COMPACT:
+            return self._value
+        saved = self._saved
+        return {"text": self._text, "lastSavedTime": None if saved is None else _from_epoch(saved)}
+    
+    @value.setter
+    def value(self, value):
+        self._version += 1
+        # 只压缩键顺序与内容都能原样还原的文本记录
+        if type(value) is dict and len(value) == 2 and type(value.get("text")) is str:
+            keys = iter(value)
+            if next(keys) == "text" and next(keys) == "lastSavedTime":
+                saved = value["lastSavedTime"]
+                seconds = None if saved is None else _to_epoch(saved)
+                if saved is None or seconds is not None:
+                    self._value = _COMPACT
+                    self._text = value["text"]
+                    self._saved = seconds
+                    return
+        self._value = value
+        self._text = None
+        self._saved = None
+    
+    def compact_parts(self):
+        """紧凑保存的文本记录返回 (text, 纪元秒数或 None)，否则返回 None（供二进制备份使用）"""
+        if self._value is _COMPACT:
+            return self._text, self._saved
+        return None
+    
+    @classmethod
+    def from_compact(cls, mime: str, text: str, saved, lastModifiedTime=None):
+        """compact_parts() 的逆操作，跳过 value 的形状检查"""
+        instance = cls.__new__(cls)
+        instance.mime = sys.intern(mime)
+        instance._value = _COMPACT
+        instance._text = text
+        instance._saved = saved
+        instance.lastModifiedTime = lastModifiedTime
+        instance._version = 0
+        return instance
+    
+    def _compact_value(self):
+        """紧凑文本记录的可序列化 value（datetime 转为 ISO 字符串）"""
+        saved = self._saved
+        return {"text": self._text, "lastSavedTime": None if saved is None else _from_epoch(saved).isoformat()}
+    
     def to_dict(self):
         """转换为字典（用于持久化）"""
-        from datetime import datetime
+        if self._value is _COMPACT:
+            result = {"mime": self.mime, "value": self._compact_value()}
+            if self.lastModifiedTime is not None:
+                result["lastModifiedTime"] = self.lastModifiedTime.isoformat() if isinstance(self.lastModifiedTime, datetime) else self.lastModifiedTime
+            return result
         
         def _serialize_value(val):
             """递归序列化 value 字段"""
@@ -137,7 +239,9 @@ class entry:
         使用 JSON 单行格式，并对换行符等特殊字符进行转义
         """
         import json
-        from datetime import datetime
+        
+        if self._value is _COMPACT:
+            return json.dumps(self._compact_value(), ensure_ascii=False, separators=(',', ':'))
         
         def _serialize_for_line(val):
             """递归序列化为 JSON 可接受的格式"""
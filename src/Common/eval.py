@@ -1,27 +1,565 @@
-from typing import Dict, Tuple
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+import ast
+import ctypes
+import hashlib
 import re
 import io
 import sys
+import threading
+import time
 
 
-def execute_script(script_content: str, extra_globals: Dict = None) -> Tuple[bool, str, list]:
+# 插入到脚本每个 except 分支开头的检查函数（由 run_script 放进脚本的内置函数）
+BUDGET_CHECK = "__budget_check__"
+
+
+class _GuardHandlers(ast.NodeTransformer):
+    """在每个 except 分支开头插入 BUDGET_CHECK()：超出预算后脚本的 try/except 接不住预算异常"""
+    
+    def visit_ExceptHandler(self, node):
+        self.generic_visit(node)
+        check = ast.Expr(ast.Call(ast.Name(BUDGET_CHECK, ast.Load()), [], []))
+        node.body.insert(0, ast.copy_location(check, node))
+        return ast.fix_missing_locations(node)
+
+
+class CodeCache:
+    """编译结果（code object）的 LRU 缓存，按脚本内容的哈希索引
+    
+    计时器每秒执行同样的脚本，.py entry 也会被反复访问；内容相同的脚本只编译一次。
+    条目数和源码总长度都有上限，超出时淘汰最久未使用的条目。
+    编译时在每个 except 分支开头插入预算检查（见 _GuardHandlers）。
+    """
+    
+    def __init__(self, max_entries: int = 512, max_bytes: int = 8 << 20):
+        """
+        Args:
+            max_entries: 最多缓存的脚本数
+            max_bytes: 缓存脚本的源码总长度上限（字符数，近似代替 code object 的大小）
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def _key(source: str) -> bytes:
+        return hashlib.blake2b(source.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    
+    def compile(self, source: str, filename: str = "<string>"):
+        """返回 source 的 code object（有缓存时直接返回）
+        
+        Raises:
+            SyntaxError: 脚本有语法错误（不缓存）
+        """
+        key = self._key(source)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        
+        # 编译不持有锁；并发编译同一脚本时后写入的覆盖先写入的，结果相同
+        code = compile(_GuardHandlers().visit(ast.parse(source, filename)), filename, "exec")
+        size = len(source)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return code
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (code, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return code
+    
+    def configure(self, max_entries: int = None, max_bytes: int = None):
+        """修改上限（立即按新上限淘汰）"""
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+# Exec、Meta 和计时器共用的编译缓存
+code_cache = CodeCache()
+
+
+def code_cache_info() -> Dict[str, Any]:
+    """编译缓存的命中率等统计"""
+    return code_cache.info()
+
+
+# 每次执行最多捕获的输出字符数（execute_script 的 max_output 默认值）
+MAX_OUTPUT = 1 << 20
+
+
+# 脚本编译时使用的文件名；执行预算只统计这个文件名下的代码
+SCRIPT_FILENAME = "<string>"
+
+
+class BudgetExceeded(Exception):
+    """脚本超出执行预算
+    
+    一旦超出，脚本的每个 except 分支都会立即再次抛出，脚本无法用 try/except 吞掉后继续运行。
+    """
+    
+    def __init__(self, budget: str, limit, used=None):
+        self.budget = budget
+        self.limit = limit
+        self.used = used
+        super().__init__(f"超出执行预算: {budget}（上限 {limit}）")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {"budget": self.budget, "limit": self.limit, "used": self.used}
+
+
+class Budget:
+    """一次执行的预算，None 表示不限
+    
+    - wall_time: 墙钟时间（秒），由看门狗线程计时，不需要跟踪脚本
+    - cpu_time: CPU 时间（秒），只在进程池中生效
+    - ops: 脚本代码执行的字节码指令数（通过 sys.settrace 计数，只在指定时跟踪，会明显拖慢脚本）
+    - output: 输出的字符数（超出即失败，而不是截断）
+    - db_ops: db 操作次数
+    
+    可以由调用方指定，也可以写在脚本开头的注释中（只能收紧调用方的预算）：
+        # budget: wall_time=2, ops=1000000, db_ops=50
+    """
+    
+    FIELDS = ("wall_time", "cpu_time", "ops", "output", "db_ops")
+    __slots__ = FIELDS
+    
+    _HEADER = re.compile(r"#\s*budget\s*:(.*)", re.IGNORECASE)
+    
+    def __init__(self, wall_time: float = None, cpu_time: float = None, ops: int = None,
+                 output: int = None, db_ops: int = None):
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.ops = ops
+        self.output = output
+        self.db_ops = db_ops
+    
+    def __getstate__(self):
+        return self.to_dict()
+    
+    def __setstate__(self, state):
+        for name in self.FIELDS:
+            setattr(self, name, state.get(name))
+    
+    def __repr__(self):
+        items = ", ".join(f"{name}={getattr(self, name)}" for name in self.FIELDS if getattr(self, name) is not None)
+        return f"Budget({items})"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+    
+    def within(self, other: Optional["Budget"]) -> "Budget":
+        """逐项取两者中更严格的一个"""
+        if other is None:
+            return self
+        values = {}
+        for name in self.FIELDS:
+            mine, theirs = getattr(self, name), getattr(other, name)
+            values[name] = theirs if mine is None else mine if theirs is None else min(mine, theirs)
+        return Budget(**values)
+    
+    @classmethod
+    def from_script(cls, script_content: str) -> Optional["Budget"]:
+        """脚本开头注释中的预算；没有时返回 None，无法解析的项被忽略"""
+        values = {}
+        for line in script_content.lstrip().splitlines():
+            line = line.strip()
+            if not line.startswith("#"):
+                break
+            match = cls._HEADER.match(line)
+            if not match:
+                continue
+            for item in re.split(r"[,\s]+", match.group(1).strip()):
+                name, _, value = item.partition("=")
+                if name not in cls.FIELDS:
+                    continue
+                try:
+                    number = float(value)
+                except ValueError:
+                    continue
+                values[name] = number if name in ("wall_time", "cpu_time") else int(number)
+        return cls(**values) if values else None
+
+
+class _Meter:
+    """执行预算的计量：指定了 ops 时用 sys.settrace 统计脚本代码的字节码指令数，db 操作另行计数
+    
+    按指令而不是按行计数：写在一行里的循环（while True: pass、推导式）回跳时不产生 line 事件。
+    墙钟时间由 _Watchdog 负责。
+    """
+    
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.ops = 0
+        self.db_ops = 0
+        self.output = 0
+        self.exceeded: Optional[BudgetExceeded] = None
+        self.started = time.monotonic()
+        self.deadline = None if budget.wall_time is None else self.started + budget.wall_time
+        # 看门狗持有它时才注入异常；db 操作期间也持有它，注入的异常不会落在表的写入中间
+        self.guard = threading.Lock()
+    
+    @property
+    def traced(self) -> bool:
+        return self.budget.ops is not None
+    
+    def _exceed(self, name: str, limit, used):
+        if self.exceeded is None:
+            self.exceeded = BudgetExceeded(name, limit, used)
+        raise self.exceeded
+    
+    def trace(self, frame, event, arg):
+        """全局跟踪函数：只跟踪脚本自己的代码（包括脚本中定义的函数）"""
+        if frame.f_code.co_filename != SCRIPT_FILENAME:
+            return None
+        frame.f_trace_opcodes = True
+        return self._trace_opcode
+    
+    def _trace_opcode(self, frame, event, arg):
+        if event == "opcode":
+            if self.exceeded is not None:
+                raise self.exceeded
+            self.ops += 1
+            if self.ops > self.budget.ops:
+                self._exceed("ops", self.budget.ops, self.ops)
+        return self._trace_opcode
+    
+    def counters(self) -> Dict[str, Any]:
+        """到目前为止的计量数（ops 只在跟踪时统计）"""
+        return {
+            "ops": self.ops,
+            "db_ops": self.db_ops,
+            "output": self.output,
+            "elapsed": round(time.monotonic() - self.started, 3),
+        }
+    
+    def check(self):
+        """脚本的 except 分支开头调用（BUDGET_CHECK）：已经超出预算时不让脚本接住异常继续执行"""
+        if self.exceeded is not None:
+            raise _Expired(self.exceeded.budget)
+    
+    def expire(self):
+        """墙钟时间用完（由看门狗线程调用）"""
+        if self.exceeded is None:
+            self.exceeded = BudgetExceeded("wall_time", self.budget.wall_time,
+                                           round(time.monotonic() - self.started, 3))
+    
+    def count_db(self):
+        if self.exceeded is not None:
+            raise self.exceeded
+        self.db_ops += 1
+        if self.budget.db_ops is not None and self.db_ops > self.budget.db_ops:
+            self._exceed("db_ops", self.budget.db_ops, self.db_ops)
+    
+    def exceed_output(self, used: int):
+        self._exceed("output", self.budget.output, used)
+
+
+# 每个线程中看门狗注入的 _Expired 已经落下（被实例化）的次数
+_delivered = threading.local()
+
+
+def _delivered_count() -> int:
+    return getattr(_delivered, "count", 0)
+
+
+class _Expired(BaseException):
+    """看门狗注入到脚本线程中的异常（不是 Exception 的子类，脚本的 except Exception 接不住）
+    
+    注入的是类，解释器在抛出处不带参数地实例化它；_Meter.check 再次抛出时带参数，不计入。
+    """
+    
+    def __init__(self, *args):
+        super().__init__(*args)
+        if not args:
+            _delivered.count = _delivered_count() + 1
+
+
+def _async_raise(thread_id: int, exc_type):
+    """在线程 thread_id 执行下一条字节码时抛出 exc_type
+    
+    不用 PyThreadState_SetAsyncExc(id, NULL) 撤销：3.11 中它会让该线程的 eval breaker 一直置位，
+    之后 sys.settrace 不再生效。
+    """
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(exc_type))
+
+
+class _Watchdog(threading.Thread):
+    """墙钟时间预算：到期后向执行脚本的线程注入 _Expired
+    
+    脚本不需要被跟踪，没有额外开销。注入的异常在下一条字节码处抛出，无法打断正在执行的单个内置调用
+    （例如 sum(range(10**11))），它返回后立即生效；进程池中由父进程杀掉工作进程兜底。
+    脚本的 except 分支会把它再次抛出（_Meter.check）；没有结束时每隔 RETRY 秒再注入一次。
+    """
+    
+    RETRY = 0.05
+    
+    # stop() 最多等待这么多秒，让已经注入的异常落下
+    DRAIN = 1.0
+    
+    def __init__(self, meter: _Meter):
+        super().__init__(name="script-watchdog", daemon=True)
+        self._meter = meter
+        self._target = threading.get_ident()
+        self._done = threading.Event()
+        # 注入与 stop()、db 操作互斥：stop() 返回之后不会再有异常落到调用方
+        self._lock = meter.guard
+        self._injected = 0
+        self._base = _delivered_count()
+    
+    def run(self):
+        if self._done.wait(max(0.0, self._meter.deadline - time.monotonic())):
+            return
+        while True:
+            with self._lock:
+                if self._done.is_set():
+                    return
+                self._meter.expire()
+                self._injected += 1
+                _async_raise(self._target, _Expired)
+            if self._done.wait(self.RETRY):
+                return
+    
+    def stop(self):
+        """脚本结束（在执行脚本的线程中调用）：停止计时；已经注入的异常在这里落下，不会落到调用方"""
+        deadline = time.monotonic() + self.DRAIN
+        while True:
+            try:
+                with self._lock:
+                    self._done.set()
+                    if self._injected <= _delivered_count() - self._base:
+                        return
+                # 异常在下一次检查（循环回跳、函数调用）时落下
+                while time.monotonic() < deadline:
+                    time.sleep(0.001)
+                return
+            except _Expired:
+                # 预算已经记在 meter 上
+                continue
+
+
+class _MeteredDB:
+    """给 db 的每个方法调用计数（vmAPI 或工作进程中的代理）"""
+    
+    def __init__(self, db_api, meter: _Meter):
+        self._db = db_api
+        self._meter = meter
+    
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        
+        def call(*args, **kwargs):
+            meter = self._meter
+            # 持有 guard 时看门狗不会注入；之前注入的异常一定已经记在 meter 上，由 count_db 抛出，
+            # 不会进入 db 操作
+            with meter.guard:
+                meter.count_db()
+                return attr(*args, **kwargs)
+        return call
+
+
+class ScriptResult(tuple):
+    """execute_script 的结果：(成功标志, 输出内容, 操作历史)
+    
+    超出预算时 budget_exceeded 为 {"budget", "limit", "used"}，否则为 None。
+    """
+    
+    def __new__(cls, success: bool, output: str, operations: list, budget_exceeded: Dict[str, Any] = None):
+        result = super().__new__(cls, (success, output, operations))
+        result.budget_exceeded = budget_exceeded
+        return result
+    
+    def __reduce__(self):
+        return ScriptResult, (*self, self.budget_exceeded)
+    
+    @property
+    def success(self) -> bool:
+        return self[0]
+    
+    @property
+    def output(self) -> str:
+        return self[1]
+    
+    @property
+    def operations(self) -> list:
+        return self[2]
+
+
+class ScriptOutput:
+    """一次执行的输出缓冲区，超过上限的部分被丢弃；有输出预算时超出即失败"""
+    
+    def __init__(self, limit: int = MAX_OUTPUT, meter: _Meter = None):
+        self.limit = limit
+        self.truncated = False
+        self._buffer = io.StringIO()
+        self._size = 0
+        self._meter = meter
+        if meter is not None and meter.budget.output is not None:
+            self.limit = meter.budget.output
+    
+    def write(self, text: str):
+        if self.truncated:
+            return
+        remaining = self.limit - self._size
+        if len(text) > remaining and self._meter is not None and self._meter.budget.output is not None:
+            self._meter.exceed_output(self._size + len(text))
+        if len(text) > remaining:
+            text = text[:max(0, remaining)]
+            self.truncated = True
+        self._buffer.write(text)
+        self._size += len(text)
+        if self._meter is not None:
+            self._meter.output = self._size
+    
+    def print(self, *args, sep=" ", end="\n", file=None, flush=False):
+        """绑定给脚本的 print：写入本次执行的缓冲区，而不是进程共享的 sys.stdout（忽略 file）"""
+        sep = " " if sep is None else sep
+        end = "\n" if end is None else end
+        self.write(sep.join(str(arg) for arg in args) + end)
+    
+    def getvalue(self) -> str:
+        output = self._buffer.getvalue()
+        if self.truncated:
+            output += f"\n...（输出超过 {self.limit} 个字符，已截断）\n"
+        return output
+
+
+class Progress:
+    """执行中的计量数（ops / db_ops / output / elapsed），供异步任务推送进度
+    
+    在本进程中执行时直接读取 _Meter；在进程池中执行时由工作进程定期发来。
+    """
+    
+    def __init__(self):
+        self._source: Optional[Callable[[], Dict[str, Any]]] = None
+        self._values: Dict[str, Any] = {}
+    
+    def attach(self, source: Optional[Callable[[], Dict[str, Any]]]):
+        """执行开始时设置读取计量数的函数；结束时传 None，保留最后一次的值"""
+        if source is None and self._source is not None:
+            self._values = self._source()
+        self._source = source
+    
+    def update(self, values: Dict[str, Any]):
+        self._values = values
+    
+    def snapshot(self) -> Dict[str, Any]:
+        source = self._source
+        return source() if source is not None else dict(self._values)
+
+
+# 执行后端：None 表示在本进程中执行，否则为 Common.sandbox.ScriptPool
+_backend = None
+
+
+def set_backend(backend):
+    """设置 execute_script 的执行后端（None 恢复为在本进程中执行）"""
+    global _backend
+    _backend = backend
+
+
+def execute_script(script_content: str, extra_globals: Dict = None, max_output: int = None,
+                   timeout: float = None, cpu_time: float = None,
+                   budget: Budget = None, progress: Progress = None, backend=None) -> ScriptResult:
     """执行脚本的通用函数
     
+    输出由绑定到本次执行的 print 捕获，不重定向 sys.stdout：多个线程可以同时执行脚本，
+    输出互不混杂，服务器其他地方的 print 也不会混进脚本输出。
+    设置了进程池后端（Common.sandbox.start_pool）时交给工作进程执行。
+    
     Args:
         script_content: 脚本内容
         extra_globals: 额外的全局变量
-        
+        max_output: 最多捕获的输出字符数（超出部分截断），默认 MAX_OUTPUT
+        timeout: 墙钟时间上限（秒），等同于 budget 的 wall_time
+        cpu_time: CPU 时间上限（秒），等同于 budget 的 cpu_time
+        budget: 执行预算；脚本开头的 "# budget: ..." 注释可以进一步收紧
+        progress: 指定时在执行过程中更新计量数
+        backend: 指定执行后端（例如异步任务专用的进程池），默认使用 set_backend() 设置的后端
+    
     Returns:
-        (成功标志, 输出内容, 操作历史)
+        ScriptResult，可以按 (成功标志, 输出内容, 操作历史) 解包；超出预算时 budget_exceeded 给出是哪一项
     """
     if not script_content.strip():
-        return False, "", []
+        return ScriptResult(False, "", [])
+    
+    budget = Budget(wall_time=timeout, cpu_time=cpu_time).within(budget)
+    header = Budget.from_script(script_content)
+    if header is not None:
+        budget = header.within(budget)
+    
+    backend = backend if backend is not None else _backend
+    if backend is not None:
+        return backend.run(script_content, extra_globals, max_output, budget, progress)
     
     # 延迟导入以避免循环导入
     from Database import vmAPI
+    return run_script(script_content, extra_globals, max_output, vmAPI(), budget, progress)
+
+
+def run_script(script_content: str, extra_globals: Dict, max_output: int, db_api,
+               budget: Budget = None, progress: Progress = None) -> ScriptResult:
+    """在当前进程中执行脚本，db 为 db_api（vmAPI 或工作进程中的代理）"""
+    meter = _Meter(budget or Budget())
+    if progress is not None:
+        progress.attach(meter.counters)
+    try:
+        return _run_metered(script_content, extra_globals, max_output, db_api, meter)
+    finally:
+        if progress is not None:
+            progress.attach(None)
+
+
+def _run_metered(script_content: str, extra_globals: Dict, max_output: int, db_api,
+                 meter: _Meter) -> ScriptResult:
+    """run_script 的主体，按 meter 计量"""
+    operations = db_api.operations
+    db_api = _MeteredDB(db_api, meter)
     
     # 创建安全的执行环境
-    db_api = vmAPI()
+    captured_output = ScriptOutput(MAX_OUTPUT if max_output is None else max_output, meter)
     safe_globals = {
         '__builtins__': {
             'len': len,
@@ -36,7 +574,7 @@ def execute_script(script_content: str, extra_globals: Dict = None) -> Tuple[boo
             'range': range,
             'enumerate': enumerate,
             'zip': zip,
-            'print': print,
+            'print': captured_output.print,
             'max': max,
             'min': min,
             'sum': sum,
@@ -44,6 +582,7 @@ def execute_script(script_content: str, extra_globals: Dict = None) -> Tuple[boo
             'reversed': reversed,
             'any': any,
             'all': all,
+            BUDGET_CHECK: meter.check,
         },
         'db': db_api,  # 提供数据库API
         're': re,      # 正则表达式
@@ -53,20 +592,36 @@ def execute_script(script_content: str, extra_globals: Dict = None) -> Tuple[boo
     if extra_globals:
         safe_globals.update(extra_globals)
     
-    # 捕获输出
-    old_stdout = sys.stdout
-    sys.stdout = captured_output = io.StringIO()
-    
+    previous_trace = sys.gettrace()
     try:
-        # 执行用户脚本
-        exec(script_content, safe_globals, {})
+        # 执行用户脚本（内容相同的脚本只编译一次）
+        code = code_cache.compile(script_content)
+        watchdog = _Watchdog(meter) if meter.deadline is not None else None
+        try:
+            if watchdog is not None:
+                watchdog.start()
+            if meter.traced:
+                sys.settrace(meter.trace)
+            try:
+                exec(code, safe_globals, {})
+            finally:
+                if meter.traced:
+                    sys.settrace(previous_trace)
+        finally:
+            if watchdog is not None:
+                watchdog.stop()
+        if meter.exceeded is not None:
+            # 脚本用 try/except 吞掉了异常，但之后的代码没有再执行
+            raise meter.exceeded
         output = captured_output.getvalue()
-        return True, output, db_api.operations
-        
+        return ScriptResult(True, output, operations)
+    
+    except BudgetExceeded as e:
+        return ScriptResult(False, str(e), operations, e.to_dict())
+    except _Expired:
+        return ScriptResult(False, str(meter.exceeded), operations, meter.exceeded.to_dict())
     except Exception as e:
-        output = captured_output.getvalue()
-        return False, str(e), db_api.operations
-        
-    finally:
-        sys.stdout = old_stdout
+        if meter.exceeded is not None:
+            return ScriptResult(False, str(meter.exceeded), operations, meter.exceeded.to_dict())
+        return ScriptResult(False, str(e), operations)
 
@@ -0,0 +1,485 @@
+"""
+脚本执行的进程池后端
+- 启动时预先创建若干工作进程，之后一直复用；每个工作进程有自己的编译缓存
+- 工作进程由 forkserver（不支持时用 spawn）创建：服务进程是多线程的，直接 fork 会让子进程继承
+  其他线程正持有的锁（日志、备份、编译缓存……）而死锁；forkserver 是单线程的干净进程，
+  预先导入 PRELOAD 中的模块，之后补充的工作进程也从它 fork，启动仍然很快
+- 工作进程中的脚本使用同样受限的内置函数，db 是一个代理：读写请求通过管道发给父进程，
+  由父进程中调用方的线程用 vmAPI 执行；set 先在工作进程中攒批，遇到读操作、攒满或脚本结束时一次发出；
+  失败的 set 由发出这一批的 set 返回 False，或在之后的第一个 db 调用中抛出，脚本结束时的最后一批失败则使执行结果失败
+- 每次调用的执行预算（见 Common.eval.Budget）在工作进程中同样生效；此外墙钟时间由父进程兜底
+  （超过 wall_time 再加 KILL_GRACE 秒仍未结束就杀掉工作进程并补一个新的，可以打断长时间的单个内置调用），
+  CPU 时间由工作进程内的 RLIMIT_CPU 限制（超出时脚本收到异常，进程保留）
+- extra_globals 无法 pickle 时（例如包含函数）退回到在本进程中执行
+- 没有空闲的工作进程时最多等待 acquire_timeout 秒，超时则本次执行失败，不会无限期排队
+- 异步任务（Port/jobs.py）使用单独的进程池 job_pool（start_job_pool），墙钟时间更长，
+  不占用同步执行和定时任务的工作进程；执行中的计量数每 PROGRESS_EVERY 秒发回父进程一次
+  
+    from Common import sandbox
+    sandbox.start_pool(workers=2, timeout=10, cpu_time=5)   # 之后 execute_script 交给进程池
+    sandbox.stop_pool()
+"""
+import multiprocessing
+import pickle
+import queue
+import signal
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from . import eval as script_eval
+
+# 代理中攒批的 set 最多条数
+DB_BATCH = 100
+
+# 工作进程超过墙钟时间预算后，父进程再等待这么多秒才杀掉它（让工作进程自己先报告超出预算）
+KILL_GRACE = 1.0
+
+# 需要进度时，工作进程发回计量数的间隔（秒）
+PROGRESS_EVERY = 0.5
+
+# 代理可以调用的 vmAPI 方法
+DB_METHODS = {"get", "get_text", "set", "list_keys", "exists", "delete", "compare_and_set", "setdefault", "copy"}
+
+# forkserver 预先导入的模块（工作进程从 forkserver fork，不必各自导入）
+PRELOAD = ["Common.eval", "Common.sandbox"]
+
+
+def pool_context():
+    """优先使用 forkserver，不支持时（例如 Windows）使用 spawn；两者都不会从多线程的服务进程直接 fork"""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(PRELOAD)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+# ----------------------------------------------------------------------
+# 工作进程
+# ----------------------------------------------------------------------
+
+class ScriptCPUTimeout(script_eval.BudgetExceeded):
+    def __init__(self, limit):
+        super().__init__("cpu_time", limit)
+
+
+class RemoteDB:
+    """工作进程中的 db：接口与 vmAPI 相同，实际操作由父进程执行"""
+    
+    def __init__(self, conn, send_lock: threading.Lock):
+        self._conn = conn
+        self._send_lock = send_lock
+        self._pending: List[Tuple[str, tuple, dict]] = []
+        self.operations = []   # 操作历史记录在父进程中
+        self.failures: List[str] = []   # 攒批发出后失败的 set（"key: 原因"）
+    
+    def _call(self, method: str, *args, **kwargs):
+        failed = len(self.failures)
+        self._pending.append((method, args, kwargs))
+        ok, value = self.flush()[-1]
+        if len(self.failures) > failed:
+            # 之前攒下的 set 无法再返回 False，在它之后的第一个 db 调用中报告
+            raise RuntimeError(f"db.set 写入失败: {self.failures[failed]}")
+        if not ok:
+            raise RuntimeError(value)
+        return value
+    
+    def flush(self) -> list:
+        """发出攒下的操作，返回每个操作的 (成功, 结果或错误信息)；失败的 set 记入 failures"""
+        if not self._pending:
+            return []
+        batch, self._pending = self._pending, []
+        with self._send_lock:
+            self._conn.send(("db", batch))
+        kind, results = self._conn.recv()
+        for (method, args, _), (ok, value) in zip(batch, results):
+            # vmAPI.set 出错时返回 False，代理拒绝的操作 ok 为 False
+            if method == "set" and (not ok or value is False):
+                self.failures.append(f"{args[0]}: {value if not ok else '写入失败'}")
+        return results
+    
+    def set(self, key: str, content: str, mime: str = "text") -> bool:
+        """写入先攒批，攒满时发出，这一批中有 set 失败时返回 False；
+        没有发出的 set 返回 True，失败在之后的 db 调用或脚本结束时报告"""
+        self._pending.append(("set", (key, str(content), mime), {}))
+        if len(self._pending) >= DB_BATCH:
+            failed = len(self.failures)
+            self.flush()
+            return len(self.failures) == failed
+        return True
+    
+    def get(self, key: str):
+        return self._call("get", key)
+    
+    def get_text(self, key: str):
+        return self._call("get_text", key)
+    
+    def list_keys(self, pattern: str = None, limit: int = None, after: str = None) -> list:
+        return self._call("list_keys", pattern, limit, after)
+    
+    def exists(self, key: str) -> bool:
+        return self._call("exists", key)
+    
+    def delete(self, key: str) -> bool:
+        return self._call("delete", key)
+    
+    def compare_and_set(self, key: str, expected, content: str, mime: str = "text") -> bool:
+        return self._call("compare_and_set", key, expected, str(content), mime)
+    
+    def setdefault(self, key: str, content: str, mime: str = "text") -> str:
+        return self._call("setdefault", key, str(content), mime)
+    
+    def copy(self, from_key: str, to_key: str) -> bool:
+        return self._call("copy", from_key, to_key)
+    
+    def update(self, key: str, fn, mime: str = "text"):
+        """fn 不能发到父进程：在这里读取后用 compare_and_set 写回，冲突时重试"""
+        while True:
+            # 只读一次：键不存在时为 None，与 vmAPI.update 相同
+            text = self.get_text(key)
+            try:
+                new_text = fn(text)
+            except Exception:
+                return None
+            if self.compare_and_set(key, text, new_text, mime):
+                return str(new_text)
+
+
+_running = False
+_cpu_time = None
+
+
+def _on_cpu_limit(signum, frame):
+    if _running:
+        raise ScriptCPUTimeout(_cpu_time)
+
+
+def _limit_cpu(cpu_time: Optional[float]) -> bool:
+    """把 CPU 时间的软上限设为 已用时间 + cpu_time（RLIMIT_CPU 以秒计，向上取整）"""
+    if not cpu_time or resource is None or not hasattr(signal, "SIGXCPU"):
+        return False
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + cpu_time) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    return True
+
+
+def _unlimit_cpu():
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+def _report_progress(conn, send_lock: threading.Lock, progress: script_eval.Progress,
+                     stop: threading.Event, interval: float):
+    """工作进程中的进度线程：脚本执行期间每 interval 秒把计量数发给父进程"""
+    while not stop.wait(interval):
+        try:
+            with send_lock:
+                conn.send(("progress", progress.snapshot()))
+        except (EOFError, OSError):
+            return
+
+
+def _worker_main(conn):
+    """工作进程：逐个执行父进程发来的脚本"""
+    global _running, _cpu_time
+    # 工作进程中的脚本总是在本进程中执行
+    script_eval.set_backend(None)
+    # Ctrl-C 由父进程处理，工作进程由父进程停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, "SIGXCPU"):
+        signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == "stop":
+            return
+        if message[0] != "run":
+            # CPU 超时打断了等待 db 结果的代理，留在管道中的结果已经没有用了
+            continue
+        _, script, extra_globals, max_output, budget, report = message
+        # 进度线程与 db 代理都会发送消息，发送需要互斥（接收只在本线程）
+        send_lock = threading.Lock()
+        db = RemoteDB(conn, send_lock)
+        progress = reporter = None
+        if report:
+            progress = script_eval.Progress()
+            stop_report = threading.Event()
+            reporter = threading.Thread(target=_report_progress, daemon=True,
+                                        args=(conn, send_lock, progress, stop_report, report))
+            reporter.start()
+        _cpu_time = budget.cpu_time
+        limited = _limit_cpu(budget.cpu_time)
+        _running = True
+        try:
+            result = script_eval.run_script(script, extra_globals, max_output, db, budget, progress)
+            success, output, exceeded = result.success, result.output, result.budget_exceeded
+        except ScriptCPUTimeout as e:
+            success, output, exceeded = False, str(e), e.to_dict()
+        finally:
+            _running = False
+            if limited:
+                _unlimit_cpu()
+            if reporter is not None:
+                stop_report.set()
+                reporter.join()
+        try:
+            # 脚本失败时也写入已经执行的 set（与在本进程中执行时一致）
+            failed = len(db.failures)
+            db.flush()
+            if len(db.failures) > failed:
+                # 脚本已经结束，最后一批中失败的 set 只能体现在执行结果里
+                success = False
+                output += f"\ndb.set 写入失败: {'; '.join(db.failures[failed:])}"
+            conn.send(("done", success, output, exceeded, progress.snapshot() if progress else None))
+        except (EOFError, OSError):
+            return
+
+
+# ----------------------------------------------------------------------
+# 父进程
+# ----------------------------------------------------------------------
+
+class _Worker:
+    __slots__ = ("process", "conn")
+    
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+
+def _plain(value):
+    """vmAPI.get 的结果可能是 entry 子类（例如 TimerEntry），统一转换成基类 entry 再发给工作进程"""
+    from .base import entry
+    if type(value) is entry or not isinstance(value, entry):
+        return value
+    plain = entry(mime=value.mime, value=value.value)
+    plain.lastModifiedTime = value.lastModifiedTime
+    return plain
+
+
+class ScriptPool:
+    """预先启动的脚本工作进程池"""
+    
+    def __init__(self, workers: int = 2, timeout: float = 10.0, cpu_time: float = None,
+                 acquire_timeout: float = None):
+        """
+        Args:
+            workers: 工作进程数
+            timeout: 预算中没有 wall_time 时默认的墙钟时间上限（秒），None 表示不限
+            cpu_time: 预算中没有 cpu_time 时默认的 CPU 时间上限（秒），None 表示不限
+            acquire_timeout: 等待空闲工作进程的最长时间（秒），None 表示一直等待
+        """
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.cpu_time = cpu_time
+        self.acquire_timeout = acquire_timeout
+        self._context = pool_context()
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._all: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.runs = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.fallbacks = 0
+        self.busy = 0
+    
+    def start(self) -> "ScriptPool":
+        for _ in range(self.workers):
+            self._idle.put(self._spawn())
+        return self
+    
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn,), daemon=True, name="script-worker")
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        with self._lock:
+            self._all.append(worker)
+        return worker
+    
+    def _kill(self, worker: _Worker):
+        try:
+            worker.process.kill()
+            worker.process.join(timeout=5)
+        except Exception:
+            pass
+        worker.conn.close()
+        with self._lock:
+            if worker in self._all:
+                self._all.remove(worker)
+    
+    def run(self, script: str, extra_globals: Dict = None, max_output: int = None,
+            budget: script_eval.Budget = None, progress: script_eval.Progress = None) -> script_eval.ScriptResult:
+        """在空闲的工作进程中执行脚本，返回值与 execute_script 相同
+        
+        没有空闲进程时最多等待 acquire_timeout 秒，超时返回失败的结果。
+        指定 progress 时，工作进程每 PROGRESS_EVERY 秒发回一次计量数。
+        """
+        if self._closed:
+            raise RuntimeError("脚本进程池已停止")
+        budget = script_eval.Budget(**(budget or script_eval.Budget()).to_dict())
+        # 工作进程中由看门狗计时，父进程在 timeout + KILL_GRACE 之后兜底
+        if budget.wall_time is None:
+            budget.wall_time = self.timeout
+        timeout = budget.wall_time
+        if budget.cpu_time is None:
+            budget.cpu_time = self.cpu_time
+        
+        from Database import vmAPI
+        db_api = vmAPI()
+        try:
+            worker = self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            self.busy += 1
+            return script_eval.ScriptResult(False, f"没有空闲的脚本进程（已等待 {self.acquire_timeout} 秒）", [])
+        alive = True
+        try:
+            try:
+                report = PROGRESS_EVERY if progress is not None else None
+                worker.conn.send(("run", script, extra_globals, max_output, budget, report))
+            except (pickle.PicklingError, TypeError, AttributeError):
+                # extra_globals 无法 pickle：在本进程中执行（CPU 时间预算不生效）
+                self.fallbacks += 1
+                return script_eval.run_script(script, extra_globals, max_output, db_api, budget, progress)
+            except OSError:
+                alive = False
+                return script_eval.ScriptResult(False, "脚本进程意外退出", db_api.operations)
+            self.runs += 1
+            success, output, exceeded, alive = self._wait(worker, db_api, timeout, progress)
+            return script_eval.ScriptResult(success, output, db_api.operations, exceeded)
+        finally:
+            if alive and not self._closed:
+                self._idle.put(worker)
+            else:
+                self._kill(worker)
+                if not self._closed:
+                    self.restarts += 1
+                    self._idle.put(self._spawn())
+    
+    def _wait(self, worker: _Worker, db_api, timeout: Optional[float],
+              progress: script_eval.Progress = None) -> Tuple[bool, str, Optional[dict], bool]:
+        """处理工作进程的 db 请求直到脚本结束
+        
+        Returns:
+            (成功标志, 输出, 超出的预算或 None, 工作进程是否可以复用)
+        """
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout + KILL_GRACE
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and (remaining <= 0 or not worker.conn.poll(remaining)):
+                self.timeouts += 1
+                exceeded = script_eval.BudgetExceeded("wall_time", timeout, round(time.monotonic() - started, 3))
+                return False, str(exceeded), exceeded.to_dict(), False
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                return False, "脚本进程意外退出", None, False
+            if message[0] == "done":
+                if progress is not None and message[4] is not None:
+                    progress.update(message[4])
+                return message[1], message[2], message[3], True
+            if message[0] == "progress":
+                if progress is not None:
+                    progress.update(message[1])
+                continue
+            if message[0] == "db":
+                worker.conn.send(("db", [self._apply(db_api, *op) for op in message[1]]))
+    
+    @staticmethod
+    def _apply(db_api, method: str, args: tuple, kwargs: dict):
+        if method not in DB_METHODS:
+            return False, f"不支持的操作: {method}"
+        try:
+            return True, _plain(getattr(db_api, method)(*args, **kwargs))
+        except Exception as e:
+            return False, str(e)
+    
+    def stop(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._all)
+        for worker in workers:
+            try:
+                worker.conn.send(("stop",))
+            except (EOFError, OSError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout=2)
+            if worker.process.is_alive():
+                self._kill(worker)
+    
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            alive = sum(1 for worker in self._all if worker.process.is_alive())
+        return {
+            "workers": self.workers,
+            "alive": alive,
+            "idle": self._idle.qsize(),
+            "timeout": self.timeout,
+            "cpu_time": self.cpu_time,
+            "acquire_timeout": self.acquire_timeout,
+            "busy": self.busy,
+            "runs": self.runs,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# 当前的进程池（未启动时为 None）
+pool: Optional[ScriptPool] = None
+
+# 异步任务专用的进程池（未启动时为 None）
+job_pool: Optional[ScriptPool] = None
+
+
+def start_pool(workers: int = 2, timeout: float = 10.0, cpu_time: float = None,
+               acquire_timeout: float = None) -> ScriptPool:
+    """启动进程池，并让 execute_script 交给它执行"""
+    global pool
+    stop_pool()
+    pool = ScriptPool(workers, timeout, cpu_time, acquire_timeout).start()
+    script_eval.set_backend(pool)
+    return pool
+
+
+def start_job_pool(workers: int = 2, timeout: float = 300.0, cpu_time: float = None) -> ScriptPool:
+    """启动异步任务专用的进程池：任务与同步执行、定时任务互不占用工作进程
+    
+    异步任务由 JobStore 的线程池限制并发（不多于 workers 个），在这里一直等待空闲进程即可。
+    """
+    global job_pool
+    stop_job_pool()
+    job_pool = ScriptPool(workers, timeout, cpu_time).start()
+    return job_pool
+
+
+def stop_job_pool():
+    global job_pool
+    if job_pool is not None:
+        job_pool.stop()
+        job_pool = None
+
+
+def stop_pool():
+    """停止进程池，execute_script 恢复为在本进程中执行"""
+    global pool
+    if pool is not None:
+        script_eval.set_backend(None)
+        pool.stop()
+        pool = None
@@ -1,5 +1,5 @@
 #collect dependencies that VSCode extensions can't detect and will alarm
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse
 from fastapi import Request, FastAPI, Query, Cookie
 from fastapi.middleware.cors import CORSMiddleware
 def first_valid(*args):
@@ -1,6 +1,6 @@
 from Common.base import entry
 from .backup import BackupManager
-from .table import Table
+from .table import Table, DURABLE, SNAPSHOT, EPHEMERAL
 from datetime import datetime
 import re
 
@@ -11,6 +11,16 @@ backup_manager = None
 from Common.logger import get_logger
 logger = get_logger("database")
 
+# 在正则中有特殊含义的字符（list_keys 的模式最终按正则匹配）
+_PATTERN_SPECIAL = set("*?.^$+{}[]\\|()")
+
+def _literal_prefix(pattern: str) -> str:
+    """模式开头不含通配符/正则元字符的部分，匹配结果必然以它开头"""
+    for i, ch in enumerate(pattern):
+        if ch in _PATTERN_SPECIAL:
+            return pattern[:i]
+    return pattern
+
 def getmime(entry_key):
     """从主表获取 entry 的 MIME 类型"""
     main_table = Table.of("main")
@@ -37,6 +47,12 @@ class vmAPI:
         else:
             return entry(mime="text", value={"text": str(result or ""), "lastSavedTime": None})
     
+    def get_text(self, key: str):
+        """键当前的文本，键不存在时为 None（get 对不存在的键返回空文本的 entry）"""
+        result = self._text_of(self.main.get(key))
+        self.operations.append(f"GET {key}")
+        return result
+    
     def set(self, key: str, content: str, mime: str = "text") -> bool:
         """设置entry内容"""
         try:
@@ -52,20 +68,34 @@ class vmAPI:
             self.operations.append(f"SET {key} FAILED: {e}")
             return False
     
-    def list_keys(self, pattern: str = None) -> list:
-        """列出所有键，可选择模式匹配"""
-        all_keys = list(self.main.inner.keys())
+    def list_keys(self, pattern: str = None, limit: int = None, after: str = None) -> list:
+        """列出键（按字典序），可选择模式匹配
         
+        Args:
+            pattern: 通配符模式，如 "log_*"；模式开头的字面前缀通过有序索引做范围扫描
+            limit: 最多返回的键数
+            after: 只返回大于该键的键，用上一页最后一个键翻页
+        """
+        prefix = ""
+        regex = None
         if pattern:
-            # 简单的通配符匹配
+            prefix = _literal_prefix(pattern)
+            rest = pattern[len(prefix):]
+            # 简单的通配符匹配；"前缀" 或 "前缀*" 直接由范围扫描得出，无需正则
             pattern = pattern.replace('*', '.*').replace('?', '.')
-            regex = re.compile(pattern)
-            filtered_keys = [key for key in all_keys if regex.match(key)]
-            self.operations.append(f"LIST {pattern} -> {len(filtered_keys)} keys")
-            return filtered_keys
-        else:
-            self.operations.append(f"LIST ALL -> {len(all_keys)} keys")
-            return all_keys
+            if rest not in ("", "*"):
+                regex = re.compile(pattern)
+        
+        keys = []
+        for key in self.main.scan_keys(prefix, after=after):
+            if regex is not None and not regex.match(key):
+                continue
+            keys.append(key)
+            if limit is not None and len(keys) >= limit:
+                break
+        
+        self.operations.append(f"LIST {pattern or 'ALL'} -> {len(keys)} keys")
+        return keys
     
     def exists(self, key: str) -> bool:
         """检查键是否存在"""
@@ -76,9 +106,7 @@ class vmAPI:
     def delete(self, key: str) -> bool:
         """删除entry"""
         try:
-            if key in self.main.inner:
-                del self.main.inner[key]
-                self.main.sync()
+            if self.main.delete(key):
                 self.operations.append(f"DELETE {key}")
                 return True
             else:
@@ -88,6 +116,49 @@ class vmAPI:
             self.operations.append(f"DELETE {key} FAILED: {e}")
             return False
     
+    @staticmethod
+    def _text_of(value):
+        """表中的值对应的文本，键不存在时为 None"""
+        if value is None:
+            return None
+        if isinstance(value, entry):
+            return value.value.get("text") if isinstance(value.value, dict) else None
+        return str(value)
+    
+    @staticmethod
+    def _text_entry(content, mime: str = "text") -> entry:
+        return entry(mime=mime, value={"text": str(content), "lastSavedTime": datetime.now()})
+    
+    def update(self, key: str, fn, mime: str = "text"):
+        """原子地更新entry文本：新文本 = fn(当前文本)，键不存在时传入 None
+        
+        并发的 update 不会互相覆盖，适合计数器等读改写场景。返回新文本，失败时返回 None。
+        """
+        try:
+            result = self.main.update(key, lambda current: self._text_entry(fn(self._text_of(current)), mime))
+            self.operations.append(f"UPDATE {key}")
+            return result.value["text"]
+        except Exception as e:
+            self.operations.append(f"UPDATE {key} FAILED: {e}")
+            return None
+    
+    def compare_and_set(self, key: str, expected, content: str, mime: str = "text") -> bool:
+        """当前文本等于 expected 时才写入 content（expected 为 None 表示要求键不存在）"""
+        current = self.main.get(key)
+        if self._text_of(current) != expected:
+            self.operations.append(f"CAS {key} MISMATCH")
+            return False
+        # 以读到的对象为期望值：期间被其他写入替换时失败
+        result = self.main.compare_and_set(key, current, self._text_entry(content, mime))
+        self.operations.append(f"CAS {key}" if result else f"CAS {key} MISMATCH")
+        return result
+    
+    def setdefault(self, key: str, content: str, mime: str = "text") -> str:
+        """键不存在时写入 content；返回键当前的文本"""
+        result = self.main.setdefault(key, self._text_entry(content, mime))
+        self.operations.append(f"SETDEFAULT {key}")
+        return self._text_of(result)
+    
     def copy(self, from_key: str, to_key: str) -> bool:
         """复制entry"""
         try:
@@ -116,22 +187,71 @@ from .test_cases import load_test_cases
 # load_test_cases(main_table)
 
 def init_backup_system(backup_dir: str = ".backup", max_backups: int = 10, 
-                      backup_interval: int = 600, format: str = "json"):
-    """初始化备份系统"""
+                      backup_interval: int = 600, format: str = "json",
+                      wal: bool = False, wal_sync_mode: str = "group",
+                      delta_every: int = 0, lazy_load: bool = False,
+                      mode: str = "thread", compression: str = None,
+                      memoize: bool = True, workers: int = 0, shard_size: int = 50000,
+                      adaptive: bool = False, min_interval: float = 1.0, max_interval: float = None,
+                      max_dirty_keys: int = 1000, max_overhead: float = 0.02, debounce: float = 0.0,
+                      debounce_keys: int = 100, durabilities: dict = None):
+    """初始化备份系统
+    
+    wal=True 时每次写入都追加到预写日志，启动时在最新快照之上重放，
+    定期快照则用于压缩日志。
+    delta_every>0 时两次全量快照之间只写变更键的增量文件。
+    lazy_load=True 时 line 格式备份只建立索引，记录按需反序列化并在后台预热。
+    mode="fork" 时全量快照由 fork 出的子进程序列化，不占用服务进程的 GIL。
+    compression="gzip" / "lzma" 时全量快照流式压缩写入 backup_*.<ext>.gz / .xz。
+    memoize=True 时缓存各记录的序列化结果，未变化的记录在下次全量快照时直接复用。
+    workers>0 时全量快照按表和键区间切成最多 shard_size 条的分片，由进程池并行读写。
+    adaptive=True 时按快照耗时和脏键速率在 [min_interval, max_interval] 内自适应地选择备份间隔，
+    快照耗时占比不超过 max_overhead、未保存的脏键约不超过 max_dirty_keys；
+    debounce>0 时一阵集中写入（至少 debounce_keys 个脏键）结束 debounce 秒后立即备份（延迟写回）。
+    durabilities 为 {表名: 持久化级别}，在加载备份之前创建这些表并设置级别。
+    """
     global backup_manager
+    # 先声明持久化级别：ephemeral 表不加载备份，其余表加载时需要已经存在
+    for table_name, durability in (durabilities or {}).items():
+        Table.of(table_name, durability=durability)
+    
     backup_manager = BackupManager(
         backup_dir=backup_dir,
         max_backups=max_backups,
         backup_interval=backup_interval,
-        format=format
+        format=format,
+        wal=wal,
+        wal_sync_mode=wal_sync_mode,
+        delta_every=delta_every,
+        lazy_load=lazy_load,
+        mode=mode,
+        compression=compression,
+        memoize=memoize,
+        workers=workers,
+        shard_size=shard_size,
+        adaptive=adaptive,
+        min_interval=min_interval,
+        max_interval=max_interval,
+        max_dirty_keys=max_dirty_keys,
+        max_overhead=max_overhead,
+        debounce=debounce,
+        debounce_keys=debounce_keys
     )
     
     # 启动时加载最新备份
     logger.info("加载最新备份...")
     backup_manager.load_latest_backup(tables)
     
+    # 在快照之上重放 WAL
+    if wal:
+        replayed = backup_manager.replay_wal(tables)
+        logger.info(f"WAL 重放完成: {replayed} 条记录")
+    
     # 启动自动备份
-    logger.info(f"启动自动备份: 目录={backup_dir}, 格式={format}, 间隔={backup_interval}秒")
+    if adaptive:
+        logger.info(f"启动自动备份: 目录={backup_dir}, 格式={format}, 自适应间隔 {min_interval}~{backup_manager.scheduler.max_interval}秒")
+    else:
+        logger.info(f"启动自动备份: 目录={backup_dir}, 格式={format}, 间隔={backup_interval}秒")
     backup_manager.start_auto_backup(tables)
     
     logger.info(f"备份系统初始化完成")
@@ -142,6 +262,7 @@ def stop_backup_system():
     global backup_manager
     if backup_manager:
         backup_manager.stop_auto_backup()
+        backup_manager.close_wal()
         backup_manager = None
         logger.info("备份系统已停止")
 
@@ -164,4 +285,19 @@ def get_backup_info():
     if backup_manager:
         return backup_manager.get_backup_info()
     else:
-        return {"error": "备份系统未初始化"}
\ No newline at end of file
+        return {"error": "备份系统未初始化"}
+
+def restore_backup(backup: str = None, at=None, deltas: bool = True):
+    """把所有表恢复到某个历史备份或时间点（见 BackupManager.restore），服务不停止
+    
+    Args:
+        backup: 备份文件名；为 None 时按 at 选择
+        at: 时间点（datetime、ISO 字符串或 "YYYYmmdd_HHMMSS"），使用该时间之前最新的快照和增量
+        deltas: 是否应用快照之后的增量
+    """
+    global backup_manager
+    if backup_manager:
+        return backup_manager.restore(tables, backup=backup, at=at, deltas=deltas)
+    else:
+        print("备份系统未初始化")
+        return None
@@ -6,18 +6,35 @@
 - 支持 JSON 和 TOML 格式
 """
 
+import gc
+import gzip
+import hashlib
+import io
 import json
+import lzma
 import os
+import shutil
+import signal
 import threading
 import time
+import traceback
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, List, Optional, Any
 
 # 导入 entry 类型用于序列化检查
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from Common.base import entry
+from . import binfmt, diff as backup_diff, sharded
+from .catalog import BackupCatalog, verify_entries
+from .schedule import BackupScheduler
+from .lazy import LazyRecord, LineBackupIndex
+from .serialcache import FORM_BIN, FORM_DICT, FORM_LINE
+from .table import DURABLE, EPHEMERAL, Table, ordered_write_locks
+from .wal import WriteAheadLog
 
 # MIME 类型到 entry 类的映射
 _ENTRY_CLASS_REGISTRY = {}
@@ -28,6 +45,74 @@ try:
 except ImportError:
     TOML_AVAILABLE = False
 
+# 压缩方式 -> 备份文件的附加后缀
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "lzma": ".xz"}
+
+# 增量中删除行（x keyname）解析出的值
+_DELETED = object()
+
+# apply_delta 每批通过 Table.set_many 写入的记录数
+APPLY_BATCH = 1000
+
+# fork 备份子进程最长运行的秒数，超时后强制结束并按失败处理
+FORK_TIMEOUT = 600
+
+
+def open_backup_file(path, mode: str = "rb"):
+    """按后缀打开（可能压缩的）备份文件，读取时边读边解压
+    
+    Args:
+        path: 文件路径
+        mode: "rb" 或 "rt"（文本模式使用 UTF-8）
+    """
+    path = str(path)
+    encoding = "utf-8" if "t" in mode else None
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding=encoding)
+    if path.endswith(".xz"):
+        return lzma.open(path, mode, encoding=encoding)
+    return open(path, mode.replace("t", ""), encoding=encoding)
+
+
+class _CountingWriter(io.RawIOBase):
+    """透传写入并统计字节数和 sha256；可以按表划出区间，分别计算记录数和 sha256"""
+    
+    def __init__(self, stream):
+        self._stream = stream
+        self.count = 0
+        self.sha256 = hashlib.sha256()
+        self.tables = {}              # table_name -> {"records", "offset", "length", "sha256"}
+        self._table = None
+        self._table_digest = None
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._stream.write(data)
+        size = memoryview(data).nbytes
+        self.count += size
+        self.sha256.update(data)
+        if self._table_digest is not None:
+            self._table_digest.update(data)
+        return size
+    
+    def begin_table(self, name: str, records: int, ranged: bool = True):
+        """之后写入的数据属于表 name；ranged=False 时只记录记录数（json / toml 整体写出）"""
+        self.end_table()
+        info = self.tables[name] = {"records": records}
+        if ranged:
+            info["offset"] = self.count
+            self._table = info
+            self._table_digest = hashlib.sha256()
+    
+    def end_table(self):
+        if self._table is not None:
+            self._table["length"] = self.count - self._table["offset"]
+            self._table["sha256"] = self._table_digest.hexdigest()
+            self._table = None
+            self._table_digest = None
+
 
 def register_entry_class(mime: str, entry_class: type):
     """注册 MIME 类型对应的 entry 类
@@ -69,6 +154,8 @@ class CustomJSONEncoder(json.JSONEncoder):
 
 def serialize_value(value):
     """递归序列化值，将 entry 对象转换为字典"""
+    if isinstance(value, LazyRecord):
+        value = value.materialize()
     if isinstance(value, entry):
         # 使用 entry 的 to_dict 方法（可能被子类覆写）
         return value.to_dict()
@@ -90,7 +177,14 @@ def deserialize_value(value):
         if "mime" in value and "value" in value:
             mime_type = value.get("mime")
             entry_class = get_entry_class(mime_type)
-            return entry_class.from_dict(value)
+            restored = entry_class.from_dict(value)
+            # json / toml 中的时间戳是 ISO 字符串，与 line / bin 格式一样还原为 datetime
+            if isinstance(getattr(restored, 'lastModifiedTime', None), str):
+                try:
+                    restored.lastModifiedTime = datetime.fromisoformat(restored.lastModifiedTime)
+                except ValueError:
+                    pass
+            return restored
         # 递归处理嵌套字典
         return {k: deserialize_value(v) for k, v in list(value.items())}
     elif isinstance(value, list):
@@ -102,11 +196,63 @@ def deserialize_value(value):
         return value
 
 
+def restore_entry(mime: str, value, lastModifiedTime=None):
+    """按 MIME 类型重建 entry 对象（走 from_dict，子类可覆写）"""
+    entry_class = get_entry_class(mime)
+    return entry_class.from_dict({
+        "mime": mime,
+        "value": value,
+        "lastModifiedTime": lastModifiedTime
+    })
+
+
+def encode_record_value(value):
+    """把表中的值编码为 (mime, valueline)，line 格式备份与 WAL 共用
+    
+    entry 使用自身的 to_line()；其他值以 mime "raw" 存为单行 JSON。
+    """
+    if isinstance(value, entry):
+        return value.mime, value.to_line()
+    return "raw", json.dumps(value, ensure_ascii=False, separators=(',', ':'), cls=CustomJSONEncoder)
+
+
+def decode_record_value(mime: str, valueline: str):
+    """encode_record_value 的逆操作"""
+    if mime == "raw":
+        return json.loads(valueline)
+    return restore_entry(mime, get_entry_class(mime).from_line(valueline))
+
+
+class _StagingTable:
+    """恢复时的暂存表：备份先完整加载到这里，全部成功后才换入真正的表"""
+    
+    __slots__ = ("inner", "loaded")
+    
+    def __init__(self):
+        self.inner = {}
+        self.loaded = False          # 备份中是否包含这个表
+    
+    def invalidate_index(self):
+        # line 格式读到该表的表头
+        self.loaded = True
+    
+    def replace_all(self, data):
+        self.inner = dict(data)
+        self.loaded = True
+
+
 class BackupManager:
     """数据库备份管理器"""
     
     def __init__(self, backup_dir: str = ".backup", max_backups: int = 10, 
-                 backup_interval: int = 600, format: str = "json"):
+                 backup_interval: int = 600, format: str = "json",
+                 wal: bool = False, wal_sync_mode: str = "group",
+                 delta_every: int = 0, lazy_load: bool = False, warm_up: bool = True,
+                 mode: str = "thread", compression: Optional[str] = None,
+                 memoize: bool = True, workers: int = 0, shard_size: int = 50000,
+                 adaptive: bool = False, min_interval: float = 1.0, max_interval: float = None,
+                 max_dirty_keys: int = 1000, max_overhead: float = 0.02, debounce: float = 0.0,
+                 debounce_keys: int = 100):
         """
         初始化备份管理器
         
@@ -114,7 +260,27 @@ class BackupManager:
             backup_dir: 备份目录
             max_backups: 最大备份文件数量
             backup_interval: 备份间隔（秒），默认600秒（10分钟）
-            format: 备份格式，支持 "json"、"toml" 和 "line"
+            format: 备份格式，支持 "json"、"toml"、"line" 和 "bin"
+            wal: 是否启用预写日志；启用后快照只起日志压缩作用
+            wal_sync_mode: WAL 落盘方式，"group"（组提交）或 "interval"（后台定时）
+            delta_every: 每两个全量快照之间最多写多少个增量文件，0 表示总是全量备份
+            lazy_load: line 格式启动时只建立索引，记录在第一次访问时才反序列化
+            warm_up: 延迟加载后是否在后台线程中预热剩余记录
+            mode: 全量快照的序列化方式，"thread"（备份线程内）或 "fork"（fork 子进程，
+                  不占用服务进程的 GIL；不支持 fork 的平台退回 thread）
+            compression: 全量快照的压缩方式，None、"gzip"（.gz）或 "lzma"（.xz），只用标准库
+            memoize: 是否缓存各记录的序列化结果，下次全量快照时未变化的记录直接复用
+            workers: 大于 0 时全量快照按表和键区间分片，由这么多个工作进程并行序列化，
+                     加载时也并行读取各分片（优先于 mode="fork"）
+            shard_size: 每个分片最多包含的记录数
+            adaptive: 自动备份按快照耗时和脏键速率自适应地选择间隔（见 schedule.py），
+                      此时 backup_interval 只作为 max_interval 的默认值
+            min_interval: 自适应模式 / 延迟写回时两次备份的最小间隔（秒）
+            max_interval: 自适应模式下两次备份的最大间隔，即数据丢失窗口的上限
+            max_dirty_keys: 自适应模式下允许积累的未保存脏键数
+            max_overhead: 自适应模式下快照耗时占总时间的比例上限
+            debounce: 大于 0 时启用延迟写回，集中写入结束这么多秒后立即备份
+            debounce_keys: 未保存的脏键至少有这么多个才算一阵集中写入
         """
         self.backup_dir = Path(backup_dir)
         self.max_backups = max_backups
@@ -124,19 +290,72 @@ class BackupManager:
         # 确保备份目录存在
         self.backup_dir.mkdir(exist_ok=True)
         
+        # 预写日志（快照之间的写入靠它保证不丢失）
+        self.wal = WriteAheadLog(self.backup_dir, sync_mode=wal_sync_mode) if wal else None
+        
+        # 增量备份：delta_<base>_<seq>.txt 只包含自上次备份以来变更/删除的键
+        self.delta_every = delta_every
+        self._base_stamp = None       # 当前增量链所基于的全量快照时间戳
+        self._deltas_since_full = 0
+        
+        # 延迟加载
+        self.lazy_load = lazy_load
+        self.warm_up = warm_up
+        
+        # 全量快照的序列化方式
+        self.mode = mode
+        self._fork_stats = None       # 最近一次 fork 备份的耗时统计
+        
+        # 全量快照的压缩方式（增量文件很小，始终不压缩）
+        self.compression = compression
+        
+        # 序列化结果缓存（缓存本身在各 Table 上），以及最近一次全量快照的命中情况
+        self.memoize = memoize
+        self._memo_stats = None
+        self._memo_totals = {"hits": 0, "misses": 0}
+        
+        # 分片并行快照
+        self.workers = workers
+        self.shard_size = max(1, shard_size)
+        
+        # 全量快照清单（catalog.json），第一次使用时加载
+        self._catalog = None
+        
+        # 同一时间只允许一个恢复任务
+        self._restore_lock = threading.Lock()
+        # 同一时间只写一个备份（自动备份线程与恢复后立即写的快照可能同时进行，而快照按秒命名）
+        self._backup_lock = threading.RLock()
+        
+        # 自动备份的调度（固定间隔或自适应）
+        self.scheduler = BackupScheduler(
+            backup_interval, adaptive=adaptive, min_interval=min_interval,
+            max_interval=max_interval, max_dirty_keys=max_dirty_keys,
+            max_overhead=max_overhead, debounce=debounce, debounce_keys=debounce_keys
+        )
+        
         # 备份线程控制
         self._backup_thread = None
         self._stop_event = threading.Event()
         self._running = False
         
         # 验证格式
-        if self.format not in ["json", "toml", "line"]:
-            raise ValueError("格式必须是 'json'、'toml' 或 'line'")
+        if self.format not in ["json", "toml", "line", "bin"]:
+            raise ValueError("格式必须是 'json'、'toml'、'line' 或 'bin'")
         
         if self.format == "toml" and not TOML_AVAILABLE:
             print("警告: TOML 不可用，使用 JSON 格式")
             self.format = "json"
         
+        if self.compression not in COMPRESSION_SUFFIXES:
+            raise ValueError("compression 必须是 None、'gzip' 或 'lzma'")
+        
+        if self.mode not in ["thread", "fork"]:
+            raise ValueError("mode 必须是 'thread' 或 'fork'")
+        
+        if self.mode == "fork" and not hasattr(os, "fork"):
+            print("警告: 当前平台不支持 fork，使用 thread 模式")
+            self.mode = "thread"
+        
         # 日志开关（默认安静，设置环境变量 TEXUS_BACKUP_VERBOSE=1 开启详细日志）
         self.verbose = str(os.getenv("TEXUS_BACKUP_VERBOSE", "0")).lower() in ("1", "true", "yes", "on")
     
@@ -172,106 +391,615 @@ class BackupManager:
             self._backup_thread.join(timeout=5)
         self._log("自动备份已停止")
     
+    def replay_wal(self, tables_dict: Dict[str, Any]) -> int:
+        """在已加载的快照之上重放预写日志，然后开始记录新的写入"""
+        if self.wal is None:
+            return 0
+        replayed = self.wal.replay(tables_dict)
+        self._log(f"重放 WAL: {replayed} 条记录")
+        # 从此刻起 Table.set / Table.delete 写入日志
+        from .table import Table
+        Table.wal = self.wal
+        return replayed
+    
+    def close_wal(self):
+        """停止记录写入并把日志落盘"""
+        if self.wal is None:
+            return
+        from .table import Table
+        if Table.wal is self.wal:
+            Table.wal = None
+        self.wal.close()
+    
     def _backup_loop(self, tables_dict_or_func):
-        """备份循环"""
+        """备份循环：由调度器决定何时备份"""
+        scheduler = self.scheduler
         while not self._stop_event.is_set():
             # 获取最新的tables字典
             tables_dict = tables_dict_or_func() if callable(tables_dict_or_func) else tables_dict_or_func
+            tables_dict = self._persisted_tables(tables_dict)
             
-            # 检查是否有表需要备份
-            if not hasattr(tables_dict, 'get_tables_need_sync') or tables_dict.get_tables_need_sync():
+            # 检查是否有表需要备份（全量和增量的耗时分别估计）
+            kind = "delta" if self._should_write_delta(tables_dict) else "full"
+            reason = scheduler.due(tables_dict, time.monotonic(), kind)
+            if reason:
+                started = time.monotonic()
                 self.create_backup(tables_dict)
+                scheduler.record(kind, started, time.monotonic(), reason)
             
-            # 等待下次备份
-            self._stop_event.wait(self.backup_interval)
+            # 等待下次检查
+            self._stop_event.wait(scheduler.next_wait())
     
     def create_backup(self, tables_dict: Dict[str, Any]) -> str:
         """
-        创建备份
+        创建备份（多个线程同时调用时依次进行）
         
         Args:
             tables_dict: 表字典，通常是 Database.tables
-            
+        
         Returns:
             备份文件路径
         """
+        with self._backup_lock:
+            return self._create_backup(tables_dict)
+    
+    def _create_backup(self, tables_dict: Dict[str, Any]) -> str:
+        # ephemeral 表（缓存）从不写入备份
+        tables_dict = self._persisted_tables(tables_dict)
+        
+        # 增量链未满时只写变更
+        if self._should_write_delta(tables_dict):
+            return self.create_delta_backup(tables_dict)
+        
+        # 分片模式：全量快照由进程池并行序列化
+        if self.workers > 0:
+            return self.create_backup_sharded(tables_dict)
+        
+        # fork 模式：全量快照交给子进程序列化
+        # （SQLite 等引擎的连接不能跨 fork 使用，存在这类表时本次仍在线程内备份）
+        if self.mode == "fork" and self._fork_safe(tables_dict):
+            return self.create_backup_forked(tables_dict)
+        
         # 如果是 line 格式，调用专门的方法
         if self.format == "line":
             return self.create_backup_line_format(tables_dict)
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"backup_{timestamp}.{self.format}"
-        backup_path = self.backup_dir / filename
+        backup_path = self._full_backup_path(timestamp)
+        
+        # 先封存当前 WAL 段：之后的写入进入新段，快照成功后旧段即可丢弃
+        sealed_wal = self.wal.rotate() if self.wal else None
+        changes = self._take_changes(tables_dict)
+        # 写时复制快照：收集期间的并发写入不会出现在本次备份中，也不会被阻塞
+        snapshots = self._open_snapshots(tables_dict)
         
         try:
-            # 收集所有表的数据 - 直接使用字典，不添加元数据
-            backup_data = {}
-            
-            # 遍历所有表
-            self._log(f"\n开始备份，共 {len(tables_dict)} 个表:")
-            for table_name, table in tables_dict.items():
-                if hasattr(table, 'get_all_data'):
-                    table_data = table.get_all_data()
-                    raw_data = table_data.get("data", {})
-                    entry_count = len(raw_data) if isinstance(raw_data, dict) else 0
-                    self._log(f"  表 {table_name}: {entry_count} 条记录")
-                    
-                    # 直接序列化表数据，不添加额外包装
-                    backup_data[table_name] = serialize_value(raw_data)
-                else:
-                    # 如果没有 get_all_data 方法，使用 inner 属性
-                    inner_data = getattr(table, 'inner', {})
-                    entry_count = len(inner_data) if isinstance(inner_data, dict) else 0
-                    self._log(f"  表 {table_name}: {entry_count} 条记录")
-                    
-                    # 直接序列化
-                    backup_data[table_name] = serialize_value(inner_data)
-            self._log(f"备份数据收集完成，开始保存...")
-            
-            # 保存备份文件
-            if self.format == "json":
-                with open(backup_path, 'w', encoding='utf-8') as f:
-                    json.dump(backup_data, f, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
-            elif self.format == "toml":
-                # TOML 需要先序列化为兼容格式
-                with open(backup_path, 'w', encoding='utf-8') as f:
-                    # 使用 toml 库，它会自动处理多行字符串
-                    # 长文本会自动使用 """ 多行语法
-                    toml.dump(backup_data, f)
-            
+            self._write_full_backup(snapshots, backup_path, self._serial_caches(tables_dict))
+            self._close_snapshots(snapshots)
             self._log(f"+ {backup_path}")
+            self._finish_full_backup(backup_path, sealed_wal)
+            return str(backup_path)
+        except Exception as e:
+            print(f"创建备份失败: {e}")
+            self._close_snapshots(snapshots)
+            self._restore_changes(tables_dict, changes)
+            self._remove_backup_files(backup_path)
+            return None
+    
+    @property
+    def _extension(self) -> str:
+        """全量快照的扩展名（不含压缩后缀）"""
+        return "txt" if self.format == "line" else self.format
+    
+    def _full_backup_path(self, timestamp: str) -> Path:
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+        return self.backup_dir / f"backup_{timestamp}.{self._extension}{suffix}"
+    
+    def _backup_files(self, extension: Optional[str] = None) -> List[Path]:
+        """扫描目录中某种格式的全部全量快照（任意压缩方式），不含临时文件和 sidecar"""
+        extension = extension or self._extension
+        files = []
+        for suffix in COMPRESSION_SUFFIXES.values():
+            files.extend(self.backup_dir.glob(f"backup_*.{extension}{suffix}"))
+        # 分片快照是一个目录，清单写入之后才算完整
+        for directory in self.backup_dir.glob(f"backup_*.{extension}{sharded.SHARDED_SUFFIX}"):
+            if (directory / sharded.MANIFEST).exists():
+                files.append(directory)
+        return files
+    
+    @property
+    def catalog(self) -> BackupCatalog:
+        """备份目录的清单；第一次使用时读取，缺失或损坏时扫描目录重建"""
+        if self._catalog is None:
+            catalog = BackupCatalog(self.backup_dir)
+            if not catalog.loaded:
+                paths = [path for extension in ("txt", "json", "toml", "bin")
+                         for path in self._backup_files(extension)]
+                catalog.rebuild(paths, self._describe_backup)
+            self._catalog = catalog
+        return self._catalog
+    
+    def _is_current_format(self, filename: str) -> bool:
+        """backup_<stamp>.<ext>[.gz|.xz|.d] 是否为当前格式"""
+        parts = filename.split(".")
+        return len(parts) > 1 and parts[1] == self._extension
+    
+    def _describe_backup(self, backup_path: Path) -> Dict[str, Any]:
+        """快照在清单中的条目（来自 .meta 或分片清单；旧版本的快照只有大小）"""
+        if backup_path.is_dir():
+            manifest = sharded.read_manifest(backup_path) or {}
+            size, raw_size = sharded.manifest_sizes(manifest)
+            table_sizes = manifest.get("tables", {})
+            return {
+                "filename": backup_path.name,
+                "format": manifest.get("format"),
+                "compression": manifest.get("compression"),
+                "size": size,
+                "raw_size": raw_size,
+                "records": sum(table_sizes.values()),
+                "tables": {name: {"records": count} for name, count in table_sizes.items()},
+                "shards": [
+                    {key: shard.get(key) for key in ("file", "table", "records", "size", "sha256", "tables")}
+                    for shard in manifest.get("shards", [])
+                ],
+                "created": manifest.get("created"),
+                "complete": bool(manifest),
+            }
+        meta = self._read_meta(backup_path)
+        if not meta:
+            stat = backup_path.stat()
+            compressed = backup_path.suffix in (".gz", ".xz")
+            meta = {
+                "compression": {".gz": "gzip", ".xz": "lzma"}.get(backup_path.suffix),
+                "size": stat.st_size,
+                "raw_size": None if compressed else stat.st_size,
+                "created": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            }
+        return {"filename": backup_path.name, **meta, "complete": True}
+    
+    @staticmethod
+    def _backup_stamp(backup_path: Path) -> str:
+        """backup_<stamp>.<ext>[.gz] -> stamp"""
+        return backup_path.name[len("backup_"):].split(".", 1)[0]
+    
+    @staticmethod
+    def _meta_path(backup_path: Path) -> Path:
+        """记录原始大小等信息的 sidecar"""
+        return backup_path.with_name(backup_path.name + ".meta")
+    
+    @staticmethod
+    def _remove_backup_files(backup_path: Path):
+        """删除备份文件（或分片目录）及其临时文件和 sidecar"""
+        for directory in (backup_path, backup_path.with_name(backup_path.name + ".tmp")):
+            if directory.is_dir():
+                shutil.rmtree(directory, ignore_errors=True)
+        for path in (backup_path, backup_path.with_name(backup_path.name + ".tmp"),
+                     LineBackupIndex.sidecar_path(backup_path), BackupManager._meta_path(backup_path)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+    
+    @contextmanager
+    def _atomic_output(self, backup_path: Path, compression: Optional[str] = None):
+        """流式写入 <backup_path>.tmp，成功后 fsync 并原子地重命名为 backup_path
+        
+        产出的二进制流按 compression 压缩；其 count / sha256 / tables 针对压缩前的数据，
+        disk 属性统计实际写入磁盘的字节。
+        写入过程中出错时删除临时文件，backup_path 上不会出现写了一半的文件。
+        """
+        tmp_path = backup_path.with_name(backup_path.name + ".tmp")
+        raw = open(tmp_path, "wb")
+        try:
+            disk = _CountingWriter(raw)
+            if compression == "gzip":
+                stream = gzip.GzipFile(filename="", mode="wb", fileobj=disk, compresslevel=6)
+            elif compression == "lzma":
+                stream = lzma.LZMAFile(disk, "wb", preset=6)
+            else:
+                stream = disk
+            output = _CountingWriter(stream)
+            output.disk = disk
+            yield output
+            output.end_table()
+            if stream is not disk:
+                # 写入压缩尾部；不会关闭底层文件
+                stream.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+            raw.close()
+            os.replace(tmp_path, backup_path)
+        except BaseException:
+            raw.close()
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+        self._fsync_dir()
+    
+    def _fsync_dir(self):
+        """让目录项（重命名）落盘；不支持目录 fsync 的平台忽略"""
+        try:
+            fd = os.open(self.backup_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    
+    def _serial_caches(self, tables_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """table_name -> 该表的序列化结果缓存；memoize 关闭时为空"""
+        if not self.memoize:
+            return {}
+        return {
+            name: table._serial_cache
+            for name, table in list(tables_dict.items())
+            if hasattr(table, '_serial_cache')
+        }
+    
+    def _write_full_backup(self, snapshots: Dict[str, Any], backup_path: Path,
+                           caches: Optional[Dict[str, Any]] = None):
+        """按当前格式把各表快照流式写入 backup_path（临时文件 + 原子重命名）
+        
+        caches 为 table_name -> SerializedCache，未变化的记录直接复用上次的序列化结果。
+        """
+        caches = caches or {}
+        hits = sum(cache.hits for cache in caches.values())
+        misses = sum(cache.misses for cache in caches.values())
+        with self._atomic_output(backup_path, self.compression) as output:
+            if self.format == "line":
+                index = self._write_line_backup(snapshots, output, caches)
+            elif self.format == "bin":
+                self._write_bin_backup(snapshots, output, caches)
+            else:
+                self._write_structured_backup(snapshots, output, caches)
+        if caches:
+            hits = sum(cache.hits for cache in caches.values()) - hits
+            misses = sum(cache.misses for cache in caches.values()) - misses
+            self._memo_totals["hits"] += hits
+            self._memo_totals["misses"] += misses
+            self._memo_stats = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            }
+        size = output.disk.count
+        if self.format == "line" and self.compression is None:
+            # 偏移量只对未压缩文件有意义
+            LineBackupIndex.write_sidecar(backup_path, size, index)
+        # 清单（catalog.json）根据 .meta 登记快照
+        with open(self._meta_path(backup_path), "w", encoding="utf-8") as f:
+            json.dump({
+                "format": self.format,
+                "compression": self.compression,
+                "size": size,
+                "raw_size": output.count,
+                "sha256": output.disk.sha256.hexdigest(),
+                "records": sum(info["records"] for info in output.tables.values()),
+                "tables": output.tables,
+                "created": datetime.now().isoformat(),
+            }, f, ensure_ascii=False)
+    
+    def _write_structured_backup(self, snapshots: Dict[str, Any], output, caches: Dict[str, Any]):
+        """写入 json / toml 格式的全量备份"""
+        # 收集所有表的数据 - 直接使用字典，不添加元数据
+        backup_data = {}
+        
+        # 遍历所有表
+        self._log(f"\n开始备份，共 {len(snapshots)} 个表:")
+        for table_name, snapshot in snapshots.items():
+            self._log(f"  表 {table_name}: {len(snapshot)} 条记录")
+            output.begin_table(table_name, len(snapshot), ranged=False)
+            cache = caches.get(table_name)
             
-            # 清理旧备份
-            self._cleanup_old_backups()
-            
-            # 标记所有表已备份
-            self._mark_tables_synced(tables_dict)
+            # 直接序列化表数据，不添加额外包装
+            table_data = backup_data[table_name] = {}
+            for keyname, value in snapshot.items():
+                serialized = cache.get(keyname, value, FORM_DICT) if cache is not None else None
+                if serialized is None:
+                    serialized = serialize_value(value)
+                    if cache is not None:
+                        cache.put(keyname, value, FORM_DICT, serialized)
+                table_data[keyname] = serialized
+        self._log(f"备份数据收集完成，开始保存...")
+        
+        # 保存备份文件
+        f = io.TextIOWrapper(io.BufferedWriter(output), encoding='utf-8')
+        if self.format == "json":
+            json.dump(backup_data, f, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
+        elif self.format == "toml":
+            # TOML 需要先序列化为兼容格式
+            # 使用 toml 库，它会自动处理多行字符串
+            # 长文本会自动使用 """ 多行语法
+            toml.dump(backup_data, f)
+        f.flush()
+        f.detach().detach()
+    
+    def _write_bin_backup(self, snapshots: Dict[str, Any], output, caches: Dict[str, Any]):
+        """流式写入 bin 格式的全量备份：逐条编码，不在内存中组装整个备份"""
+        self._log(f"\n开始创建 bin 格式备份，共 {len(snapshots)} 个表:")
+        writer = binfmt.BinWriter(output)
+        for table_name, snapshot in snapshots.items():
+            self._log(f"  表 {table_name}: {len(snapshot)} 条记录")
+            output.begin_table(table_name, len(snapshot))
+            writer.table(table_name)
+            cache = caches.get(table_name)
+            for keyname, value in snapshot.items():
+                if cache is None:
+                    if isinstance(value, LazyRecord):
+                        value = value.materialize()
+                    writer.record(keyname, value)
+                    continue
+                encoded = cache.get(keyname, value, FORM_BIN)
+                if encoded is None:
+                    encoded = binfmt.encode(value.materialize() if isinstance(value, LazyRecord) else value)
+                    cache.put(keyname, value, FORM_BIN, encoded)
+                writer.record_encoded(keyname, encoded)
+        output.end_table()
+        writer.close()
+    
+    def _finish_full_backup(self, backup_path: Path, sealed_wal: Optional[int]):
+        """全量快照写完后：登记到清单、清理旧备份、开始新的增量链、丢弃已封存的 WAL 段"""
+        # 登记即完成标记：快照文件和 .meta 都已落盘
+        self.catalog.add(self._describe_backup(backup_path))
+        
+        # 清理旧备份
+        self._cleanup_old_backups()
+        
+        # 新的增量链从这个全量快照开始
+        self._start_delta_chain(self._backup_stamp(backup_path))
+        
+        # 快照已包含封存段中的全部写入
+        if sealed_wal is not None:
+            self.wal.discard(sealed_wal)
+    
+    @staticmethod
+    def _fork_safe(tables_dict: Dict[str, Any]) -> bool:
+        """所有表都是内存表（inner 为 dict）时才能 fork：其他引擎的连接和锁不能带进子进程"""
+        return all(isinstance(getattr(table, 'inner', None), dict) for table in list(tables_dict.values()))
+    
+    def create_backup_forked(self, tables_dict: Dict[str, Any]) -> str:
+        """
+        BGSAVE 式全量备份：fork 子进程，由子进程在写时复制的内存上序列化
+        
+        父进程只在 fork 的瞬间持有各表的写锁，之后继续处理请求；
+        当前（备份）线程等待子进程退出，再负责清理旧备份、开始新的增量链和丢弃 WAL 段。
+        服务进程是多线程的，fork 时其他线程持有的锁会以持有状态留在子进程里，
+        所以子进程只遍历内存表、不输出日志、不获取任何锁；超过 FORK_TIMEOUT 秒仍未退出时强制结束。
+        
+        Args:
+            tables_dict: 表字典，通常是 Database.tables
+        
+        Returns:
+            备份文件路径
+        
+        Raises:
+            ValueError: 存在非内存表（例如 SQLite 引擎）
+        """
+        if not self._fork_safe(tables_dict):
+            raise ValueError("fork 备份只支持内存表")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_path = self._full_backup_path(timestamp)
+        
+        sealed_wal = self.wal.rotate() if self.wal else None
+        changes = self._take_changes(tables_dict)
+        
+        # fork 时不能有写入进行到一半，否则子进程看到的表可能不完整
+        # 加锁顺序与恢复时换入数据相同（按表名），两者同时进行时不会死锁
+        tables = [table for table in list(tables_dict.values()) if hasattr(table, 'inner')]
+        locks = ordered_write_locks(tables)
+        for lock in locks:
+            lock.acquire()
+        started = time.perf_counter()
+        try:
+            pid = os.fork()
+        except OSError as e:
+            for lock in locks:
+                lock.release()
+            print(f"fork 失败: {e}")
+            self._restore_changes(tables_dict, changes)
+            return None
+        
+        if pid == 0:
+            # 子进程：内存是 fork 时刻的副本，直接遍历各表的 inner
+            exit_code = 1
+            try:
+                # 子进程很快退出，关闭 GC 避免扫描对象头触发大量页复制
+                gc.disable()
+                # print 需要 stdout 的缓冲区锁，它可能被 fork 时的其他线程持有
+                self.verbose = False
+                # 缓存的更新留在子进程里，只读取 fork 之前已有的结果
+                self._write_full_backup({table.name: table.inner for table in tables}, backup_path,
+                                        self._serial_caches(tables_dict))
+                exit_code = 0
+            except BaseException:
+                os.write(2, traceback.format_exc().encode("utf-8", "replace"))
+            finally:
+                os._exit(exit_code)
+        
+        fork_ms = (time.perf_counter() - started) * 1000
+        for lock in locks:
+            lock.release()
+        
+        exit_code = self._wait_child(pid, FORK_TIMEOUT)
+        self._fork_stats = {
+            "pid": pid,
+            "finished": datetime.now().isoformat(),
+            "fork_ms": round(fork_ms, 3),
+            "child_seconds": round(time.perf_counter() - started, 3),
+            "exit_code": exit_code,
+            "backup": str(backup_path),
+        }
+        
+        if exit_code is None:
+            print(f"fork 备份失败: 子进程 {FORK_TIMEOUT} 秒内没有结束，已强制结束")
+            self._restore_changes(tables_dict, changes)
+            self._remove_backup_files(backup_path)
+            return None
+        if exit_code != 0:
+            print(f"fork 备份失败: 子进程退出码 {exit_code}")
+            self._restore_changes(tables_dict, changes)
+            self._remove_backup_files(backup_path)
+            return None
+        
+        self._log(f"+ {backup_path} (fork {fork_ms:.1f} ms, 子进程 {self._fork_stats['child_seconds']} s)")
+        self._finish_full_backup(backup_path, sealed_wal)
+        return str(backup_path)
+    
+    @staticmethod
+    def _wait_child(pid: int, timeout: float) -> Optional[int]:
+        """等待子进程退出并返回退出码；超时时用 SIGKILL 结束它并返回 None"""
+        deadline = time.monotonic() + timeout
+        while True:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                return os.waitstatus_to_exitcode(status)
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        os.waitpid(pid, 0)
+        return None
+    
+    def create_backup_sharded(self, tables_dict: Dict[str, Any]) -> str:
+        """
+        分片全量备份：按表和键区间切分快照，由进程池并行序列化
+        
+        当前线程按键的顺序遍历写时复制快照、切出分片交给工作进程；每个分片是一个
+        普通的全量快照文件，全部写完后写入 manifest.json，再把整个目录原子地重命名。
+        
+        Args:
+            tables_dict: 表字典，通常是 Database.tables
+        
+        Returns:
+            分片目录路径
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_path = self.backup_dir / f"backup_{timestamp}.{self._extension}{sharded.SHARDED_SUFFIX}"
+        tmp_dir = backup_path.with_name(backup_path.name + ".tmp")
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+        
+        sealed_wal = self.wal.rotate() if self.wal else None
+        changes = self._take_changes(tables_dict)
+        snapshots = self._open_snapshots(tables_dict)
+        
+        try:
+            self._remove_backup_files(backup_path)
+            tmp_dir.mkdir()
+            table_sizes = {}
+            futures = []
+            self._log(f"\n开始创建分片备份，共 {len(snapshots)} 个表，{self.workers} 个工作进程:")
+            with sharded.executor(self.workers) as pool:
+                pending = set()
+                for table_name, snapshot in snapshots.items():
+                    table_sizes[table_name] = 0
+                    for chunk in sharded.iter_chunks(snapshot, self.shard_size, self.format):
+                        table_sizes[table_name] += len(chunk)
+                        shard_path = tmp_dir / f"shard_{len(futures):04d}.{self._extension}{suffix}"
+                        future = pool.submit(sharded.write_shard, self.format, self.compression,
+                                             str(shard_path), table_name, chunk)
+                        futures.append(future)
+                        pending.add(future)
+                        # 限制排队中的分片数，快照不会被整个复制到内存里
+                        if len(pending) >= self.workers * 2:
+                            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._log(f"  表 {table_name}: {table_sizes[table_name]} 条记录")
+                shards = [future.result() for future in futures]
+            self._close_snapshots(snapshots)
             
+            sharded.write_manifest(tmp_dir, {
+                "format": self.format,
+                "compression": self.compression,
+                "created": datetime.now().isoformat(),
+                "tables": table_sizes,
+                "shards": shards,
+            })
+            os.replace(tmp_dir, backup_path)
+            self._fsync_dir()
+            self._log(f"+ {backup_path} ({len(shards)} 个分片)")
+            self._finish_full_backup(backup_path, sealed_wal)
             return str(backup_path)
         except Exception as e:
-            print(f"创建备份失败: {e}")
-            if backup_path.exists():
-                backup_path.unlink()
+            print(f"创建分片备份失败: {e}")
+            self._close_snapshots(snapshots)
+            self._restore_changes(tables_dict, changes)
+            self._remove_backup_files(backup_path)
             return None
     
-    def _cleanup_old_backups(self):
-        """清理旧备份文件"""
-        # 根据格式确定文件扩展名
-        if self.format == "line":
-            extension = "txt"
-        else:
-            extension = self.format
+    def load_sharded_backup(self, tables_dict: Dict[str, Any], backup_path: Path) -> bool:
+        """
+        并行读取分片快照的各个分片，全部成功后再替换表内容（不应用增量）
         
-        backup_files = list(self.backup_dir.glob(f"backup_*.{extension}"))
+        Args:
+            tables_dict: 表字典
+            backup_path: 分片目录
         
-        if len(backup_files) <= self.max_backups:
+        Returns:
+            是否成功加载
+        """
+        manifest = sharded.read_manifest(backup_path)
+        if manifest is None:
+            print(f"分片备份缺少清单: {backup_path}")
+            return False
+        self._log(f"加载分片备份: {backup_path} ({len(manifest['shards'])} 个分片)")
+        
+        format = manifest.get("format", self.format)
+        shards = [shard for shard in manifest["shards"] if shard["table"] in tables_dict]
+        backup_data = {table_name: {} for table_name in manifest.get("tables", {})}
+        try:
+            workers = max(1, min(self.workers or os.cpu_count() or 1, len(shards)))
+            with sharded.executor(workers) as pool:
+                futures = [
+                    pool.submit(sharded.read_shard, format, str(backup_path / shard["file"]), shard["table"])
+                    for shard in shards
+                ]
+                # 按清单顺序合并，同一个表的分片键区间互不重叠
+                for shard, future in zip(shards, futures):
+                    records = future.result()
+                    if len(records) != shard["records"]:
+                        raise ValueError(f"分片 {shard['file']} 记录数不符: {len(records)} != {shard['records']}")
+                    backup_data.setdefault(shard["table"], {}).update(records)
+        except Exception as e:
+            print(f"加载分片备份失败: {e}")
+            return False
+        
+        restored_tables = self._replace_tables(tables_dict, backup_data)
+        print(f"成功恢复 {restored_tables} 个表的数据")
+        return True
+    
+    def _cleanup_old_backups(self):
+        """清理旧备份文件（按清单中的创建顺序，不扫描目录）"""
+        entries = self.catalog.matching(self._is_current_format)
+        
+        if len(entries) <= self.max_backups:
             return
         
-        # 按修改时间排序，删除多余的
-        backup_files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-        for file_path in backup_files[self.max_backups:]:
-            file_path.unlink()
+        # 删除最旧的
+        for item in entries[:len(entries) - self.max_backups]:
+            file_path = self.backup_dir / item["filename"]
+            try:
+                if file_path.is_dir():
+                    shutil.rmtree(file_path)
+                else:
+                    file_path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # 仍被延迟加载的 mmap 占用（Windows），下次再清理
+                continue
+            self.catalog.remove(item["filename"])
             self._log(f"- {file_path}")
+            self._remove_backup_files(file_path)
+            # 基准快照不在了，其增量也就无用了
+            base_stamp = self._backup_stamp(file_path)
+            for delta_path in self._delta_files(base_stamp):
+                delta_path.unlink()
+                self._log(f"- {delta_path}")
     
     def _mark_tables_synced(self, tables_dict: Dict[str, Any]):
         """标记所有表已备份"""
@@ -279,83 +1007,553 @@ class BackupManager:
             if hasattr(table, 'mark_synced'):
                 table.mark_synced()
     
+    def _take_changes(self, tables_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """在收集数据之前取出各表的变更集合（之后的写入会记入新的集合）"""
+        return {
+            name: table.take_changes()
+            for name, table in tables_dict.items()
+            if hasattr(table, 'take_changes')
+        }
+    
+    def _restore_changes(self, tables_dict: Dict[str, Any], changes: Dict[str, Any]):
+        """备份失败时放回变更集合，保证下次备份不漏掉它们"""
+        for name, table_changes in changes.items():
+            table = tables_dict.get(name)
+            if table is not None:
+                table.restore_changes(table_changes)
+    
+    @staticmethod
+    def _open_snapshots(tables_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """为每个表打开写时复制快照（不支持快照的表退回到复制 inner）
+        
+        返回 table_name -> 快照；快照与 dict 一样支持 items()、len()、get()。
+        """
+        snapshots = {}
+        for table_name, table in list(tables_dict.items()):
+            if hasattr(table, 'snapshot'):
+                snapshots[table_name] = table.snapshot()
+            elif hasattr(table, 'inner'):
+                snapshots[table_name] = dict(table.inner)
+        return snapshots
+    
+    @staticmethod
+    def _close_snapshots(snapshots: Dict[str, Any]):
+        for snapshot in snapshots.values():
+            if hasattr(snapshot, 'close'):
+                snapshot.close()
+    
+    # ------------------------------------------------------------------
+    # 增量备份
+    # ------------------------------------------------------------------
+    
+    def _delta_files(self, base_stamp: str) -> List[Path]:
+        """按写入顺序列出某个全量快照之后的增量文件"""
+        return sorted(self.backup_dir.glob(f"delta_{base_stamp}_*.txt"))
+    
+    def _base_exists(self, base_stamp: str) -> bool:
+        suffixes = list(COMPRESSION_SUFFIXES.values()) + [sharded.SHARDED_SUFFIX]
+        return any(
+            (self.backup_dir / f"backup_{base_stamp}.{self._extension}{suffix}").exists()
+            for suffix in suffixes
+        )
+    
+    def _should_write_delta(self, tables_dict: Dict[str, Any]) -> bool:
+        """增量链未满、基准快照仍在、且没有表要求整表备份时写增量"""
+        if not self.delta_every or self._base_stamp is None:
+            return False
+        if self._deltas_since_full >= self.delta_every:
+            return False
+        if not self._base_exists(self._base_stamp):
+            return False
+        return not any(getattr(table, '_needs_full', False) for table in tables_dict.values())
+    
+    def create_delta_backup(self, tables_dict: Dict[str, Any]) -> str:
+        """
+        创建增量备份，只写入自上次备份以来变更和删除的键
+        
+        格式与 line 格式相同，另外用 "x keyname" 表示删除：
+        Table tablename timestamp:
+        - 20251108181432 mime keyname valueline
+        x keyname
+        
+        Args:
+            tables_dict: 表字典，通常是 Database.tables
+        
+        Returns:
+            增量文件路径
+        """
+        seq = self._deltas_since_full + 1
+        delta_path = self.backup_dir / f"delta_{self._base_stamp}_{seq:04d}.txt"
+        
+        sealed_wal = self.wal.rotate() if self.wal else None
+        changes = self._take_changes(tables_dict)
+        snapshots = self._open_snapshots(tables_dict)
+        
+        try:
+            lines = []
+            record_count = 0
+            missing = object()
+            for table_name, (changed, deleted, _) in changes.items():
+                if not changed and not deleted:
+                    continue
+                snapshot = snapshots[table_name]
+                table_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+                lines.append(f"Table {table_name} {table_timestamp}:")
+                for keyname in sorted(changed):
+                    value = snapshot.get(keyname, missing)
+                    if value is missing:
+                        # 取出变更后又被删除
+                        deleted = deleted | {keyname}
+                        continue
+                    lines.append(self._format_line_record(keyname, value, table_timestamp))
+                    record_count += 1
+                for keyname in sorted(deleted):
+                    lines.append(f"x {self._escape_key(keyname)}")
+                    record_count += 1
+                lines.append("")
+            self._close_snapshots(snapshots)
+            
+            with self._atomic_output(delta_path) as output:
+                output.write('\n'.join(lines).encode('utf-8'))
+            
+            self._deltas_since_full = seq
+            self._log(f"+ {delta_path} ({record_count} 条变更)")
+            
+            if sealed_wal is not None:
+                self.wal.discard(sealed_wal)
+            
+            return str(delta_path)
+        except Exception as e:
+            print(f"创建增量备份失败: {e}")
+            self._close_snapshots(snapshots)
+            self._restore_changes(tables_dict, changes)
+            if delta_path.exists():
+                delta_path.unlink()
+            return None
+    
+    def _start_delta_chain(self, base_stamp: str):
+        """全量快照写完后开始新的增量链
+        
+        同一秒内的全量快照会覆盖同名文件，旧链上的增量必须一并删除。
+        """
+        for delta_path in self._delta_files(base_stamp):
+            delta_path.unlink()
+        self._base_stamp = base_stamp
+        self._deltas_since_full = 0
+    
+    def _apply_deltas(self, tables_dict: Dict[str, Any], base_stamp: str) -> int:
+        """按顺序把某个全量快照之后的增量文件应用到 tables_dict，并在其后继续这条增量链"""
+        applied = self._apply_deltas_until(tables_dict, base_stamp)
+        self._base_stamp = base_stamp
+        self._deltas_since_full = applied
+        return applied
+    
+    def _apply_deltas_until(self, tables_dict: Dict[str, Any], base_stamp: str,
+                            until: Optional[datetime] = None) -> int:
+        """按顺序应用某个全量快照之后、until 之前写入的增量文件（until 为 None 时全部应用）"""
+        applied = 0
+        for delta_path in self._delta_files(base_stamp):
+            if until is not None and self._delta_time(delta_path) > until:
+                break
+            with open(delta_path, 'r', encoding='utf-8') as f:
+                self._apply_line_records(f, tables_dict)
+            applied += 1
+            self._log(f"  应用增量: {delta_path.name}")
+        return applied
+    
+    @staticmethod
+    def _delta_time(delta_path: Path) -> datetime:
+        """增量文件的写入时间：第一个表头中的时间戳，没有表头时用文件的修改时间"""
+        with open(delta_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith("Table "):
+                    parts = line.split()
+                    if len(parts) >= 3:
+                        try:
+                            return datetime.strptime(parts[2].rstrip(':'), "%Y%m%d%H%M%S")
+                        except ValueError:
+                            pass
+                    break
+        return datetime.fromtimestamp(delta_path.stat().st_mtime)
+    
     def load_latest_backup(self, tables_dict: Dict[str, Any]) -> bool:
         """
         加载最新备份
         
         Args:
             tables_dict: 表字典
-            
+        
         Returns:
             是否成功加载
         """
-        # 如果是 line 格式，调用专门的方法
-        if self.format == "line":
-            return self.load_backup_line_format(tables_dict)
+        # 已持久化且非空的表（例如 SQLite 引擎）本身就是最新数据，不用备份覆盖
+        tables_dict = self._restore_targets(tables_dict)
         
-        # 查找最新备份文件
-        backup_files = list(self.backup_dir.glob(f"backup_*.{self.format}"))
-        if not backup_files:
+        # 按清单从新到旧尝试：截断或已标记损坏的快照只做 stat 就跳过，不扫描目录
+        found = False
+        for item in self.catalog.latest_valid(self._is_current_format):
+            found = True
+            backup_path = self.backup_dir / item["filename"]
+            if not self._load_full_backup(tables_dict, backup_path):
+                self.catalog.mark_corrupt(item["filename"], "加载失败")
+                continue
+            # 应用该快照之后的增量
+            self._apply_deltas(tables_dict, self._backup_stamp(backup_path))
+            return True
+        
+        if found:
+            print("没有可以加载的完整备份")
+        else:
             self._log("没有找到备份文件")
+        return False
+    
+    def _load_full_backup(self, tables_dict: Dict[str, Any], backup_path: Path, lazy: bool = None) -> bool:
+        """加载一个全量快照（不应用增量）；文件不完整时整体放弃，不会只恢复一部分
+        
+        lazy 为 None 时按 lazy_load 决定 line 格式是否延迟加载。
+        """
+        # 分片快照：由工作进程并行读取
+        if backup_path.is_dir():
+            return self.load_sharded_backup(tables_dict, backup_path)
+        
+        if self.format == "line":
+            return self._load_line_backup(tables_dict, backup_path, lazy)
+        
+        self._log(f"加载最新备份: {backup_path}")
+        try:
+            backup_data = self._read_backup_tables(backup_path)
+        except (OSError, EOFError, ValueError, lzma.LZMAError) as e:
+            print(f"加载 {self.format} 格式备份失败: {e}")
             return False
         
-        # 按修改时间排序，获取最新的
-        latest_backup = max(backup_files, key=lambda x: x.stat().st_mtime)
-        self._log(f"加载最新备份: {latest_backup}")
+        restored_tables = self._replace_tables(tables_dict, backup_data)
+        print(f"成功恢复 {restored_tables} 个表的数据")
+        return True
+    
+    def _read_backup_tables(self, backup_path: Path) -> Dict[str, Dict[str, Any]]:
+        """读取 json / toml / bin 格式的全量快照，返回 table_name -> {key: value}"""
+        if self.format == "bin":
+            # 值带有显式类型，无需 deserialize_value
+            with open_backup_file(backup_path, "rb") as f:
+                return binfmt.read_tables(f)
         
-        # 加载备份数据
-        with open(latest_backup, 'r', encoding='utf-8') as f:
+        # 加载备份数据（压缩文件边读边解压）
+        with open_backup_file(backup_path, 'rt') as f:
             backup_data = json.load(f) if self.format == "json" else toml.load(f)
         
-        # 恢复表数据
-        restored_tables = 0
-        
         # 兼容旧格式（有 "tables" 键）和新格式（直接是表数据）
         if "tables" in backup_data and isinstance(backup_data.get("tables"), dict):
             # 旧格式兼容
-            tables_data = backup_data["tables"]
-            for table_name, table_data in tables_data.items():
-                if table_name in tables_dict:
-                    table = tables_dict[table_name]
-                    if hasattr(table, 'inner'):
-                        table.inner = deserialize_value(table_data.get("data", {}))
-                    restored_tables += 1
-        else:
-            # 新格式：直接是表名到数据的映射
-            for table_name, table_data in backup_data.items():
-                if table_name in tables_dict:
-                    table = tables_dict[table_name]
-                    if hasattr(table, 'inner'):
-                        table.inner = deserialize_value(table_data)
-                    restored_tables += 1
+            return {
+                table_name: deserialize_value(table_data.get("data", {}))
+                for table_name, table_data in backup_data["tables"].items()
+            }
+        # 新格式：直接是表名到数据的映射
+        return {table_name: deserialize_value(table_data) for table_name, table_data in backup_data.items()}
+    
+    @staticmethod
+    def _replace_tables(tables_dict: Dict[str, Any], backup_data: Dict[str, Dict[str, Any]]) -> int:
+        """用备份数据整体替换已存在的表，返回恢复的表数"""
+        restored_tables = 0
+        for table_name, table_data in backup_data.items():
+            if table_name in tables_dict:
+                table = tables_dict[table_name]
+                if hasattr(table, 'replace_all'):
+                    table.replace_all(table_data)
+                elif hasattr(table, 'inner'):
+                    table.inner = table_data
+                restored_tables += 1
+        return restored_tables
+    
+    @staticmethod
+    def _persisted_tables(tables_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """需要备份的表：去掉持久化级别为 ephemeral 的表"""
+        return {
+            table_name: table for table_name, table in list(tables_dict.items())
+            if getattr(table, 'durability', DURABLE) != EPHEMERAL
+        }
+    
+    def _restore_targets(self, tables_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """启动加载备份时需要恢复的表：跳过 ephemeral 表和已有数据的持久化引擎"""
+        targets = {}
+        for table_name, table in self._persisted_tables(tables_dict).items():
+            inner = getattr(table, 'inner', None)
+            if getattr(inner, 'persistent', False) and len(inner):
+                self._log(f"  表 {table_name} 使用持久化存储，跳过备份加载")
+                continue
+            targets[table_name] = table
+        return targets
+    
+    def restore(self, tables_dict: Dict[str, Any], backup: str = None, at=None,
+                deltas: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        在不停止服务的情况下，把表恢复到某个历史备份（或某个时间点）的状态
         
-        print(f"成功恢复 {restored_tables} 个表的数据")
-        return True
+        备份先流式加载到暂存表（不持有任何表锁，读写照常进行），全部成功后
+        在所有目标表的写锁内一次性换入；随后立即写一个新的全量快照，
+        使恢复后的状态成为最新备份（恢复前的 WAL 段随之丢弃，重启后不会被覆盖）。
+        只替换备份中包含的表。
+        
+        Args:
+            tables_dict: 表字典
+            backup: 备份文件名（见 list_backups()）；为 None 时按 at 选择
+            at: 时间点（datetime、ISO 字符串或 "YYYYmmdd_HHMMSS"）：选择该时间之前最新的有效快照，
+                且只应用该时间之前写入的增量；backup 和 at 都为 None 时恢复到最新的有效快照
+            deltas: 是否应用快照之后的增量
+        
+        Returns:
+            {"backup", "deltas", "tables", "records", "snapshot"}；加载失败时返回 None
+        
+        Raises:
+            ValueError: 参数无效或找不到符合条件的备份
+            RuntimeError: 已有恢复任务在进行
+        """
+        at = self._parse_point_in_time(at)
+        item = self._select_restore_backup(backup, at)
+        if not self._restore_lock.acquire(blocking=False):
+            raise RuntimeError("已有恢复任务在进行")
+        try:
+            backup_path = self.backup_dir / item["filename"]
+            self._log(f"恢复备份: {backup_path}")
+            
+            # 逐条流式读入暂存表；不使用延迟加载，恢复后的数据不依赖备份文件继续存在
+            staging = {table_name: _StagingTable() for table_name in self._persisted_tables(tables_dict)}
+            if not self._load_full_backup(staging, backup_path, lazy=False):
+                self.catalog.mark_corrupt(item["filename"], "加载失败")
+                return None
+            applied = self._apply_deltas_until(staging, self._backup_stamp(backup_path), at) if deltas else 0
+            
+            restored = {table_name: table.inner for table_name, table in staging.items() if table.loaded}
+            self._swap_tables(tables_dict, restored)
+            print(f"已恢复到 {item['filename']}（{applied} 个增量），共 {len(restored)} 个表")
+            
+            # sync() 要求整表备份，下面一定写全量快照
+            for table_name in restored:
+                if hasattr(tables_dict[table_name], 'sync'):
+                    tables_dict[table_name].sync()
+            snapshot = self.create_backup(tables_dict)
+            if snapshot is None:
+                print("警告: 恢复后的全量快照写入失败，将在下次自动备份时重试")
+            
+            return {
+                "backup": item["filename"],
+                "deltas": applied,
+                "tables": sorted(restored),
+                "records": sum(len(data) for data in restored.values()),
+                "snapshot": Path(snapshot).name if snapshot else None,
+            }
+        finally:
+            self._restore_lock.release()
+    
+    @staticmethod
+    def _parse_point_in_time(at) -> Optional[datetime]:
+        """把 restore() 的 at 参数转换为本地时间的 naive datetime"""
+        if at is None or at == "":
+            return None
+        if isinstance(at, str):
+            try:
+                at = datetime.strptime(at, "%Y%m%d_%H%M%S")
+            except ValueError:
+                try:
+                    at = datetime.fromisoformat(at)
+                except ValueError:
+                    raise ValueError(f"无法解析时间点: {at}")
+        if not isinstance(at, datetime):
+            raise ValueError(f"无法解析时间点: {at!r}")
+        if at.tzinfo is not None:
+            at = at.astimezone().replace(tzinfo=None)
+        return at
+    
+    def _select_restore_backup(self, backup: Optional[str], at: Optional[datetime]) -> Dict[str, Any]:
+        """按文件名或时间点在清单中选出要恢复的全量快照"""
+        if backup is not None:
+            item = self.catalog.get(Path(backup).name)
+            if item is None or not self._is_current_format(item["filename"]):
+                raise ValueError(f"没有找到 {self.format} 格式的备份: {backup}")
+            if not item.get("complete") or item.get("corrupt"):
+                raise ValueError(f"备份不完整或已损坏: {backup}")
+            return item
+        
+        for item in self.catalog.latest_valid(self._is_current_format):
+            if at is None or self._stamp_time(item["filename"]) <= at:
+                return item
+        raise ValueError("没有符合条件的有效备份" + (f"（{at.isoformat()} 之前）" if at else ""))
+    
+    @classmethod
+    def _stamp_time(cls, filename: str) -> datetime:
+        """全量快照文件名中的时间戳"""
+        return datetime.strptime(cls._backup_stamp(Path(filename)), "%Y%m%d_%H%M%S")
+    
+    @staticmethod
+    def _swap_tables(tables_dict: Dict[str, Any], backup_data: Dict[str, Dict[str, Any]]):
+        """持有全部目标表的写锁（按 ordered_write_locks 的顺序获取）时整体替换，期间的写入等待换入完成"""
+        targets = [tables_dict[table_name] for table_name in backup_data if table_name in tables_dict]
+        with ExitStack() as stack:
+            for lock in ordered_write_locks(targets):
+                stack.enter_context(lock)
+            BackupManager._replace_tables(tables_dict, backup_data)
     
     def list_backups(self) -> List[Dict[str, Any]]:
-        """列出所有备份文件"""
-        # 根据格式确定文件扩展名
-        if self.format == "line":
-            extension = "txt"
-        else:
-            extension = self.format
+        """列出所有备份文件
         
-        backup_files = list(self.backup_dir.glob(f"backup_*.{extension}"))
+        size 为磁盘上的（压缩后）大小，raw_size 为压缩前的大小。
+        """
         backups = []
-        for file_path in backup_files:
-            stat = file_path.stat()
-            backups.append({
-                "filename": file_path.name,
-                "path": str(file_path),
-                "size": stat.st_size,
-                "created": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat()
-            })
-        
-        # 按修改时间排序
-        backups.sort(key=lambda x: x["modified"], reverse=True)
+        # 清单按创建顺序排列，最新的在最后
+        for item in reversed(self.catalog.entries or []):
+            info = {
+                "filename": item["filename"],
+                "path": str(self.backup_dir / item["filename"]),
+                "size": item.get("size"),
+                "raw_size": item.get("raw_size"),
+                "compression": item.get("compression"),
+                "records": item.get("records"),
+                "created": item.get("created"),
+                "modified": item.get("created"),
+                "complete": bool(item.get("complete")),
+                "corrupt": item.get("corrupt"),
+            }
+            if "shards" in item:
+                info["shards"] = len(item["shards"])
+            backups.append(info)
         return backups
     
+    def verify_backups(self, workers: int = None) -> List[Dict[str, Any]]:
+        """
+        并行校验清单中所有快照的大小和 sha256，结果写回清单（损坏的之后加载时跳过）
+        
+        Args:
+            workers: 校验线程数，None 时按 CPU 数
+        
+        Returns:
+            每个快照一个结果 {"filename", "ok", "problems"}
+        """
+        results = verify_entries(self.backup_dir, list(self.catalog.entries or []), workers)
+        for result in results:
+            if result["ok"]:
+                self.catalog.mark_verified(result["filename"])
+            else:
+                self.catalog.mark_corrupt(result["filename"], "; ".join(result["problems"]))
+        return results
+    
+    def _resolve_backup(self, backup: str) -> Path:
+        """文件名（相对于备份目录）或路径 -> 快照路径"""
+        path = Path(backup)
+        if not path.exists():
+            path = self.backup_dir / backup
+        if not path.exists():
+            raise ValueError(f"备份不存在: {backup}")
+        return path
+    
+    def diff(self, a: str, b: str, delta_path: str = None, max_keys: int = 100,
+             on_change: Callable[[str, str, str], None] = None) -> Dict[str, Any]:
+        """
+        比较两个全量快照（line / bin 格式，可以是压缩文件或分片快照）
+        
+        两个快照按键归并比较，各顺序读一遍，内存占用与快照大小无关。
+        
+        Args:
+            a: 旧快照的文件名（相对于备份目录）或路径
+            b: 新快照的文件名或路径
+            delta_path: 指定时把差异写成增量文件（与 delta_*.txt 格式相同），
+                        用 apply_delta() 应用到 a 的数据上得到 b
+            max_keys: 每个表每类变化最多列出的键数（计数不受限制）
+            on_change: 每个差异调用一次 on_change(op, table, key)，op 为 "+" / "-" / "~"
+        
+        Returns:
+            {"a", "b", "added", "removed", "changed", "delta",
+             "tables": {table: {"added", "removed", "changed", "keys": {"added": [...], ...}}}}
+        
+        Raises:
+            ValueError: 快照不存在、格式不支持，或记录没有按键排序
+        """
+        path_a, path_b = self._resolve_backup(a), self._resolve_backup(b)
+        names = {backup_diff.ADDED: "added", backup_diff.REMOVED: "removed", backup_diff.CHANGED: "changed"}
+        result = {"a": path_a.name, "b": path_b.name, "added": 0, "removed": 0, "changed": 0,
+                  "delta": str(delta_path) if delta_path else None, "tables": {}}
+        
+        with ExitStack() as stack:
+            output = stack.enter_context(self._atomic_output(Path(delta_path))) if delta_path else None
+            current_table = None
+            table_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+            for op, table_name, keyname, parts in backup_diff.iter_diff(path_a, path_b):
+                name = names[op]
+                stats = result["tables"].get(table_name)
+                if stats is None:
+                    stats = result["tables"][table_name] = {
+                        "added": 0, "removed": 0, "changed": 0,
+                        "keys": {"added": [], "removed": [], "changed": []},
+                    }
+                stats[name] += 1
+                result[name] += 1
+                if len(stats["keys"][name]) < max_keys:
+                    stats["keys"][name].append(keyname)
+                if on_change is not None:
+                    on_change(op, table_name, keyname)
+                if output is None:
+                    continue
+                
+                if table_name != current_table:
+                    # 表之间空一行
+                    separator = "\n\n" if current_table else ""
+                    output.write(f"{separator}Table {table_name} {table_timestamp}:".encode("utf-8"))
+                    current_table = table_name
+                if parts is None:
+                    line = f"x {self._escape_key(keyname)}"
+                else:
+                    record_timestamp, mime, valueline = parts
+                    line = f"- {record_timestamp or table_timestamp} {mime} {self._escape_key(keyname)} {valueline}"
+                output.write(("\n" + line).encode("utf-8"))
+            if output is not None and current_table:
+                output.write(b"\n")
+        
+        return result
+    
+    def apply_delta(self, tables_dict: Dict[str, Any], delta_path: str) -> int:
+        """
+        把一个增量文件（例如 diff() 写出的差异）应用到 tables_dict
+        
+        与普通写入相同，通过 Table.set_many / Table.delete 写入：照常记 WAL、更新键索引、
+        让打开的快照保留旧值，并记为脏键，下次备份（增量或全量）会包含这些变更。
+        每 APPLY_BATCH 条写入一批，最后只等待一次日志落盘。
+        
+        Returns:
+            应用的记录数
+        """
+        applied = 0
+        lsn = None
+        batch = []
+        batch_table = None
+        
+        def flush():
+            nonlocal lsn, batch
+            if batch:
+                lsn = batch_table.set_many(batch, wait=False) or lsn
+                batch = []
+        
+        with open(delta_path, 'r', encoding='utf-8') as f:
+            for table, keyname, value in self._iter_line_records(f, tables_dict):
+                if table is not batch_table or len(batch) >= APPLY_BATCH:
+                    flush()
+                    batch_table = table
+                if value is _DELETED:
+                    # 同一个增量中每个键只出现一次，先写入的批次与这次删除互不影响
+                    table.delete(keyname)
+                else:
+                    batch.append((keyname, value))
+                applied += 1
+        flush()
+        Table.wait_durable(lsn)
+        return applied
+    
+    def _read_meta(self, backup_path: Path) -> Dict[str, Any]:
+        """读取备份的 .meta sidecar；不存在或损坏时返回空字典"""
+        try:
+            with open(self._meta_path(backup_path), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
     def get_backup_info(self) -> Dict[str, Any]:
         """获取备份系统信息"""
         backups = self.list_backups()
@@ -366,7 +1564,20 @@ class BackupManager:
             "backup_interval": self.backup_interval,
             "running": self._running,
             "total_backups": len(backups),
-            "latest_backup": backups[0] if backups else None
+            "compression": self.compression,
+            "total_size": sum(backup["size"] or 0 for backup in backups),
+            "total_raw_size": sum(backup["raw_size"] or 0 for backup in backups),
+            "latest_backup": backups[0] if backups else None,
+            "wal": self.wal.info() if self.wal else None,
+            "mode": self.mode,
+            "fork": self._fork_stats,
+            "workers": self.workers,
+            "memo": {
+                "enabled": self.memoize,
+                "last_backup": self._memo_stats,
+                **self._memo_totals,
+            },
+            "schedule": self.scheduler.info(),
         }
     
     def create_backup_line_format(self, tables_dict: Dict[str, Any]) -> str:
@@ -385,182 +1596,263 @@ class BackupManager:
         
         Args:
             tables_dict: 表字典，通常是 Database.tables
-            
+        
         Returns:
             备份文件路径
         """
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"backup_{timestamp}.txt"
-        backup_path = self.backup_dir / filename
+        backup_path = self._full_backup_path(timestamp)
+        
+        sealed_wal = self.wal.rotate() if self.wal else None
+        changes = self._take_changes(tables_dict)
+        snapshots = self._open_snapshots(tables_dict)
         
         try:
-            lines = []
-            self._log(f"\n开始创建 line 格式备份，共 {len(tables_dict)} 个表:")
-            
-            # 遍历所有表
-            for table_name, table in tables_dict.items():
-                if hasattr(table, 'get_all_data'):
-                    table_data = table.get_all_data()
-                    raw_data = table_data.get("data", {})
-                elif hasattr(table, 'inner'):
-                    raw_data = table.inner
-                else:
-                    continue
-                
-                entry_count = len(raw_data) if isinstance(raw_data, dict) else 0
-                self._log(f"  表 {table_name}: {entry_count} 条记录")
-                
-                if not raw_data:
-                    continue
-                
-                # 添加表头
-                table_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                lines.append(f"Table {table_name} {table_timestamp}:")
-                
-                # 添加每条记录
-                for keyname, value in raw_data.items():
-                    # 记录的时间戳（如果 value 是 entry 对象，可能有 lastModifiedTime）
-                    if isinstance(value, entry):
-                        if hasattr(value, 'lastModifiedTime') and value.lastModifiedTime:
-                            if isinstance(value.lastModifiedTime, datetime):
-                                record_timestamp = value.lastModifiedTime.strftime("%Y%m%d%H%M%S")
-                            else:
-                                # 如果是字符串，尝试解析
-                                try:
-                                    dt = datetime.fromisoformat(value.lastModifiedTime)
-                                    record_timestamp = dt.strftime("%Y%m%d%H%M%S")
-                                except:
-                                    record_timestamp = table_timestamp
-                        else:
-                            record_timestamp = table_timestamp
-                        
-                        mime = value.mime
-                        valueline = value.to_line()
-                    else:
-                        # 如果不是 entry 对象，直接序列化
-                        record_timestamp = table_timestamp
-                        mime = "raw"
-                        import json
-                        valueline = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
-                    
-                    # 转义 keyname 中的空格
-                    keyname_escaped = keyname.replace(" ", "\\ ")
-                    lines.append(f"- {record_timestamp} {mime} {keyname_escaped} {valueline}")
-                
-                # 添加空行分隔表
-                lines.append("")
-            
-            # 写入文件
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(lines))
-            
+            self._write_full_backup(snapshots, backup_path, self._serial_caches(tables_dict))
+            self._close_snapshots(snapshots)
             self._log(f"+ {backup_path}")
-            
-            # 清理旧备份
-            self._cleanup_old_backups()
-            
-            # 标记所有表已备份
-            self._mark_tables_synced(tables_dict)
-            
+            self._finish_full_backup(backup_path, sealed_wal)
             return str(backup_path)
         except Exception as e:
             print(f"创建 line 格式备份失败: {e}")
             import traceback
             traceback.print_exc()
-            if backup_path.exists():
-                backup_path.unlink()
+            self._close_snapshots(snapshots)
+            self._restore_changes(tables_dict, changes)
+            self._remove_backup_files(backup_path)
             return None
     
+    def _write_line_backup(self, snapshots: Dict[str, Any], output,
+                           caches: Dict[str, Any]) -> Dict[str, List[list]]:
+        """逐行写入 line 格式的全量备份，返回记录索引
+        
+        索引供延迟加载使用：table -> [[key, offset, length, mime, timestamp], ...]，
+        偏移量是未压缩数据中的位置。
+        """
+        index = {}
+        # 第一行之前没有换行符，之后每行前写一个（与按 '\n' 拼接的结果相同）
+        separator = b""
+        self._log(f"\n开始创建 line 格式备份，共 {len(snapshots)} 个表:")
+        
+        # 遍历所有表
+        for table_name, snapshot in snapshots.items():
+            entry_count = len(snapshot)
+            self._log(f"  表 {table_name}: {entry_count} 条记录")
+            output.begin_table(table_name, entry_count)
+            
+            if not entry_count:
+                continue
+            
+            # 添加表头
+            table_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+            output.write(separator + f"Table {table_name} {table_timestamp}:".encode("utf-8"))
+            separator = b"\n"
+            table_index = index.setdefault(table_name, [])
+            cache = caches.get(table_name)
+            
+            # 添加每条记录
+            for keyname, value in snapshot.items():
+                parts = cache.get(keyname, value, FORM_LINE) if cache is not None else None
+                if parts is None:
+                    parts = self._encoded_line_parts(value)
+                    if cache is not None:
+                        cache.put(keyname, value, FORM_LINE, parts)
+                own_timestamp, mime, value_bytes = parts
+                record_timestamp = own_timestamp or table_timestamp
+                prefix = f"\n- {record_timestamp} {mime} {self._escape_key(keyname)} ".encode("utf-8")
+                table_index.append([keyname, output.count + len(prefix), len(value_bytes), mime, record_timestamp])
+                output.write(prefix + value_bytes)
+            
+            # 添加空行分隔表
+            output.write(b"\n")
+        
+        return index
+    
     def load_backup_line_format(self, tables_dict: Dict[str, Any], backup_path: str = None) -> bool:
         """
         从 line 格式备份恢复数据
         
         Args:
             tables_dict: 表字典
-            backup_path: 备份文件路径，如果为 None 则加载最新的
-            
+            backup_path: 备份文件路径，如果为 None 则加载最新的有效快照（并应用其后的增量）
+        
         Returns:
             是否成功加载
         """
+        if backup_path is None:
+            return self.load_latest_backup(tables_dict)
+        return self._load_line_backup(tables_dict, Path(backup_path))
+    
+    def _load_line_backup(self, tables_dict: Dict[str, Any], backup_path: Path, lazy: bool = None) -> bool:
+        """加载一个 line 格式快照文件（不应用增量）"""
+        if lazy is None:
+            lazy = self.lazy_load
         try:
-            # 如果没有指定路径，找最新的 txt 备份
-            if backup_path is None:
-                backup_files = list(self.backup_dir.glob("backup_*.txt"))
-                if not backup_files:
-                    self._log("没有找到 line 格式备份文件")
-                    return False
-                backup_path = max(backup_files, key=lambda x: x.stat().st_mtime)
-            else:
-                backup_path = Path(backup_path)
-            
             self._log(f"加载 line 格式备份: {backup_path}")
             
-            # 读取文件
-            with open(backup_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            lines = content.split('\n')
-            
-            current_table = None
-            restored_count = 0
-            
-            for line in lines:
-                line = line.strip()
-                
-                if not line:
-                    # 空行，表分隔
-                    current_table = None
-                    continue
-                
-                if line.startswith("Table "):
-                    # 表头: Table tablename timestamp:
-                    parts = line.split()
-                    if len(parts) >= 3:
-                        table_name = parts[1]
-                        # timestamp = parts[2].rstrip(':')
-                        
-                        if table_name in tables_dict:
-                            current_table = tables_dict[table_name]
-                            self._log(f"  恢复表: {table_name}")
-                        else:
-                            self._log(f"  警告: 表 {table_name} 不存在，跳过")
-                            current_table = None
-                    continue
-                
-                if line.startswith("- ") and current_table is not None:
-                    # 数据行: - 20251108181432 mime keyname valueline
-                    parts = line[2:].split(' ', 3)  # 跳过 "- "，然后分割成 4 部分
-                    
-                    if len(parts) >= 4:
-                        record_timestamp = parts[0]
-                        mime = parts[1]
-                        keyname = parts[2].replace("\\ ", " ")  # 反转义
-                        valueline = parts[3]
-                        
-                        # 恢复 value
-                        entry_class = get_entry_class(mime)
-                        value_data = entry_class.from_line(valueline)
-                        
-                        # 创建 entry 对象
-                        entry_obj = entry_class(mime=mime, value=value_data)
-                        
-                        # 设置 lastModifiedTime
-                        try:
-                            dt = datetime.strptime(record_timestamp, "%Y%m%d%H%M%S")
-                            entry_obj.lastModifiedTime = dt
-                        except:
-                            pass
-                        
-                        # 存入表
-                        if hasattr(current_table, 'inner'):
-                            current_table.inner[keyname] = entry_obj
-                            restored_count += 1
+            if lazy and backup_path.suffix == ".txt":
+                # 只建立索引（优先读取 sidecar），记录在首次访问时反序列化
+                index = LineBackupIndex.open(backup_path)
+                restored_count = index.install(tables_dict, log=self._log)
+                if self.warm_up:
+                    index.start_warm_up(tables_dict)
+            else:
+                # 逐行流式读取（压缩文件无法按偏移量映射，延迟加载时也走这里）；
+                # 先读入暂存表，整个文件解析成功后才换入，损坏的文件不会留下一部分数据
+                staging = {table_name: _StagingTable() for table_name in tables_dict}
+                with open_backup_file(backup_path, 'rt') as f:
+                    restored_count = self._apply_line_records(f, staging)
+                self._replace_tables(tables_dict, {
+                    table_name: table.inner for table_name, table in staging.items() if table.loaded
+                })
             
             self._log(f"成功恢复 {restored_count} 条记录")
             return True
-            
+        
         except Exception as e:
             print(f"加载 line 格式备份失败: {e}")
             import traceback
             traceback.print_exc()
-            return False
\ No newline at end of file
+            return False
+    
+    # ------------------------------------------------------------------
+    # line 记录读写（全量快照与增量文件共用）
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def _escape_key(keyname: str) -> str:
+        """转义 keyname 中的空格"""
+        return keyname.replace(" ", "\\ ")
+    
+    def _format_line_record(self, keyname: str, value, table_timestamp: str) -> str:
+        """格式化一条数据行: - timestamp mime keyname valueline"""
+        record_timestamp, mime, valueline = self._line_record_parts(value, table_timestamp)
+        return f"- {record_timestamp} {mime} {self._escape_key(keyname)} {valueline}"
+    
+    @staticmethod
+    def _line_record_parts(value, table_timestamp: str):
+        """计算数据行的 (timestamp, mime, valueline)"""
+        # 延迟加载且尚未访问的记录：直接拷贝原始 valueline
+        if isinstance(value, LazyRecord):
+            return value.timestamp or table_timestamp, value.mime, value.valueline()
+        
+        mime, valueline = encode_record_value(value)
+        return BackupManager._record_timestamp(value) or table_timestamp, mime, valueline
+    
+    @staticmethod
+    def _encoded_line_parts(value):
+        """(记录自身的时间戳或 None, mime, valueline 的 UTF-8 字节)，可缓存复用"""
+        if isinstance(value, LazyRecord):
+            return value.timestamp or None, value.mime, value.valueline().encode("utf-8")
+        mime, valueline = encode_record_value(value)
+        return BackupManager._record_timestamp(value), mime, valueline.encode("utf-8")
+    
+    @staticmethod
+    def _record_timestamp(value) -> Optional[str]:
+        """entry 的 lastModifiedTime（%Y%m%d%H%M%S）；没有时返回 None，由调用方使用表的时间戳"""
+        # 记录的时间戳（如果 value 是 entry 对象，可能有 lastModifiedTime）
+        if isinstance(value, entry) and getattr(value, 'lastModifiedTime', None):
+            if isinstance(value.lastModifiedTime, datetime):
+                return value.lastModifiedTime.strftime("%Y%m%d%H%M%S")
+            else:
+                # 如果是字符串，尝试解析
+                try:
+                    dt = datetime.fromisoformat(value.lastModifiedTime)
+                    return dt.strftime("%Y%m%d%H%M%S")
+                except:
+                    pass
+        return None
+    
+    @staticmethod
+    def _split_key(rest: str):
+        """从 "keyname valueline" 中切出转义过的 keyname"""
+        i = 0
+        while i < len(rest):
+            if rest[i] == "\\" and rest[i + 1:i + 2] == " ":
+                i += 2
+                continue
+            if rest[i] == " ":
+                break
+            i += 1
+        return rest[:i].replace("\\ ", " "), rest[i + 1:]
+    
+    def _apply_line_records(self, lines, tables_dict: Dict[str, Any]) -> int:
+        """把 line 格式的记录（含增量中的删除行）直接写入 tables_dict 中各表的存储
+        
+        只用于加载备份（表随后整体替换或尚未开始服务），不记为修改、不写 WAL。
+        
+        Returns:
+            应用的记录数
+        """
+        applied = 0
+        last_table = None
+        for table, keyname, value in self._iter_line_records(lines, tables_dict):
+            if table is not last_table:
+                if hasattr(table, 'invalidate_index'):
+                    table.invalidate_index()
+                last_table = table
+            if value is _DELETED:
+                table.inner.pop(keyname, None)
+            else:
+                table.inner[keyname] = value
+            applied += 1
+        return applied
+    
+    def _iter_line_records(self, lines, tables_dict: Dict[str, Any]):
+        """逐条解析 line 格式的记录，跳过 tables_dict 中没有的表
+        
+        Yields:
+            (表, keyname, value)；增量中的删除行（x keyname）的 value 为 _DELETED
+        """
+        current_table = None
+        
+        for line in lines:
+            line = line.strip()
+            
+            if not line:
+                # 空行，表分隔
+                current_table = None
+                continue
+            
+            if line.startswith("Table "):
+                # 表头: Table tablename timestamp:
+                parts = line.split()
+                if len(parts) >= 3:
+                    table_name = parts[1]
+                    # timestamp = parts[2].rstrip(':')
+                    
+                    if table_name in tables_dict:
+                        current_table = tables_dict[table_name]
+                        self._log(f"  恢复表: {table_name}")
+                    else:
+                        self._log(f"  警告: 表 {table_name} 不存在，跳过")
+                        current_table = None
+                continue
+            
+            if current_table is None or not hasattr(current_table, 'inner'):
+                continue
+            
+            if line.startswith("- "):
+                # 数据行: - 20251108181432 mime keyname valueline
+                parts = line[2:].split(' ', 2)
+                if len(parts) < 3:
+                    continue
+                record_timestamp, mime = parts[0], parts[1]
+                keyname, valueline = self._split_key(parts[2])
+                
+                # 恢复 value（entry 对象或 raw 数据）
+                entry_obj = decode_record_value(mime, valueline)
+                
+                # 设置 lastModifiedTime
+                if isinstance(entry_obj, entry):
+                    try:
+                        dt = datetime.strptime(record_timestamp, "%Y%m%d%H%M%S")
+                        entry_obj.lastModifiedTime = dt
+                    except:
+                        pass
+                
+                yield current_table, keyname, entry_obj
+            elif line.startswith("x "):
+                # 删除行（仅出现在增量文件中）: x keyname
+                keyname, _ = self._split_key(line[2:])
+                yield current_table, keyname, _DELETED
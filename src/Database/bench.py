@@ -0,0 +1,473 @@
+"""
+数据库基准测试
+
+用法（在 src 目录下运行）：
+    python -m Database.bench snapshot --entries 200000
+    python -m Database.bench contention --entries 20000 --threads 8
+    python -m Database.bench memory --entries 100000
+    python -m Database.bench formats --entries 100000 --compression gzip
+    python -m Database.bench memo --entries 100000
+    python -m Database.bench parallel --entries 400000 --workers 4
+    python -m Database.bench schedule --entries 100000
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from Common.base import entry
+
+from .backup import BackupManager
+from .table import Table
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    """返回毫秒单位的 p50 / p99 / max"""
+    if not samples:
+        return {"count": 0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50": statistics.median(ordered) * 1000,
+        "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+        "max": ordered[-1] * 1000,
+    }
+
+
+def _fill_table(name: str, entries: int) -> Table:
+    table = Table.of(name)
+    for i in range(entries):
+        table.inner[f"key{i:08d}"] = {"text": f"value {i} " + "x" * 48, "count": i}
+    table.invalidate_index()
+    return table
+
+
+class _Writer:
+    """后台写入线程，记录每次 set() 的耗时"""
+    
+    def __init__(self, table: Table, entries: int):
+        self.table = table
+        self.entries = entries
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        i = 0
+        while not self._stop.is_set():
+            key = f"key{(i * 7919) % self.entries:08d}"
+            started = time.perf_counter()
+            self.table.set(key, {"text": f"updated {i}", "count": i})
+            self.samples.append(time.perf_counter() - started)
+            i += 1
+            # 模拟请求间隔
+            time.sleep(0.0005)
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def stop(self) -> List[float]:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+
+def bench_snapshot(entries: int = 200000, idle_seconds: float = 1.0,
+                   mode: str = "thread") -> Dict[str, Dict[str, float]]:
+    """备份（写时复制快照 / fork 子进程）期间的写入延迟，与空闲时及整表复制对比"""
+    table = _fill_table("__bench__", entries)
+    tables_dict = {table.name: table}
+    results = {}
+    
+    writer = _Writer(table, entries).start()
+    time.sleep(idle_seconds)
+    results["idle"] = _percentiles(writer.stop())
+    
+    # 旧做法的参考值：每次在锁内复制整表
+    writer = _Writer(table, entries).start()
+    deadline = time.perf_counter() + idle_seconds
+    while time.perf_counter() < deadline:
+        with table._write_lock:
+            table.inner.copy()
+    results["full copy under lock"] = _percentiles(writer.stop())
+    
+    with tempfile.TemporaryDirectory() as backup_dir:
+        manager = BackupManager(backup_dir=backup_dir, max_backups=2, format="line", mode=mode)
+        manager._log = lambda message: None
+        writer = _Writer(table, entries).start()
+        started = time.perf_counter()
+        manager.create_backup(tables_dict)
+        backup_seconds = time.perf_counter() - started
+        results[f"during {manager.mode} backup"] = _percentiles(writer.stop())
+    
+    results["backup"] = {"count": entries, "ms": backup_seconds * 1000}
+    
+    from . import tables
+    tables.pop(table.name, None)
+    return results
+
+
+def bench_contention(entries: int = 20000, threads: int = 8,
+                     hot_keys: int = 4) -> Dict[str, Dict[str, float]]:
+    """多线程读改写：普通 get + set 会丢失更新，update() 不会
+    
+    每个线程对 hot_keys 个计数器累计加 entries // threads 次，
+    "lost" 列为结束时丢失的增量数，p50 / p99 / max 为单次操作耗时。
+    """
+    table = Table.of("__bench__")
+    per_thread = max(1, entries // threads)
+    results = {}
+    
+    def naive(key):
+        table.set(key, (table.get(key) or 0) + 1)
+    
+    def atomic(key):
+        table.update(key, lambda value: (value or 0) + 1, 0)
+    
+    def spread(key):
+        table.set(key, 1)
+    
+    for name, op, keys in (
+        ("get + set (hot keys)", naive, [f"hot{i}" for i in range(hot_keys)]),
+        ("update (hot keys)", atomic, [f"hot{i}" for i in range(hot_keys)]),
+        ("set (spread keys)", spread, None),
+    ):
+        for key in keys or []:
+            table.set(key, 0)
+        samples = [[] for _ in range(threads)]
+        barrier = threading.Barrier(threads)
+        
+        def run(n):
+            barrier.wait()
+            own = samples[n]
+            for i in range(per_thread):
+                key = keys[i % len(keys)] if keys else f"t{n}-{i}"
+                started = time.perf_counter()
+                op(key)
+                own.append(time.perf_counter() - started)
+        
+        workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        
+        row = _percentiles([s for own in samples for s in own])
+        row["lost"] = 0
+        if keys:
+            row["lost"] = per_thread * threads - sum(table.get(key) for key in keys)
+        row["ops/s"] = per_thread * threads / elapsed
+        results[name] = row
+    
+    from . import tables
+    tables.pop(table.name, None)
+    return results
+
+
+class _DictEntry:
+    """改用 __slots__ 之前的 entry 表示：实例字典 + value 字典 + datetime 对象"""
+    
+    def __init__(self, mime, value):
+        self.mime = mime
+        self.value = value
+        self.lastModifiedTime = None
+
+
+def bench_memory(entries: int = 100000) -> Dict[str, Dict[str, float]]:
+    """用 tracemalloc 统计每条小文本记录占用的字节数（不含表本身的字典）
+    
+    "bytes/entry" 列为平均每条记录的字节数，"ms" 列为构造全部记录的耗时。
+    """
+    base = datetime(2025, 1, 1)
+    # mime 字符串来自解析（例如读取备份文件），不是同一个字面量
+    mimes = ["".join(["te", "xt"]) for _ in range(entries)]
+    texts = [f"note {i}: a short line of text" for i in range(entries)]
+    saved = [base + timedelta(seconds=i, microseconds=i % 1000) for i in range(entries)]
+    results = {}
+    
+    for name, factory in (
+        ("dict entry (before)", _DictEntry),
+        ("slots entry (after)", entry),
+    ):
+        tracemalloc.start()
+        started = time.perf_counter()
+        records = [factory(mimes[i], {"text": texts[i], "lastSavedTime": saved[i]}) for i in range(entries)]
+        elapsed = time.perf_counter() - started
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # 记录列表本身（每条一个指针）不算在内
+        per_entry = (size - 8 * len(records)) / entries
+        results[name] = {"count": entries, "ms": elapsed * 1000, "bytes/entry": per_entry}
+        del records
+    
+    return results
+
+
+def bench_formats(entries: int = 100000, compression: str = None) -> Dict[str, Dict[str, float]]:
+    """json / line / bin 三种格式的全量备份写入与加载吞吐量
+    
+    "MB" 列为磁盘上的文件大小，"raw MB" 列为压缩前的大小。
+    """
+    table = _fill_table("__bench__", 0)
+    base = datetime(2025, 1, 1)
+    for i in range(entries):
+        table.inner[f"key{i:08d}"] = entry("text", {
+            "text": f"note {i}: a short line of text\nwith a second line",
+            "lastSavedTime": base + timedelta(seconds=i),
+        })
+    table.invalidate_index()
+    tables_dict = {table.name: table}
+    results = {}
+    
+    for format in ("json", "line", "bin"):
+        with tempfile.TemporaryDirectory() as backup_dir:
+            manager = BackupManager(backup_dir=backup_dir, max_backups=2, format=format,
+                                    compression=compression)
+            manager._log = lambda message: None
+            
+            started = time.perf_counter()
+            path = manager.create_backup(tables_dict)
+            save_seconds = time.perf_counter() - started
+            size = os.path.getsize(path)
+            raw_size = manager.list_backups()[0]["raw_size"]
+            
+            started = time.perf_counter()
+            manager.load_latest_backup(tables_dict)
+            load_seconds = time.perf_counter() - started
+        
+        results[f"{format} save"] = {"count": entries, "ms": save_seconds * 1000,
+                                     "records/s": entries / save_seconds, "MB": size / 1e6,
+                                     "raw MB": raw_size / 1e6}
+        results[f"{format} load"] = {"count": entries, "ms": load_seconds * 1000,
+                                     "records/s": entries / load_seconds, "MB": size / 1e6,
+                                     "raw MB": raw_size / 1e6}
+    
+    from . import tables
+    tables.pop(table.name, None)
+    return results
+
+
+def bench_memo(entries: int = 100000, changed: float = 0.01) -> Dict[str, Dict[str, float]]:
+    """连续两次全量快照，第二次之前只修改 changed 比例的记录：比较开启 / 关闭序列化缓存的耗时
+    
+    "hit rate" 列为第二次快照的缓存命中率。
+    """
+    table = _fill_table("__bench__", 0)
+    base = datetime(2025, 1, 1)
+    for i in range(entries):
+        table.inner[f"key{i:08d}"] = entry("text", {
+            "text": f"note {i}: a short line of text\nwith a second line",
+            "lastSavedTime": base + timedelta(seconds=i),
+        })
+    table.invalidate_index()
+    tables_dict = {table.name: table}
+    step = max(1, int(1 / changed)) if changed else entries + 1
+    results = {}
+    
+    for format in ("line", "json", "bin"):
+        for memoize in (False, True):
+            with tempfile.TemporaryDirectory() as backup_dir:
+                manager = BackupManager(backup_dir=backup_dir, max_backups=2, format=format, memoize=memoize)
+                manager._log = lambda message: None
+                manager.create_backup(tables_dict)
+                for i in range(0, entries, step):
+                    table.set(f"key{i:08d}", entry("text", {"text": f"changed {i}", "lastSavedTime": base}))
+                started = time.perf_counter()
+                manager.create_backup(tables_dict)
+                elapsed = time.perf_counter() - started
+            row = {"count": entries, "ms": elapsed * 1000, "records/s": entries / elapsed}
+            if memoize:
+                row["hit rate"] = manager._memo_stats["hit_rate"]
+            results[f"{format} {'memo' if memoize else 'no memo'}"] = row
+    
+    from . import tables
+    tables.pop(table.name, None)
+    return results
+
+
+def bench_parallel(entries: int = 400000, workers: int = None,
+                   tables_count: int = 4) -> Dict[str, Dict[str, float]]:
+    """多个表的全量快照：单线程序列化与按表 / 键区间分片、进程池并行序列化的对比
+    
+    记录平均分布在 tables_count 个表中；"speedup" 列相对于单线程的同一操作。
+    """
+    workers = workers or os.cpu_count() or 1
+    base = datetime(2025, 1, 1)
+    tables_dict = {}
+    for n in range(tables_count):
+        table = _fill_table(f"__bench{n}__", 0)
+        for i in range(n, entries, tables_count):
+            table.inner[f"key{i:08d}"] = entry("text", {
+                "text": f"note {i}: a short line of text\nwith a second line",
+                "lastSavedTime": base + timedelta(seconds=i),
+            })
+        table.invalidate_index()
+        tables_dict[table.name] = table
+    results = {}
+    
+    sharded = {"workers": workers, "shard_size": max(1, entries // (workers * 2))}
+    for format in ("line", "json"):
+        timings = {}
+        for label, options in (("serial", {}), (f"{workers} workers", sharded)):
+            with tempfile.TemporaryDirectory() as backup_dir:
+                manager = BackupManager(backup_dir=backup_dir, max_backups=2, format=format,
+                                        memoize=False, **options)
+                manager._log = lambda message: None
+                started = time.perf_counter()
+                manager.create_backup(tables_dict)
+                timings["save", label] = time.perf_counter() - started
+                started = time.perf_counter()
+                manager.load_latest_backup(tables_dict)
+                timings["load", label] = time.perf_counter() - started
+        for (operation, label), seconds in timings.items():
+            results[f"{format} {operation} {label}"] = {
+                "count": entries,
+                "ms": seconds * 1000,
+                "speedup": timings[operation, "serial"] / seconds,
+            }
+    
+    from . import tables
+    for name in tables_dict:
+        tables.pop(name, None)
+    return results
+
+
+def bench_schedule(entries: int = 100000, seconds: float = 10.0) -> Dict[str, Dict[str, float]]:
+    """自动备份调度：计数器式的持续少量写入（每 0.1 秒更新同一个键），中间有一阵集中写入
+    
+    比较固定间隔（1 秒）与自适应调度（0.2~5 秒、快照耗时占比 10%、延迟写回 0.5 秒）。"overhead %" 为快照耗时
+    占运行时间的比例，"burst lag s" 为集中写入结束到下一个快照写完的时间。
+    """
+    table = _fill_table("__bench__", entries)
+    tables_dict = {table.name: table}
+    burst = max(1, entries // 20)
+    results = {}
+    
+    for label, options in (
+        ("fixed 1s", {"backup_interval": 1.0}),
+        ("adaptive", {"backup_interval": 1.0, "adaptive": True, "min_interval": 0.2, "max_interval": 5.0,
+                      "max_dirty_keys": burst * 2, "max_overhead": 0.1,
+                      "debounce": 0.5, "debounce_keys": burst // 2}),
+    ):
+        with tempfile.TemporaryDirectory() as backup_dir:
+            manager = BackupManager(backup_dir=backup_dir, max_backups=2, format="line", **options)
+            manager._log = lambda message: None
+            spans = []
+            create_backup = manager.create_backup
+            
+            def timed_backup(tables):
+                started = time.perf_counter()
+                result = create_backup(tables)
+                spans.append((started, time.perf_counter()))
+                return result
+            
+            manager.create_backup = timed_backup
+            manager.create_backup(tables_dict)
+            spans.clear()
+            
+            stop = threading.Event()
+            burst_end = []
+            
+            def writer():
+                i = 0
+                begin = time.perf_counter()
+                while not stop.wait(0.1):
+                    table.set("counter", {"count": i})
+                    i += 1
+                    if not burst_end and time.perf_counter() - begin > seconds / 3:
+                        for n in range(burst):
+                            table.set(f"key{(n * 7919) % entries:08d}", {"text": f"burst {n}", "count": n})
+                        burst_end.append(time.perf_counter())
+            
+            thread = threading.Thread(target=writer, daemon=True)
+            started = time.perf_counter()
+            manager.start_auto_backup(tables_dict)
+            thread.start()
+            time.sleep(seconds)
+            stop.set()
+            thread.join()
+            manager.stop_auto_backup()
+            elapsed = time.perf_counter() - started
+        
+        busy = sum(end - begin for begin, end in spans)
+        lag = next((end - burst_end[0] for begin, end in spans if burst_end and begin >= burst_end[0]), None)
+        results[label] = {
+            "backups": len(spans),
+            "ms": busy * 1000,
+            "overhead %": busy / elapsed * 100,
+            "burst lag s": lag,
+        }
+    
+    from . import tables
+    tables.pop(table.name, None)
+    return results
+
+
+# 列名 -> 表头
+_COLUMN_LABELS = {"p50": "p50 ms", "p99": "p99 ms", "max": "max ms"}
+
+
+def _print_results(title: str, results: Dict[str, Dict[str, float]]):
+    print(title)
+    columns = []
+    for row in results.values():
+        columns += [column for column in row if column not in columns]
+    print(f"  {'':<26}" + "".join(f"{_COLUMN_LABELS.get(column, column):>12}" for column in columns))
+    for name, row in results.items():
+        cells = []
+        for column in columns:
+            value = row.get(column)
+            if value is None:
+                cells.append(f"{'':>12}")
+            elif isinstance(value, int) or abs(value) >= 10000:
+                cells.append(f"{value:>12.0f}")
+            else:
+                cells.append(f"{value:>12.3f}")
+        print(f"  {name:<26}" + "".join(cells))
+
+
+BENCHMARKS = {
+    "snapshot": bench_snapshot,
+    "contention": bench_contention,
+    "memory": bench_memory,
+    "formats": bench_formats,
+    "memo": bench_memo,
+    "parallel": bench_parallel,
+    "schedule": bench_schedule,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="数据库基准测试")
+    parser.add_argument("name", choices=sorted(BENCHMARKS), help="基准测试名称")
+    parser.add_argument("--entries", type=int, default=200000, help="表中的记录数")
+    parser.add_argument("--mode", choices=["thread", "fork"], help="备份方式（snapshot）")
+    parser.add_argument("--threads", type=int, help="并发线程数（contention）")
+    parser.add_argument("--compression", choices=["gzip", "lzma"], help="备份压缩方式（formats）")
+    parser.add_argument("--workers", type=int, help="工作进程数（parallel，默认 CPU 核数）")
+    args = parser.parse_args(argv)
+    
+    options = {}
+    if args.mode:
+        options["mode"] = args.mode
+    if args.threads:
+        options["threads"] = args.threads
+    if args.compression:
+        options["compression"] = args.compression
+    if args.workers:
+        options["workers"] = args.workers
+    results = BENCHMARKS[args.name](entries=args.entries, **options)
+    _print_results(f"{args.name} ({args.entries} entries)", results)
+
+
+if __name__ == "__main__":
+    main()
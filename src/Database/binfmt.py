@@ -0,0 +1,282 @@
+"""
+bin 格式备份：带类型标记、长度前缀的二进制记录
+- 不经过文本编码，也没有 deserialize_value 那样的日期字符串猜测：每个值都带显式类型
+- 按帧流式写入和读取，每次只在内存中解码一条记录
+
+文件结构：
+    MAGIC
+    帧: kind(1 字节) + 长度(u32) + 负载
+        b"T" 表头，负载为 UTF-8 表名
+        b"R" 记录，负载为 key(u32 长度 + UTF-8) + 带类型的值
+        b"Z" 结束标记（负载为空），缺少它说明文件不完整
+
+值的类型标记：
+    N None    T True    F False
+    i int64   I 大整数（十进制字符串）   f float64
+    s str     d naive datetime（纪元微秒 int64）   D 带时区 datetime（ISO 字符串）
+    l list    m dict（键值均带类型）
+    e entry   mime + lastModifiedTime + value（按 mime 对应的类通过 from_dict 重建）
+    x 紧凑文本 entry   mime + lastModifiedTime + text + 纪元秒数（见 entry.compact_parts）
+"""
+
+import struct
+from datetime import datetime, timedelta
+from typing import Any, BinaryIO, Dict, Iterator, Tuple
+
+from Common.base import entry
+
+MAGIC = b"TXBIN1\n"
+
+_FRAME = struct.Struct("<cI")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+_EPOCH = datetime(1970, 1, 1)
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+
+# ----------------------------------------------------------------------
+# 编码
+# ----------------------------------------------------------------------
+
+def _put_str(out: bytearray, text: str):
+    data = text.encode("utf-8")
+    out += _U32.pack(len(data))
+    out += data
+
+
+def encode_value(out: bytearray, value: Any):
+    """把 value 追加编码到 out"""
+    kind = type(value)
+    if kind is str:
+        out += b"s"
+        _put_str(out, value)
+    elif value is None:
+        out += b"N"
+    elif kind is bool:
+        out += b"T" if value else b"F"
+    elif kind is int:
+        if _INT64_MIN <= value <= _INT64_MAX:
+            out += b"i"
+            out += _I64.pack(value)
+        else:
+            out += b"I"
+            _put_str(out, str(value))
+    elif kind is float:
+        out += b"f"
+        out += _F64.pack(value)
+    elif kind is dict:
+        out += b"m"
+        out += _U32.pack(len(value))
+        for key, item in value.items():
+            encode_value(out, key)
+            encode_value(out, item)
+    elif kind is list or kind is tuple:
+        out += b"l"
+        out += _U32.pack(len(value))
+        for item in value:
+            encode_value(out, item)
+    elif isinstance(value, datetime):
+        if value.tzinfo is None:
+            delta = value - _EPOCH
+            out += b"d"
+            out += _I64.pack((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+        else:
+            out += b"D"
+            _put_str(out, value.isoformat())
+    elif isinstance(value, entry):
+        from .backup import get_entry_class
+        parts = value.compact_parts() if type(value) is entry else None
+        if parts is not None and get_entry_class(value.mime) is entry:
+            out += b"x"
+            _put_str(out, value.mime)
+            encode_value(out, value.lastModifiedTime)
+            _put_str(out, parts[0])
+            encode_value(out, parts[1])
+            return
+        out += b"e"
+        _put_str(out, value.mime)
+        encode_value(out, value.lastModifiedTime)
+        # 基类直接保存 value（保留 datetime 类型）；子类走 to_dict()，尊重其覆写
+        encode_value(out, value.value if type(value) is entry else value.to_dict().get("value"))
+    else:
+        raise TypeError(f"bin 格式不支持的类型: {kind.__name__}")
+
+
+def encode(value: Any) -> bytes:
+    """单独编码一个值（可缓存后交给 BinWriter.record_encoded）"""
+    out = bytearray()
+    encode_value(out, value)
+    return bytes(out)
+
+
+# ----------------------------------------------------------------------
+# 解码
+# ----------------------------------------------------------------------
+
+def _get_str(buf: bytes, pos: int) -> Tuple[str, int]:
+    (length,) = _U32.unpack_from(buf, pos)
+    pos += 4
+    return buf[pos:pos + length].decode("utf-8"), pos + length
+
+
+def decode_value(buf: bytes, pos: int) -> Tuple[Any, int]:
+    """从 buf[pos:] 解码一个值，返回 (值, 新位置)"""
+    tag = buf[pos:pos + 1]
+    pos += 1
+    if tag == b"s":
+        (length,) = _U32.unpack_from(buf, pos)
+        pos += 4
+        return buf[pos:pos + length].decode("utf-8"), pos + length
+    if tag == b"x":
+        mime, pos = _get_str(buf, pos)
+        modified, pos = decode_value(buf, pos)
+        text, pos = _get_str(buf, pos)
+        saved, pos = decode_value(buf, pos)
+        return entry.from_compact(mime, text, saved, modified), pos
+    if tag == b"m":
+        (count,) = _U32.unpack_from(buf, pos)
+        pos += 4
+        result = {}
+        for _ in range(count):
+            key, pos = decode_value(buf, pos)
+            result[key], pos = decode_value(buf, pos)
+        return result, pos
+    if tag == b"d":
+        (micros,) = _I64.unpack_from(buf, pos)
+        return _EPOCH + timedelta(microseconds=micros), pos + 8
+    if tag == b"N":
+        return None, pos
+    if tag == b"i":
+        return _I64.unpack_from(buf, pos)[0], pos + 8
+    if tag == b"f":
+        return _F64.unpack_from(buf, pos)[0], pos + 8
+    if tag == b"T":
+        return True, pos
+    if tag == b"F":
+        return False, pos
+    if tag == b"l":
+        (count,) = _U32.unpack_from(buf, pos)
+        pos += 4
+        result = []
+        for _ in range(count):
+            item, pos = decode_value(buf, pos)
+            result.append(item)
+        return result, pos
+    if tag == b"e":
+        from .backup import restore_entry
+        mime, pos = _get_str(buf, pos)
+        modified, pos = decode_value(buf, pos)
+        value, pos = decode_value(buf, pos)
+        return restore_entry(mime, value, modified), pos
+    if tag == b"I":
+        text, pos = _get_str(buf, pos)
+        return int(text), pos
+    if tag == b"D":
+        text, pos = _get_str(buf, pos)
+        return datetime.fromisoformat(text), pos
+    raise ValueError(f"未知的类型标记 {tag!r}（位置 {pos - 1}）")
+
+
+# ----------------------------------------------------------------------
+# 文件读写
+# ----------------------------------------------------------------------
+
+class BinWriter:
+    """流式写入 bin 格式备份"""
+    
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self._buf = bytearray()
+        f.write(MAGIC)
+    
+    def _frame(self, kind: bytes, payload):
+        self._f.write(_FRAME.pack(kind, len(payload)))
+        self._f.write(payload)
+    
+    def table(self, name: str):
+        self._frame(b"T", name.encode("utf-8"))
+    
+    def record(self, key: str, value: Any):
+        buf = self._buf
+        buf.clear()
+        _put_str(buf, key)
+        encode_value(buf, value)
+        self._frame(b"R", buf)
+    
+    def record_encoded(self, key: str, encoded: bytes):
+        """写入一条值已经用 encode() 编码好的记录"""
+        buf = self._buf
+        buf.clear()
+        _put_str(buf, key)
+        buf += encoded
+        self._frame(b"R", buf)
+    
+    def close(self):
+        """写入结束标记"""
+        self._frame(b"Z", b"")
+
+
+def _iter_frames(f: BinaryIO) -> Iterator[Tuple[bytes, bytes]]:
+    """逐帧产出 (kind, payload)，到结束标记为止
+    
+    文件不完整（缺少结束标记或帧被截断）时抛出 ValueError。
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("不是 bin 格式备份")
+    while True:
+        header = f.read(_FRAME.size)
+        if len(header) < _FRAME.size:
+            raise ValueError("bin 备份不完整：缺少结束标记")
+        kind, length = _FRAME.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length:
+            raise ValueError("bin 备份不完整：记录被截断")
+        if kind == b"Z":
+            return
+        if kind not in (b"T", b"R"):
+            raise ValueError(f"未知的帧类型 {kind!r}")
+        yield kind, payload
+
+
+def _decode_record(payload: bytes) -> Tuple[str, Any]:
+    key, pos = _get_str(payload, 0)
+    value, _ = decode_value(payload, pos)
+    return key, value
+
+
+def iter_records(f: BinaryIO) -> Iterator[Tuple[str, str, Any]]:
+    """流式读取，逐条产出 (table_name, key, value)"""
+    table_name = None
+    for kind, payload in _iter_frames(f):
+        if kind == b"T":
+            table_name = payload.decode("utf-8")
+        else:
+            yield (table_name, *_decode_record(payload))
+
+
+def iter_raw_records(f: BinaryIO) -> Iterator[Tuple[str, str, bytes]]:
+    """流式读取，逐条产出 (table_name, key, 编码后的值)，不解码值（比较两个备份时使用）"""
+    table_name = None
+    for kind, payload in _iter_frames(f):
+        if kind == b"T":
+            table_name = payload.decode("utf-8")
+        else:
+            key, pos = _get_str(payload, 0)
+            yield table_name, key, payload[pos:]
+
+
+def read_tables(f: BinaryIO) -> Dict[str, Dict[str, Any]]:
+    """读取整个 bin 备份（已打开的二进制流，可以是解压流），
+    返回 table_name -> {key: value}（空表也会出现）"""
+    tables = {}
+    current = None
+    for kind, payload in _iter_frames(f):
+        if kind == b"T":
+            current = tables.setdefault(payload.decode("utf-8"), {})
+        else:
+            key, value = _decode_record(payload)
+            current[key] = value
+    return tables
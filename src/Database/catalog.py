@@ -0,0 +1,224 @@
+"""
+备份目录的清单 catalog.json
+- 每个全量快照写完（文件已 fsync 并重命名到位）之后才登记，登记即完成标记
+- 条目包含大小、记录数、整个文件的 sha256，以及各表在原始（未压缩）数据中的区间和 sha256
+- 启动时按清单从新到旧挑选第一个有效的快照：只比较文件大小，不扫描目录、不解析内容；
+  校验失败或加载失败的快照标记为 corrupt，之后直接跳过
+- 清单本身通过临时文件 + fsync + 原子重命名写入；缺失或损坏时从各快照的 .meta / manifest 重建
+
+catalog.json:
+    {"version": 1,
+     "backups": [{"filename": "backup_20250101_120000.txt.gz", "format": "line",
+                  "compression": "gzip", "size": ..., "raw_size": ..., "records": ...,
+                  "sha256": "...", "tables": {"main": {"records": ..., "offset": ...,
+                  "length": ..., "sha256": "..."}}, "created": "...", "complete": true}, ...]}
+
+分片快照（目录）的条目没有 sha256，改为 "shards": [{"file", "table", "records", "size", "sha256"}, ...]。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+CATALOG = "catalog.json"
+VERSION = 1
+
+# 计算 / 校验 sha256 时每次读取的字节数（hashlib 和 zlib 处理大块数据时会释放 GIL）
+_CHUNK = 1 << 20
+
+
+class BackupCatalog:
+    """备份目录中全量快照的清单（按创建顺序，最新的在最后）"""
+    
+    def __init__(self, backup_dir):
+        self.backup_dir = Path(backup_dir)
+        self.path = self.backup_dir / CATALOG
+        self._lock = threading.RLock()
+        self.entries = self._read()
+    
+    @property
+    def loaded(self) -> bool:
+        """清单文件是否存在且可读；否则需要 rebuild()"""
+        return self.entries is not None
+    
+    def _read(self) -> Optional[List[Dict[str, Any]]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get("backups"), list):
+            return None
+        return data["backups"]
+    
+    def save(self):
+        """原子地写入清单"""
+        with self._lock:
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": VERSION, "backups": self.entries}, f, ensure_ascii=False, indent=1)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+    
+    def rebuild(self, paths: Iterable[Path], describe: Callable[[Path], Dict[str, Any]]):
+        """从现有快照重建清单（清单缺失或损坏时，一次性扫描）"""
+        with self._lock:
+            ordered = sorted(paths, key=lambda path: path.stat().st_mtime)
+            self.entries = [describe(path) for path in ordered]
+            self.save()
+    
+    def add(self, entry: Dict[str, Any]):
+        """登记一个已经完整落盘的快照（同名条目被替换）"""
+        with self._lock:
+            self.entries = [item for item in (self.entries or []) if item["filename"] != entry["filename"]]
+            self.entries.append(entry)
+            self.save()
+    
+    def remove(self, filename: str):
+        with self._lock:
+            self.entries = [item for item in (self.entries or []) if item["filename"] != filename]
+            self.save()
+    
+    def mark_corrupt(self, filename: str, reason: str):
+        """标记快照已损坏，之后加载时跳过"""
+        with self._lock:
+            for item in self.entries or []:
+                if item["filename"] == filename:
+                    item["corrupt"] = reason
+                    item["verified"] = datetime.now().isoformat()
+            self.save()
+    
+    def mark_verified(self, filename: str):
+        with self._lock:
+            for item in self.entries or []:
+                if item["filename"] == filename:
+                    item.pop("corrupt", None)
+                    item["verified"] = datetime.now().isoformat()
+            self.save()
+    
+    def get(self, filename: str) -> Optional[Dict[str, Any]]:
+        for item in self.entries or []:
+            if item["filename"] == filename:
+                return item
+        return None
+    
+    def matching(self, match: Callable[[str], bool]) -> List[Dict[str, Any]]:
+        """符合条件（例如当前格式）的条目，按创建顺序"""
+        return [item for item in self.entries or [] if match(item["filename"])]
+    
+    def latest_valid(self, match: Callable[[str], bool]) -> Iterator[Dict[str, Any]]:
+        """从新到旧产出可用的快照条目：已完成、未标记损坏、文件大小与清单一致"""
+        for item in reversed(self.matching(match)):
+            if not item.get("complete") or item.get("corrupt"):
+                continue
+            if self._looks_intact(item):
+                yield item
+    
+    def _looks_intact(self, item: Dict[str, Any]) -> bool:
+        """只做 stat 的快速检查（截断的文件大小不符）"""
+        path = self.backup_dir / item["filename"]
+        try:
+            if "shards" in item:
+                return all((path / shard["file"]).stat().st_size == shard["size"] for shard in item["shards"])
+            return item.get("size") is None or path.stat().st_size == item["size"]
+        except OSError:
+            return False
+
+
+# ----------------------------------------------------------------------
+# 校验
+# ----------------------------------------------------------------------
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_CHUNK)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def _bad_tables(path: Path, tables: Dict[str, Dict[str, Any]]) -> List[str]:
+    """解压后按各表的原始区间重新计算 sha256，找出内容不符的表"""
+    from .backup import open_backup_file
+    ranges = sorted(
+        (info["offset"], info["length"], name, info["sha256"])
+        for name, info in tables.items() if info.get("sha256")
+    )
+    bad = []
+    position = 0
+    try:
+        with open_backup_file(path, "rb") as f:
+            for offset, length, name, expected in ranges:
+                f.read(offset - position)
+                digest = hashlib.sha256()
+                remaining = length
+                while remaining > 0:
+                    chunk = f.read(min(_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+                position = offset + length
+                if remaining or digest.hexdigest() != expected:
+                    bad.append(name)
+    except Exception:
+        # 压缩流本身损坏：之后的表都无法确认
+        bad.extend(name for _, _, name, _ in ranges if name not in bad)
+        bad = sorted(set(bad))
+    return bad
+
+
+def _verify_file(path: Path, size: Optional[int], sha256: Optional[str],
+                 tables: Optional[Dict[str, Dict[str, Any]]] = None) -> List[str]:
+    """返回问题列表，空列表表示校验通过"""
+    try:
+        actual_size = path.stat().st_size
+    except OSError:
+        return [f"{path.name}: 文件不存在"]
+    problems = []
+    if size is not None and actual_size != size:
+        problems.append(f"{path.name}: 大小 {actual_size} != {size}")
+    if sha256 is not None and file_sha256(path) != sha256:
+        problems.append(f"{path.name}: sha256 不符")
+        if tables:
+            bad = _bad_tables(path, tables)
+            if bad:
+                problems.append(f"{path.name}: 受影响的表 {', '.join(bad)}")
+    return problems
+
+
+def verify_entries(backup_dir, entries: List[Dict[str, Any]], workers: int = None) -> List[Dict[str, Any]]:
+    """并行校验清单中的快照（分片快照的每个分片单独校验）
+    
+    Returns:
+        每个条目一个结果 {"filename", "ok", "problems"}，顺序与 entries 相同
+    """
+    backup_dir = Path(backup_dir)
+    jobs = []
+    for index, item in enumerate(entries):
+        path = backup_dir / item["filename"]
+        if "shards" in item:
+            for shard in item["shards"]:
+                jobs.append((index, path / shard["file"], shard.get("size"), shard.get("sha256"), shard.get("tables")))
+        else:
+            jobs.append((index, path, item.get("size"), item.get("sha256"), item.get("tables")))
+    
+    problems = [[] for _ in entries]
+    with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+        futures = [(index, pool.submit(_verify_file, path, size, sha256, tables))
+                   for index, path, size, sha256, tables in jobs]
+        for index, future in futures:
+            problems[index].extend(future.result())
+    
+    return [
+        {"filename": item["filename"], "ok": not problems[index], "problems": problems[index]}
+        for index, item in enumerate(entries)
+    ]
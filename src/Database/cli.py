@@ -0,0 +1,85 @@
+"""
+备份维护命令
+
+用法（在 src 目录下运行）：
+    python -m Database.cli list --backup-dir .backup
+    python -m Database.cli verify --backup-dir .backup --workers 4
+    python -m Database.cli diff backup_A.txt backup_B.txt --keys --delta A_to_B.txt
+
+verify 并行校验清单中所有快照的大小和 sha256，损坏的快照会在清单中标记，
+之后启动时直接跳过；有快照校验失败时退出码为 1。
+
+diff 按键归并比较两个 line / bin 快照，输出每个表新增、删除、修改的键数；
+--keys 逐行列出键（"+ 表 键" / "- 表 键" / "~ 表 键"），--delta 把差异写成可应用的增量文件。
+有差异时退出码为 1。
+"""
+
+import argparse
+import sys
+
+from .backup import BackupManager
+
+
+def cmd_list(manager: BackupManager, args) -> int:
+    for backup in manager.list_backups():
+        status = "损坏" if backup["corrupt"] else ("完整" if backup["complete"] else "未完成")
+        print(f"{backup['filename']}\t{backup['size']}\t{backup['records']}\t{backup['created']}\t{status}")
+    return 0
+
+
+def cmd_verify(manager: BackupManager, args) -> int:
+    results = manager.verify_backups(workers=args.workers)
+    failed = 0
+    for result in results:
+        if result["ok"]:
+            print(f"OK    {result['filename']}")
+            continue
+        failed += 1
+        print(f"FAIL  {result['filename']}")
+        for problem in result["problems"]:
+            print(f"      {problem}")
+    print(f"共 {len(results)} 个备份，{failed} 个校验失败")
+    return 1 if failed else 0
+
+
+def cmd_diff(manager: BackupManager, args) -> int:
+    if len(args.backups) != 2:
+        print("diff 需要两个快照: diff <旧快照> <新快照>")
+        return 2
+    on_change = (lambda op, table, key: print(f"{op} {table} {key}")) if args.keys else None
+    try:
+        result = manager.diff(*args.backups, delta_path=args.delta, on_change=on_change)
+    except ValueError as e:
+        print(e)
+        return 2
+    for table_name, stats in result["tables"].items():
+        print(f"{table_name}\t+{stats['added']}\t-{stats['removed']}\t~{stats['changed']}")
+    print(f"{result['a']} -> {result['b']}: 新增 {result['added']}，删除 {result['removed']}，修改 {result['changed']}")
+    if result["delta"]:
+        print(f"增量文件: {result['delta']}")
+    return 1 if result["added"] or result["removed"] or result["changed"] else 0
+
+
+COMMANDS = {
+    "list": cmd_list,
+    "verify": cmd_verify,
+    "diff": cmd_diff,
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="备份维护命令")
+    parser.add_argument("command", choices=sorted(COMMANDS), help="命令")
+    parser.add_argument("backups", nargs="*", help="要比较的两个快照（diff，文件名相对于备份目录）")
+    parser.add_argument("--backup-dir", default=".backup", help="备份目录")
+    parser.add_argument("--workers", type=int, help="校验线程数（verify，默认按 CPU 核数）")
+    parser.add_argument("--keys", action="store_true", help="逐行列出有变化的键（diff）")
+    parser.add_argument("--delta", help="把差异写成增量文件（diff）")
+    args = parser.parse_args(argv)
+    
+    manager = BackupManager(backup_dir=args.backup_dir, memoize=False)
+    return COMMANDS[args.command](manager, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
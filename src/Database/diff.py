@@ -0,0 +1,201 @@
+"""
+比较两个全量快照
+- 快照中每个表的记录按键的字典序写入（写时复制快照按序遍历），两个快照可以同时顺序读取、
+  像归并排序一样逐键比较：时间 O(n)，内存只与单条记录有关，与快照大小无关
+- 支持 line / bin 格式（包括压缩文件和分片快照）；json / toml 需要整体解析，不支持
+- 两个快照格式相同时直接比较原始数据，不反序列化：line 比较 mime 和 valueline（不比较时间戳，
+  普通值的时间戳只是表头时间），bin 比较编码后的值；格式不同时统一转换成 valueline 比较
+- 两个快照中表的顺序相同时（同一个进程写出的快照总是如此）每个文件只读一遍，
+  否则按需从头重新读到所需的表
+
+产出的差异 (op, table, key, parts)：op 为 ADDED / REMOVED / CHANGED，parts 是新记录的
+(timestamp, mime, valueline)，可以直接写成增量文件中的数据行。
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Iterator, Optional, Tuple
+
+from . import binfmt, sharded
+
+ADDED = "+"
+REMOVED = "-"
+CHANGED = "~"
+
+# 快照文件名中的扩展名 -> 格式
+_FORMATS = {"txt": "line", "bin": "bin"}
+
+
+def backup_format(path: Path) -> str:
+    """由文件名 backup_<stamp>.<ext>[.gz|.xz] 判断格式"""
+    parts = Path(path).name.split(".")
+    if len(parts) < 2 or parts[1] not in _FORMATS:
+        raise ValueError(f"{Path(path).name}: 只能比较 line / bin 格式的快照")
+    return _FORMATS[parts[1]]
+
+
+def _line_records(path) -> Iterator[Tuple[str, str, Tuple[str, str, str]]]:
+    """line 格式：逐条产出 (table, key, (timestamp, mime, valueline))"""
+    from .backup import BackupManager, open_backup_file
+    table = None
+    with open_backup_file(path, "rt") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                table = None
+                continue
+            if line.startswith("Table "):
+                parts = line.split()
+                table = parts[1] if len(parts) >= 3 else None
+                continue
+            if table is None or not line.startswith("- "):
+                continue
+            parts = line[2:].split(" ", 2)
+            if len(parts) < 3:
+                continue
+            key, valueline = BackupManager._split_key(parts[2])
+            yield table, key, (parts[0], parts[1], valueline)
+
+
+def _bin_records(path) -> Iterator[Tuple[str, str, bytes]]:
+    """bin 格式：逐条产出 (table, key, 编码后的值)"""
+    from .backup import open_backup_file
+    with open_backup_file(path, "rb") as f:
+        yield from binfmt.iter_raw_records(f)
+
+
+_READERS = {"line": _line_records, "bin": _bin_records}
+
+
+def line_parts(format: str, raw) -> Tuple[Optional[str], str, str]:
+    """原始记录 -> (timestamp 或 None, mime, valueline)"""
+    if format == "line":
+        return raw
+    from .backup import BackupManager
+    value, _ = binfmt.decode_value(raw, 0)
+    timestamp, mime, valueline = BackupManager._encoded_line_parts(value)
+    return timestamp, mime, valueline.decode("utf-8")
+
+
+class _Source:
+    """一个全量快照：各表的记录数，以及按表读取记录的游标"""
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise ValueError(f"备份不存在: {self.path}")
+        self._shards = None
+        if self.path.is_dir():
+            manifest = sharded.read_manifest(self.path)
+            if manifest is None:
+                raise ValueError(f"{self.path.name}: 分片快照缺少清单")
+            self.format = manifest.get("format")
+            if self.format not in _READERS:
+                raise ValueError(f"{self.path.name}: 只能比较 line / bin 格式的快照")
+            self.tables = dict(manifest.get("tables", {}))
+            self._shards = manifest.get("shards", [])
+        else:
+            self.format = backup_format(self.path)
+            self.tables = self._table_counts()
+        self._stream = None
+        self._head = None
+    
+    def _table_counts(self):
+        """表名 -> 记录数（按文件中的顺序）：优先读 .meta，旧版本的快照扫描一遍"""
+        try:
+            with open(self.path.with_name(self.path.name + ".meta"), "r", encoding="utf-8") as f:
+                tables = json.load(f).get("tables")
+            if isinstance(tables, dict):
+                return {name: info.get("records", 0) for name, info in tables.items()}
+        except (OSError, ValueError, AttributeError):
+            pass
+        counts = {}
+        for table, _, _ in _READERS[self.format](self.path):
+            counts[table] = counts.get(table, 0) + 1
+        return counts
+    
+    def _reopen(self):
+        self.close()
+        self._stream = _READERS[self.format](self.path)
+        self._head = next(self._stream, None)
+    
+    def records(self, table: str) -> Iterator[Tuple[str, Any]]:
+        """按文件中的顺序产出表 table 的 (key, 原始记录)"""
+        if not self.tables.get(table):
+            return
+        if self._shards is not None:
+            # 同一个表的分片按键区间顺序排列
+            for shard in self._shards:
+                if shard["table"] != table:
+                    continue
+                for name, key, raw in _READERS[self.format](self.path / shard["file"]):
+                    if name == table:
+                        yield key, raw
+            return
+        if self._head is None or self._head[0] != table:
+            # 表的顺序与另一个快照不同：从头重新读到这个表
+            self._reopen()
+            while self._head is not None and self._head[0] != table:
+                self._head = next(self._stream, None)
+        while self._head is not None and self._head[0] == table:
+            yield self._head[1], self._head[2]
+            self._head = next(self._stream, None)
+    
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        self._head = None
+
+
+def _sorted_records(source: _Source, table: str) -> Iterator[Tuple[str, Any]]:
+    """检查键严格递增（旧版本按插入顺序写出的快照不能归并比较）"""
+    previous = None
+    for key, raw in source.records(table):
+        if previous is not None and key <= previous:
+            raise ValueError(
+                f"{source.path.name}: 表 {table} 的记录没有按键排序（{previous!r} 之后是 {key!r}），无法归并比较"
+            )
+        previous = key
+        yield key, raw
+
+
+def iter_diff(path_a, path_b) -> Iterator[Tuple[str, str, str, Optional[Tuple[Optional[str], str, str]]]]:
+    """按表、按键的顺序产出从快照 a 到快照 b 的差异 (op, table, key, parts)
+    
+    删除的键 parts 为 None。
+    
+    Raises:
+        ValueError: 快照不存在、格式不支持，或记录没有按键排序
+    """
+    a, b = _Source(path_a), _Source(path_b)
+    same_format = a.format == b.format
+    
+    def content(source, raw):
+        if same_format:
+            # line 不比较时间戳
+            return raw[1:] if source.format == "line" else raw
+        return line_parts(source.format, raw)[1:]
+    
+    try:
+        tables = list(a.tables) + [name for name in b.tables if name not in a.tables]
+        for table in tables:
+            old_records = _sorted_records(a, table)
+            new_records = _sorted_records(b, table)
+            old = next(old_records, None)
+            new = next(new_records, None)
+            while old is not None or new is not None:
+                if new is None or (old is not None and old[0] < new[0]):
+                    yield REMOVED, table, old[0], None
+                    old = next(old_records, None)
+                elif old is None or new[0] < old[0]:
+                    yield ADDED, table, new[0], line_parts(b.format, new[1])
+                    new = next(new_records, None)
+                else:
+                    if content(a, old[1]) != content(b, new[1]):
+                        yield CHANGED, table, new[0], line_parts(b.format, new[1])
+                    old = next(old_records, None)
+                    new = next(new_records, None)
+    finally:
+        a.close()
+        b.close()
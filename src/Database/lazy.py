@@ -0,0 +1,178 @@
+"""
+line 格式备份的延迟加载
+- 启动时只建立 key -> (offset, length, mime, timestamp) 索引，不解析 value
+- 备份文件通过 mmap 映射，记录在第一次 Table.get 时才反序列化
+- 索引以 sidecar 文件 backup_*.txt.idx 保存，下次启动连索引都不用重建
+- 可选后台线程预热剩余记录
+"""
+
+import json
+import mmap
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from Common.base import entry
+
+
+class LazyRecord:
+    """尚未反序列化的表记录，指向备份文件中的一段 valueline"""
+    
+    __slots__ = ("source", "offset", "length", "mime", "timestamp")
+    
+    def __init__(self, source: "LineBackupIndex", offset: int, length: int, mime: str, timestamp: str):
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self.mime = mime
+        self.timestamp = timestamp
+    
+    def valueline(self) -> str:
+        """原始 valueline 文本（重新写备份时可以直接拷贝，无需反序列化）"""
+        return self.source.read(self.offset, self.length)
+    
+    def materialize(self):
+        """反序列化为 entry 对象（或 raw 数据）"""
+        from .backup import decode_record_value
+        value = decode_record_value(self.mime, self.valueline())
+        if isinstance(value, entry) and self.timestamp:
+            try:
+                value.lastModifiedTime = datetime.strptime(self.timestamp, "%Y%m%d%H%M%S")
+            except ValueError:
+                pass
+        return value
+
+
+class LineBackupIndex:
+    """line 格式备份文件的 mmap 视图与记录索引"""
+    
+    def __init__(self, path: Path, tables: Dict[str, List[list]], mm: Optional[mmap.mmap]):
+        self.path = path
+        self.tables = tables  # table_name -> [[key, offset, length, mime, timestamp], ...]
+        self._mm = mm
+    
+    @staticmethod
+    def sidecar_path(path: Path) -> Path:
+        return path.with_name(path.name + ".idx")
+    
+    @classmethod
+    def open(cls, path) -> "LineBackupIndex":
+        """映射备份文件；sidecar 索引有效时直接读取，否则扫描文件建立索引"""
+        path = Path(path)
+        with open(path, "rb") as f:
+            size = f.seek(0, 2)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        
+        tables = cls._load_sidecar(path, size)
+        if tables is None:
+            tables = cls._scan(mm) if mm is not None else {}
+        return cls(path, tables, mm)
+    
+    @classmethod
+    def _load_sidecar(cls, path: Path, size: int) -> Optional[Dict[str, List[list]]]:
+        sidecar = cls.sidecar_path(path)
+        try:
+            with open(sidecar, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # sidecar 与备份文件不匹配（例如备份被手动编辑过）时重建
+        if data.get("size") != size:
+            return None
+        return data.get("tables", {})
+    
+    @staticmethod
+    def write_sidecar(path: Path, size: int, tables: Dict[str, List[list]]):
+        """备份写入时顺带保存索引"""
+        sidecar = LineBackupIndex.sidecar_path(Path(path))
+        with open(sidecar, "w", encoding="utf-8") as f:
+            json.dump({"size": size, "tables": tables}, f, ensure_ascii=False, separators=(',', ':'))
+    
+    @staticmethod
+    def _scan(mm: mmap.mmap) -> Dict[str, List[list]]:
+        """扫描整个文件建立索引，只切分行首字段，不解析 valueline"""
+        tables = {}
+        current = None
+        pos = 0
+        end = len(mm)
+        while pos < end:
+            nl = mm.find(b"\n", pos)
+            if nl == -1:
+                nl = end
+            if mm[pos:pos + 2] == b"- " and current is not None:
+                # 数据行: - timestamp mime keyname valueline
+                line = mm[pos + 2:nl]
+                first = line.find(b" ")
+                second = line.find(b" ", first + 1)
+                i = second + 1
+                while i < len(line):
+                    if line[i:i + 2] == b"\\ ":
+                        i += 2
+                        continue
+                    if line[i:i + 1] == b" ":
+                        break
+                    i += 1
+                if first > 0 and second > first and i < len(line):
+                    keyname = line[second + 1:i].decode("utf-8").replace("\\ ", " ")
+                    value_start = pos + 2 + i + 1
+                    current.append([
+                        keyname,
+                        value_start,
+                        nl - value_start,
+                        line[first + 1:second].decode("utf-8"),
+                        line[:first].decode("utf-8"),
+                    ])
+            elif mm[pos:pos + 6] == b"Table ":
+                parts = mm[pos:nl].decode("utf-8").split()
+                current = tables.setdefault(parts[1], []) if len(parts) >= 3 else None
+            elif pos == nl or not mm[pos:nl].strip():
+                current = None
+            pos = nl + 1
+        return tables
+    
+    def read(self, offset: int, length: int) -> str:
+        return self._mm[offset:offset + length].decode("utf-8").rstrip("\r")
+    
+    def record_count(self) -> int:
+        return sum(len(records) for records in self.tables.values())
+    
+    def install(self, tables_dict: Dict[str, Any], log=None) -> int:
+        """把延迟记录放入表中（同名键会被覆盖），返回放入的记录数"""
+        installed = 0
+        for table_name, records in self.tables.items():
+            table = tables_dict.get(table_name)
+            if table is None or not hasattr(table, 'inner'):
+                if log:
+                    log(f"  警告: 表 {table_name} 不存在，跳过")
+                continue
+            if log:
+                log(f"  恢复表: {table_name}（延迟加载）")
+            if hasattr(table, 'invalidate_index'):
+                table.invalidate_index()
+            # 只有内存表能保存延迟记录，其他存储引擎直接写入反序列化后的值
+            lazy = isinstance(table.inner, dict)
+            for keyname, offset, length, mime, timestamp in records:
+                record = LazyRecord(self, offset, length, mime, timestamp)
+                table.inner[keyname] = record if lazy else record.materialize()
+                installed += 1
+        return installed
+    
+    def start_warm_up(self, tables_dict: Dict[str, Any]) -> threading.Thread:
+        """后台逐条反序列化剩余的延迟记录"""
+        thread = threading.Thread(target=self._warm_up, args=(tables_dict,), daemon=True)
+        thread.start()
+        return thread
+    
+    def _warm_up(self, tables_dict: Dict[str, Any]):
+        for table_name in list(self.tables.keys()):
+            table = tables_dict.get(table_name)
+            # 只有内存表中放的是延迟记录；遍历其他引擎会把整表读入内存
+            if table is None or not hasattr(table, 'materialize') or not isinstance(table.inner, dict):
+                continue
+            for keyname, value in list(table.inner.items()):
+                if type(value) is LazyRecord and value.source is self:
+                    table.materialize(keyname, value)
+                    # 让出 GIL，避免拖慢请求处理
+                    time.sleep(0)
@@ -0,0 +1,106 @@
+"""
+表数据的 NDJSON 导入 / 导出：每行一个 JSON 对象
+    {"key": "readme", "mime": "text", "time": "2025-11-08T18:26:50", "value": {...}}
+- mime 为 "raw" 表示普通值（不是 entry），此时没有 time
+- value 与 line 格式备份中的 valueline 相同（entry.to_line() 的 JSON）
+- 导出遍历写时复制快照，按键的字典序分块产出，不复制整个表
+- 导入逐批解析和写入，内存占用只与批大小有关，与记录总数无关
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+from Common.base import entry
+
+from .backup import BackupManager, get_entry_class, restore_entry
+from .lazy import LazyRecord
+
+# 导出时每次产出的字节数
+CHUNK = 1 << 16
+
+# 导入时每批写入的记录数
+BATCH = 1000
+
+
+def _time_of(value) -> Optional[str]:
+    """记录的 lastModifiedTime（ISO 格式）"""
+    if isinstance(value, LazyRecord):
+        try:
+            return datetime.strptime(value.timestamp, "%Y%m%d%H%M%S").isoformat()
+        except (TypeError, ValueError):
+            return None
+    modified = getattr(value, 'lastModifiedTime', None) if isinstance(value, entry) else None
+    if isinstance(modified, datetime):
+        return modified.isoformat()
+    return modified or None
+
+
+def encode_record(key: str, value: Any) -> bytes:
+    """一条记录对应的 NDJSON 行（含换行符）"""
+    _, mime, valueline = BackupManager._encoded_line_parts(value)
+    head = {"key": key, "mime": mime}
+    if mime != "raw":
+        head["time"] = _time_of(value)
+    # value 已经是单行 JSON，直接拼接，不再解析
+    prefix = json.dumps(head, ensure_ascii=False, separators=(',', ':'))[:-1]
+    return prefix.encode("utf-8") + b',"value":' + valueline + b'}\n'
+
+
+def decode_record(line) -> Tuple[str, Any]:
+    """encode_record 的逆操作，返回 (key, value)"""
+    data = json.loads(line)
+    if not isinstance(data, dict) or not isinstance(data.get("key"), str) or "value" not in data:
+        raise ValueError("每行必须是包含字符串 key 和 value 的 JSON 对象")
+    mime = data.get("mime") or "raw"
+    value = data["value"]
+    if mime == "raw":
+        return data["key"], value
+    
+    entry_class = get_entry_class(mime)
+    if entry_class.from_line.__func__ is not entry.from_line.__func__:
+        # 子类自定义了 valueline 的解析
+        value = entry_class.from_line(json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+    record = restore_entry(mime, value)
+    if data.get("time"):
+        record.lastModifiedTime = datetime.fromisoformat(data["time"])
+    return data["key"], record
+
+
+def iter_export(table, chunk: int = CHUNK) -> Iterator[bytes]:
+    """在写时复制快照上按键的字典序遍历，每次产出约 chunk 字节的 NDJSON"""
+    with table.snapshot() as snapshot:
+        buffer = bytearray()
+        for key, value in snapshot.items():
+            buffer += encode_record(key, value)
+            if len(buffer) >= chunk:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+
+def import_lines(table, lines: Iterable[bytes], first_line: int = 1) -> Tuple[int, Optional[int]]:
+    """解析一批 NDJSON 行并通过 Table.set_many 写入（不等待日志落盘）
+    
+    Args:
+        table: 目标表
+        lines: 一批行（不含换行符），空行被忽略
+        first_line: 第一行的行号，用于错误信息
+    
+    Returns:
+        (写入的记录数, 最后一条记录的日志序号)；日志序号交给 Table.wait_durable()
+    
+    Raises:
+        ValueError: 某一行无法解析（这一批都不会写入）
+    """
+    records = []
+    for number, line in enumerate(lines, first_line):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(decode_record(line))
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValueError(f"第 {number} 行: {e}")
+    return len(records), table.set_many(records, wait=False)
@@ -0,0 +1,168 @@
+"""
+自动备份的调度
+- 固定间隔（默认）：与以前一样，每隔 interval 秒检查一次，有表需要备份就备份
+- 自适应：测量每次快照（全量 / 增量分别统计）的耗时和脏键的增长速率，在
+  [min_interval, max_interval] 内选择间隔：
+    * 快照耗时占比不超过 max_overhead：两次备份至少相隔 cost / max_overhead 秒（但不超过 max_interval）
+    * 未保存的写入最多 max_interval 秒（数据丢失窗口的上限）
+    * 未保存的脏键最多约 max_dirty_keys 个：按上一轮的脏键速率预测达到上限的时间
+  只有少数键在反复更新时（例如计时器每秒更新 TIMER），脏键数量很少，间隔会放宽到 max_interval
+- debounce > 0 时启用延迟写回：一阵集中写入（至少产生 debounce_keys 个脏键）结束、
+  脏键数 debounce 秒不再增长后立即备份，不必等到下一个间隔；反复更新同一批键的持续写入不算
+
+写入次数取自各表的 _version（每次 set/delete 加一），脏键数取自 _dirty_keys / _deleted_keys，
+写入路径上没有额外开销。
+"""
+
+from typing import Any, Dict, Optional
+
+# 估计快照耗时、脏键速率时新样本的权重
+_EWMA = 0.3
+
+
+def _ewma(old: Optional[float], sample: float) -> float:
+    return sample if old is None else old + _EWMA * (sample - old)
+
+
+class BackupScheduler:
+    """决定自动备份线程何时写下一个快照"""
+    
+    def __init__(self, interval: float, adaptive: bool = False, min_interval: float = 1.0,
+                 max_interval: float = None, max_dirty_keys: int = 1000,
+                 max_overhead: float = 0.02, debounce: float = 0.0, debounce_keys: int = 100):
+        """
+        Args:
+            interval: 固定间隔（秒）；自适应模式下是 max_interval 的默认值
+            adaptive: 是否按快照耗时和脏键速率自适应地选择间隔
+            min_interval: 自适应模式下两次备份的最小间隔，也是延迟写回的最小间隔
+            max_interval: 自适应模式下两次备份的最大间隔，即数据丢失窗口的上限
+            max_dirty_keys: 自适应模式下允许积累的未保存脏键数
+            max_overhead: 自适应模式下快照耗时占总时间的比例上限
+            debounce: 大于 0 时，集中写入结束这么多秒后立即备份
+            debounce_keys: 未保存的脏键至少有这么多个才算一阵集中写入
+        """
+        self.interval = interval
+        self.adaptive = adaptive
+        self.min_interval = min_interval
+        self.max_interval = max_interval if max_interval is not None else interval
+        self.max_dirty_keys = max(1, max_dirty_keys)
+        self.max_overhead = max_overhead
+        self.debounce = debounce
+        self.debounce_keys = max(1, debounce_keys)
+        
+        self._cost = {"full": None, "delta": None}   # 快照耗时（秒）的滑动平均
+        self._dirty_rate = None                      # 上一轮每秒新增的脏键数
+        self._last_end = float("-inf")               # 上次备份结束的时间（time.monotonic()）
+        self._writes = None                          # 最近一次观察到的写入计数
+        self._write_rate = 0.0                       # 每秒写入次数的滑动平均
+        self._sampled = None                         # 最近一次观察的时间
+        self._pending = 0                            # 未保存的脏键数
+        self._pending_since = None                   # 脏键数最近一次变化的时间
+        self.last_reason = None
+        self.counts = {}                             # 备份原因 -> 次数
+    
+    @staticmethod
+    def _sample(tables_dict: Dict[str, Any]):
+        """(是否有表需要备份, 未保存的脏键数, 写入计数)"""
+        dirty = False
+        pending = 0
+        writes = 0
+        for table in list(tables_dict.values()):
+            if getattr(table, '_sync_required', True):
+                dirty = True
+            pending += len(getattr(table, '_dirty_keys', ())) + len(getattr(table, '_deleted_keys', ()))
+            writes += getattr(table, '_version', 0)
+        return dirty, pending, writes
+    
+    def _observe(self, tables_dict: Dict[str, Any], now: float) -> bool:
+        dirty, pending, writes = self._sample(tables_dict)
+        if self._sampled is not None and now > self._sampled:
+            self._write_rate = _ewma(self._write_rate, (writes - self._writes) / (now - self._sampled))
+        if self._pending_since is None or pending != self._pending:
+            self._pending_since = now
+        self._writes = writes
+        self._sampled = now
+        self._pending = pending
+        return dirty
+    
+    def floor(self, kind: str) -> float:
+        """自适应模式下两次备份的最小间隔：快照耗时占比不超过 max_overhead
+        
+        与数据丢失窗口冲突时以 max_interval 为准。
+        """
+        if not self.adaptive:
+            return 0.0
+        cost = self._cost.get(kind)
+        if cost is None or self.max_overhead <= 0:
+            return self.min_interval
+        return min(self.max_interval, max(self.min_interval, cost / self.max_overhead))
+    
+    def target_interval(self, kind: str) -> float:
+        """当前选择的备份间隔（秒）"""
+        if not self.adaptive:
+            return self.interval
+        interval = self.max_interval
+        if self._dirty_rate:
+            # 按脏键速率，积累到 max_dirty_keys 所需的时间
+            interval = min(interval, self.max_dirty_keys / self._dirty_rate)
+        return min(self.max_interval, max(self.floor(kind), interval))
+    
+    def due(self, tables_dict: Dict[str, Any], now: float, kind: str = "full") -> Optional[str]:
+        """现在是否应该备份；返回原因（"interval" / "dirty" / "debounce"）或 None
+        
+        Args:
+            tables_dict: 表字典
+            now: time.monotonic()
+            kind: 这次会写 "full" 还是 "delta"（两者耗时差别很大）
+        """
+        if not self._observe(tables_dict, now):
+            return None
+        elapsed = now - self._last_end
+        if elapsed < self.floor(kind):
+            return None
+        if elapsed >= self.target_interval(kind):
+            return "interval"
+        if elapsed < self.min_interval:
+            return None
+        if self.adaptive and self._pending >= self.max_dirty_keys:
+            return "dirty"
+        if (self.debounce > 0 and self._pending >= self.debounce_keys
+                and now - self._pending_since >= self.debounce):
+            return "debounce"
+        return None
+    
+    def record(self, kind: str, started: float, finished: float, reason: str = None):
+        """一次备份完成（started / finished 为 time.monotonic()）"""
+        self._cost[kind] = _ewma(self._cost[kind], finished - started)
+        if self._last_end != float("-inf") and started > self._last_end:
+            self._dirty_rate = _ewma(self._dirty_rate, self._pending / (started - self._last_end))
+        self._last_end = finished
+        self.last_reason = reason
+        if reason:
+            self.counts[reason] = self.counts.get(reason, 0) + 1
+    
+    def next_wait(self) -> float:
+        """到下一次检查要等待的秒数"""
+        if not self.adaptive and self.debounce <= 0:
+            return self.interval
+        tick = 1.0
+        if self.debounce > 0:
+            tick = min(tick, max(0.05, self.debounce / 2))
+        return min(tick, self.min_interval) if self.min_interval > 0 else tick
+    
+    def info(self) -> Dict[str, Any]:
+        return {
+            "adaptive": self.adaptive,
+            "interval": self.target_interval("full"),
+            "delta_interval": self.target_interval("delta"),
+            "min_interval": self.min_interval,
+            "max_interval": self.max_interval,
+            "debounce": self.debounce,
+            "debounce_keys": self.debounce_keys,
+            "cost": dict(self._cost),
+            "dirty_rate": self._dirty_rate,
+            "write_rate": self._write_rate,
+            "pending": self._pending,
+            "last_reason": self.last_reason,
+            "backups": dict(self.counts),
+        }
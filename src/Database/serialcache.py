@@ -0,0 +1,67 @@
+"""
+记录序列化结果的缓存（每个 Table 一个）
+- 每次备份都要把全部记录重新序列化，而两次备份之间绝大多数记录并没有变化
+- 缓存 key -> (值对象, 版本, 形式, 序列化结果)；值对象仍是同一个、且版本未变时直接复用
+- 版本：entry 的 _version（每次给 value 赋值加一）和 lastModifiedTime；其他值按不可变约定只看对象身份
+
+只缓存基类 entry 和 dict / list：entry 子类可能覆写 to_dict / to_line（例如每次生成内容），
+延迟加载的记录本身就保存着原始 valueline。
+"""
+
+from typing import Any, Dict, Optional
+
+from Common.base import entry
+
+# 不同备份格式使用的序列化形式
+FORM_LINE = "line"      # (记录时间戳或 None, mime, valueline 的 UTF-8 字节)
+FORM_BIN = "bin"        # binfmt 编码后的值
+FORM_DICT = "dict"      # serialize_value() 的结果（json / toml）
+
+
+def memoizable(value) -> bool:
+    kind = type(value)
+    return kind is entry or kind is dict or kind is list
+
+
+def _version_of(value):
+    if type(value) is entry:
+        return value._version, value.lastModifiedTime
+    return None
+
+
+class SerializedCache:
+    """某个表中各记录最近一次的序列化结果，以及命中 / 未命中计数"""
+    
+    def __init__(self):
+        self._items = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def get(self, key, value, form: str) -> Optional[Any]:
+        """value 自上次缓存以来未变化时返回缓存的序列化结果，否则返回 None"""
+        if not memoizable(value):
+            return None
+        cached = self._items.get(key)
+        if (cached is not None and cached[0] is value and cached[2] == form
+                and cached[1] == _version_of(value)):
+            self.hits += 1
+            return cached[3]
+        self.misses += 1
+        return None
+    
+    def put(self, key, value, form: str, serialized):
+        if memoizable(value):
+            self._items[key] = (value, _version_of(value), form, serialized)
+    
+    def discard(self, key):
+        """键被覆盖或删除时调用，及早释放旧值"""
+        self._items.pop(key, None)
+    
+    def clear(self):
+        self._items.clear()
+    
+    def info(self) -> Dict[str, int]:
+        return {"entries": len(self._items), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,190 @@
+"""
+分片全量快照：按表和键区间切分，由 ProcessPoolExecutor 的工作进程并行序列化 / 反序列化
+
+目录结构（整个目录先写在 <name>.tmp 下，完成后原子地重命名）：
+    backup_<stamp>.<ext>.d/
+        manifest.json                 分片清单，最后写入
+        shard_0000.<ext>[.gz|.xz]     每个分片是一个普通的全量快照文件，只包含一个表的一段键
+        ...
+
+manifest.json:
+    {"format": "line", "compression": null, "created": "...",
+     "tables": {"main": 120000, ...},
+     "shards": [{"file": "shard_0000.txt", "table": "main", "records": 50000,
+                 "first_key": "...", "last_key": "...", "size": ..., "raw_size": ...,
+                 "sha256": "...", "tables": {...}}, ...]}
+
+工作进程函数必须位于模块顶层，才能被 ProcessPoolExecutor 调用。
+进程池与 Common.sandbox 一样由 forkserver（不支持时用 spawn）创建，不从多线程的服务进程直接 fork；
+工作进程启动时先导入注册了 entry 子类的模块，按 mime 还原出的类与服务进程中相同。
+"""
+
+import importlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from Common.base import entry
+
+from .lazy import LazyRecord
+
+MANIFEST = "manifest.json"
+
+# 分片目录的后缀（接在 backup_<stamp>.<ext> 之后）
+SHARDED_SUFFIX = ".d"
+
+
+def pool_context():
+    """与脚本进程池共用同一个 forkserver（不支持时用 spawn）"""
+    from Common.sandbox import pool_context as sandbox_pool_context
+    return sandbox_pool_context()
+
+
+def entry_modules() -> List[str]:
+    """注册了 entry 子类的模块（不含无法在工作进程中导入的 __main__）"""
+    from .backup import _ENTRY_CLASS_REGISTRY
+    return sorted({cls.__module__ for cls in _ENTRY_CLASS_REGISTRY.values()} - {"__main__"})
+
+
+def init_worker(modules: List[str]):
+    """（工作进程）导入 entry 子类所在的模块，使它们注册到备份系统"""
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"分片工作进程导入 {name} 失败: {e}")
+
+
+def executor(workers: int) -> ProcessPoolExecutor:
+    """创建分片读写使用的进程池"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(),
+                               initializer=init_worker, initargs=(entry_modules(),))
+
+
+# 可以直接 pickle 给工作进程的值类型
+_PLAIN_TYPES = (entry, dict, list, str, int, float, bool, type(None))
+
+
+class FrozenEntry(entry):
+    """无法 pickle 的 entry 子类（例如持有 Generator 的 GenFile）在父进程中预先序列化后的替身
+    
+    to_dict() / to_line() 返回原对象的结果，写出的分片与直接序列化原对象相同。
+    """
+    
+    __slots__ = ("_dict", "_line")
+    
+    def to_dict(self):
+        return self._dict
+    
+    def to_line(self):
+        return self._line
+
+
+def freeze(value: entry, format: str) -> FrozenEntry:
+    """只计算当前格式用得到的序列化形式"""
+    frozen = FrozenEntry(value.mime, None)
+    frozen.lastModifiedTime = value.lastModifiedTime
+    frozen._line = value.to_line() if format == "line" else None
+    frozen._dict = None if format == "line" else value.to_dict()
+    return frozen
+
+
+# entry 子类 -> 它的实例能否 pickle；每个类型只试一次，之后交给 pool.submit 时只 pickle 一遍
+_picklable_types: Dict[type, bool] = {}
+
+
+def _picklable(value) -> bool:
+    picklable = _picklable_types.get(type(value))
+    if picklable is None:
+        try:
+            pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            picklable = True
+        except Exception:
+            picklable = False
+        _picklable_types[type(value)] = picklable
+    return picklable
+
+
+def iter_chunks(snapshot, shard_size: int, format: str) -> Iterator[Dict[str, Any]]:
+    """按快照的遍历顺序（键的字典序）把记录切成最多 shard_size 条一段
+    
+    延迟加载的记录持有 mmap，不能传给工作进程，在这里反序列化；
+    不能 pickle 的 entry 子类在这里预先序列化。
+    """
+    chunk = {}
+    for key, value in snapshot.items():
+        if isinstance(value, LazyRecord):
+            value = value.materialize()
+        elif type(value) not in _PLAIN_TYPES and isinstance(value, entry) and not _picklable(value):
+            value = freeze(value, format)
+        chunk[key] = value
+        if len(chunk) >= shard_size:
+            yield chunk
+            chunk = {}
+    if chunk:
+        yield chunk
+
+
+def write_shard(format: str, compression: Optional[str], path: str,
+                table_name: str, records: Dict[str, Any]) -> Dict[str, Any]:
+    """（工作进程）把一段记录写成分片文件，返回它在清单中的条目"""
+    from .backup import BackupManager
+    path = Path(path)
+    manager = BackupManager(backup_dir=str(path.parent), format=format,
+                            compression=compression, memoize=False)
+    manager._write_full_backup({table_name: records}, path)
+    meta = manager._read_meta(path)
+    keys = list(records)
+    return {
+        "file": path.name,
+        "table": table_name,
+        "records": len(records),
+        "first_key": keys[0] if keys else None,
+        "last_key": keys[-1] if keys else None,
+        "size": meta.get("size"),
+        "raw_size": meta.get("raw_size"),
+        "sha256": meta.get("sha256"),
+        "tables": meta.get("tables"),
+    }
+
+
+def read_shard(format: str, path: str, table_name: str) -> Dict[str, Any]:
+    """（工作进程）读取一个分片文件，返回 {key: value}"""
+    from .backup import BackupManager, open_backup_file
+    path = Path(path)
+    manager = BackupManager(backup_dir=str(path.parent), format=format, memoize=False)
+    if format == "line":
+        sink = SimpleNamespace(inner={})
+        with open_backup_file(path, "rt") as f:
+            manager._apply_line_records(f, {table_name: sink})
+        return sink.inner
+    return manager._read_backup_tables(path).get(table_name, {})
+
+
+def write_manifest(directory: Path, manifest: Dict[str, Any]):
+    """写入清单并落盘；清单存在即表示全部分片已写完"""
+    path = directory / MANIFEST
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_manifest(directory: Path) -> Optional[Dict[str, Any]]:
+    """读取清单；不存在或损坏时返回 None"""
+    try:
+        with open(Path(directory) / MANIFEST, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def manifest_sizes(manifest: Dict[str, Any]) -> Tuple[int, int]:
+    """(磁盘大小, 原始大小) 的合计"""
+    shards = manifest.get("shards", [])
+    return (sum(shard.get("size") or 0 for shard in shards),
+            sum(shard.get("raw_size") or 0 for shard in shards))
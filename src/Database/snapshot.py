@@ -0,0 +1,121 @@
+"""
+表的写时复制（copy-on-write）快照
+- 打开快照是 O(1) 的：只在表上登记，不复制数据
+- 快照打开期间，写入方在覆盖或删除某个键之前先把旧值保存到快照中（每个键只保存一次）
+- 读取时按键的字典序分批遍历，每批只短暂持有表锁，写入方不会被整表复制阻塞
+- 读到的是打开快照那一刻的数据：之后新增的键被跳过，之后删除的键仍然可见
+- 表的内容被整体替换（恢复备份）之前，快照复制出自己的数据并与表脱离
+
+约定：表中的值被视为不可变对象，修改时应复制后重新 set()，不要原地修改。
+"""
+
+from bisect import bisect_right, insort
+from typing import Any, Iterator, Optional, Tuple
+
+# 快照打开时键不存在
+_MISSING = object()
+
+
+class TableSnapshot:
+    """Table 在某一时刻的只读视图，用完后需要 close()（或使用 with 语句）"""
+    
+    def __init__(self, table, version: int, size: int):
+        self.table = table
+        self.name = table.name
+        self.version = version      # 打开快照时表的版本号
+        self.size = size            # 打开快照时的记录数
+        self._preimages = {}        # key -> 快照时刻的值（或 _MISSING）
+        self._removed = []          # 快照打开后被删除、但快照中存在的键（有序）
+        self._frozen = None         # 与表脱离后快照自己的数据（见 _freeze）
+        self._frozen_keys = None
+        self._closed = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def __len__(self):
+        return self.size
+    
+    def close(self):
+        """注销快照，之后的写入不再为其保存旧值"""
+        if not self._closed:
+            self._closed = True
+            self.table._release_snapshot(self)
+            self._preimages = {}
+            self._removed = []
+            self._frozen = None
+            self._frozen_keys = None
+    
+    def _freeze(self):
+        """表的内容即将被整体替换：复制出快照时刻的数据，之后不再读表；调用方需持有表的 _write_lock"""
+        view = dict(self.table.inner.items())
+        for key, value in self._preimages.items():
+            if value is _MISSING:
+                view.pop(key, None)
+            else:
+                view[key] = value
+        self._frozen = view
+        self._frozen_keys = sorted(view)
+        self._preimages = {}
+        self._removed = []
+    
+    def _before_write(self, key, deleting: bool):
+        """写入方在修改 key 之前调用；调用方需持有表的 _write_lock"""
+        if key in self._preimages:
+            return
+        old = self.table.inner.get(key, _MISSING)
+        self._preimages[key] = old
+        if deleting and old is not _MISSING:
+            insort(self._removed, key)
+    
+    def _value_of(self, key) -> Any:
+        """快照时刻 key 的值；调用方需持有表的 _write_lock"""
+        if self._frozen is not None:
+            return self._frozen.get(key, _MISSING)
+        if key in self._preimages:
+            return self._preimages[key]
+        return self.table.inner.get(key, _MISSING)
+    
+    def get(self, key, otherwise=None):
+        """读取快照时刻 key 的值（延迟加载的记录原样返回）"""
+        with self.table._write_lock:
+            value = self._value_of(key)
+        return otherwise if value is _MISSING else value
+    
+    def items(self, batch: int = 1024) -> Iterator[Tuple[str, Any]]:
+        """按键的字典序遍历快照中的 (key, value)"""
+        if self._closed:
+            raise RuntimeError("快照已关闭")
+        table = self.table
+        cursor = None
+        while True:
+            with table._write_lock:
+                keys = self._frozen_keys if self._frozen is not None else table._key_index()
+                start = bisect_right(keys, cursor) if cursor is not None else 0
+                chunk = keys[start:start + batch]
+                last = chunk[-1] if len(chunk) == batch else None
+                removed = self._removed_between(cursor, last)
+                if removed:
+                    chunk = sorted(set(chunk).union(removed))
+                pairs = []
+                for key in chunk:
+                    value = self._value_of(key)
+                    if value is not _MISSING:
+                        pairs.append((key, value))
+            yield from pairs
+            if last is None:
+                return
+            cursor = last
+    
+    def keys(self) -> Iterator[str]:
+        for key, _ in self.items():
+            yield key
+    
+    def _removed_between(self, low: Optional[str], high: Optional[str]) -> list:
+        """(low, high] 区间内快照打开后被删除的键；None 表示不设界"""
+        start = bisect_right(self._removed, low) if low is not None else 0
+        end = bisect_right(self._removed, high) if high is not None else len(self._removed)
+        return self._removed[start:end]
@@ -0,0 +1,286 @@
+"""
+Table 的存储引擎
+- "memory"：普通 dict（默认），数据全部在内存中，由备份系统持久化
+- "sqlite"：标准库 sqlite3，每个表一个数据库文件，按键存储序列化后的记录，
+  内存中只保留有限数量的已反序列化对象（LRU）
+
+引擎是一个 MutableMapping，作为 Table.inner 使用；Table 的其余逻辑（分片锁、
+WAL、变更跟踪、有序键索引）与引擎无关。
+"""
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, Tuple
+
+from Common.base import entry
+
+# sqlite 数据库文件所在目录
+STORAGE_DIR = os.getenv("TEXUS_STORAGE_DIR", ".storage")
+
+_MISSING = object()
+
+# 遍历 SQLiteStore 时每次查询的键数
+ITER_BATCH = 1024
+
+
+def create_store(engine, table_name: str):
+    """根据引擎配置创建 Table.inner
+    
+    Args:
+        engine: None / "memory"、"sqlite"、一个 MutableMapping 实例，
+                或者接收表名、返回 MutableMapping 的可调用对象
+        table_name: 表名（sqlite 引擎用作文件名）
+    """
+    if engine is None or engine == "memory":
+        return {}
+    if engine == "sqlite":
+        return SQLiteStore(Path(STORAGE_DIR) / f"{table_name}.sqlite3")
+    if isinstance(engine, MutableMapping):
+        return engine
+    if callable(engine):
+        return engine(table_name)
+    raise ValueError(f"未知的存储引擎: {engine!r}")
+
+
+def engine_name(store) -> str:
+    """存储引擎名称，用于展示"""
+    return "memory" if isinstance(store, dict) else getattr(store, "engine", type(store).__name__)
+
+
+def _encode(value) -> Tuple[str, str, str]:
+    """值 -> (mime, timestamp, valueline)，与 line 格式备份使用相同的编码"""
+    from .backup import encode_record_value
+    mime, valueline = encode_record_value(value)
+    timestamp = ""
+    if isinstance(value, entry) and isinstance(value.lastModifiedTime, datetime):
+        timestamp = value.lastModifiedTime.strftime("%Y%m%d%H%M%S")
+    return mime, timestamp, valueline
+
+
+def _decode(mime: str, timestamp: str, valueline: str):
+    from .backup import decode_record_value
+    value = decode_record_value(mime, valueline)
+    if timestamp and isinstance(value, entry):
+        try:
+            value.lastModifiedTime = datetime.strptime(timestamp, "%Y%m%d%H%M%S")
+        except ValueError:
+            pass
+    return value
+
+
+class SQLiteStore(MutableMapping):
+    """以 SQLite 文件保存的表数据，带有限大小的反序列化缓存"""
+    
+    engine = "sqlite"
+    # 数据本身已经持久化：启动时不需要再从备份加载（空库除外）
+    persistent = True
+    
+    def __init__(self, path, cache_size: int = 1024):
+        """
+        Args:
+            path: 数据库文件路径
+            cache_size: 内存中最多保留多少个已反序列化的值
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn = self._connect()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "key TEXT PRIMARY KEY, mime TEXT NOT NULL, ts TEXT NOT NULL, value TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        # COUNT(*) 需要全表扫描，记录数在内存中维护
+        self._count = self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+    
+    def _connect(self, readonly: bool = False) -> sqlite3.Connection:
+        if readonly:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True,
+                                   isolation_level=None, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    # ------------------------------------------------------------------
+    # 缓存
+    # ------------------------------------------------------------------
+    
+    def _remember(self, key, value):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+    
+    def _load(self, key):
+        with self._lock:
+            value = self._cache.get(key, _MISSING)
+            if value is not _MISSING:
+                self._cache.move_to_end(key)
+                return value
+            row = self._conn.execute("SELECT mime, ts, value FROM kv WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return _MISSING
+            value = _decode(*row)
+            self._remember(key, value)
+            return value
+    
+    # ------------------------------------------------------------------
+    # MutableMapping
+    # ------------------------------------------------------------------
+    
+    def __getitem__(self, key):
+        value = self._load(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+    
+    def get(self, key, default=None):
+        value = self._load(key)
+        return default if value is _MISSING else value
+    
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._cache:
+                return True
+            return self._conn.execute("SELECT 1 FROM kv WHERE key = ?", (key,)).fetchone() is not None
+    
+    def __setitem__(self, key, value):
+        mime, timestamp, valueline = _encode(value)
+        with self._lock:
+            exists = key in self
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, mime, ts, value) VALUES (?, ?, ?, ?)",
+                (key, mime, timestamp, valueline),
+            )
+            if not exists:
+                self._count += 1
+            self._remember(key, value)
+    
+    def __delitem__(self, key):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            self._cache.pop(key, None)
+            if cursor.rowcount == 0:
+                raise KeyError(key)
+            self._count -= 1
+    
+    def __iter__(self) -> Iterator[str]:
+        """按键的字典序分批遍历（以上一批最后一个键为游标），不一次取出全部键，也不长期持有游标"""
+        keys = self.key_range(limit=ITER_BATCH)
+        while keys:
+            yield from keys
+            if len(keys) < ITER_BATCH:
+                return
+            keys = self.key_range(keys[-1], inclusive=False, limit=ITER_BATCH)
+    
+    def key_range(self, low: str = None, inclusive: bool = True, limit: int = 256) -> list:
+        """按键的字典序取不小于（inclusive=False 时大于）low 的至多 limit 个键，由主键索引回答
+        
+        SQLite 按 UTF-8 字节比较 TEXT，与 Python 按码位比较字符串的顺序相同。
+        """
+        if low is None:
+            sql, args = "SELECT key FROM kv ORDER BY key LIMIT ?", (limit,)
+        else:
+            op = ">=" if inclusive else ">"
+            sql, args = f"SELECT key FROM kv WHERE key {op} ? ORDER BY key LIMIT ?", (low, limit)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(sql, args)]
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def update(self, other=(), **kwargs):
+        """批量写入，在一个事务内完成"""
+        items = other.items() if hasattr(other, "items") else other
+        rows = [(key, *_encode(value)) for key, value in items]
+        rows += [(key, *_encode(value)) for key, value in kwargs.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO kv (key, mime, ts, value) VALUES (?, ?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._cache.clear()
+            self._count = self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+    
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv")
+            self._cache.clear()
+            self._count = 0
+    
+    def copy(self) -> dict:
+        """全部数据的 dict 副本（会把整表读入内存）"""
+        return dict(self.items())
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    # ------------------------------------------------------------------
+    # 快照
+    # ------------------------------------------------------------------
+    
+    def snapshot(self, name: str = "") -> "SQLiteSnapshot":
+        """在独立连接上开启读事务；WAL 模式下读事务看到的是开启时刻的数据
+        
+        调用方需持有表的写锁，保证快照与变更集合的取出处于同一时刻。
+        """
+        return SQLiteSnapshot(self, name)
+
+
+class SQLiteSnapshot:
+    """SQLiteStore 的只读时间点视图，接口与 TableSnapshot 相同"""
+    
+    def __init__(self, store: SQLiteStore, name: str = ""):
+        self.name = name
+        self._conn = store._connect(readonly=True)
+        self._conn.execute("BEGIN")
+        # 第一次读取时读事务才真正开始
+        self.size = self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def __len__(self):
+        return self.size
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.execute("ROLLBACK")
+            self._conn.close()
+            self._conn = None
+    
+    def get(self, key, otherwise=None):
+        row = self._conn.execute("SELECT mime, ts, value FROM kv WHERE key = ?", (key,)).fetchone()
+        return otherwise if row is None else _decode(*row)
+    
+    def items(self, batch: int = 1024) -> Iterator[Tuple[str, Any]]:
+        """按键的字典序遍历"""
+        cursor = self._conn.execute("SELECT key, mime, ts, value FROM kv ORDER BY key")
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                return
+            for key, mime, timestamp, valueline in rows:
+                yield key, _decode(mime, timestamp, valueline)
+    
+    def keys(self) -> Iterator[str]:
+        for key, _ in self.items():
+            yield key
@@ -1,30 +1,344 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+from .lazy import LazyRecord
+from .serialcache import SerializedCache
+from .snapshot import TableSnapshot
+from .storage import create_store, engine_name
+
+# 持久化级别
+DURABLE = "durable"        # 写入记 WAL（启用时），并随快照保存
+SNAPSHOT = "snapshot"      # 只随定期快照保存，写入不记 WAL（例如计数器，崩溃时可以丢失最近的更新）
+EPHEMERAL = "ephemeral"    # 从不持久化，重启后按需重建（例如解析缓存）
+DURABILITIES = (DURABLE, SNAPSHOT, EPHEMERAL)
+
+
+def ordered_write_locks(tables):
+    """同时持有多个表的写锁时使用的加锁顺序：按表名排序
+    
+    所有需要同时锁住多个表的地方（fork 备份、恢复时换入数据）都必须按这个顺序获取，
+    否则两个线程各持有一部分锁时会互相等待。
+    """
+    return [table._write_lock for table in sorted(tables, key=lambda table: getattr(table, 'name', ''))
+            if hasattr(table, '_write_lock')]
+
+
 class Table:
-    def __init__(self, string):
-        self.inner = {}
+    # 预写日志（由 BackupManager 在启用 WAL 模式时设置）
+    wal = None
+    
+    # 键锁分片数：同一个键上的写入 / 读改写按分片串行，不同分片互不等待
+    stripes = 64
+    
+    # 表名 -> 存储引擎（Table.of 创建表时使用），例如 {"archive": "sqlite"}；未配置的表使用内存 dict
+    engines = {}
+    
+    # 表名 -> 持久化级别（Table.of 创建表时使用），例如 {"GEN": "ephemeral"}；未配置的表为 durable
+    durabilities = {}
+    
+    def __init__(self, string, engine=None, durability=None):
+        self.inner = create_store(engine if engine is not None else Table.engines.get(string), string)
         self.name = string
         self._sync_required = False  # 标记是否需要备份
+        self._dirty_keys = set()     # 自上次备份以来被修改的键
+        self._deleted_keys = set()   # 自上次备份以来被删除的键
+        self._needs_full = False     # sync() 无法指明具体键，只能整表备份
+        self._sorted_keys = None     # 有序键索引，首次范围查询时建立
+        self._write_lock = threading.RLock()  # 保证 "修改 + 写日志" 的顺序一致
+        # 按键哈希分片的锁；加锁顺序固定为 分片锁 -> _write_lock
+        self._stripes = [threading.RLock() for _ in range(Table.stripes)]
+        self._version = 0            # 每次 set/delete 加一
+        self._snapshots = []         # 正在使用中的写时复制快照
+        self._serial_cache = SerializedCache()  # 备份时各记录的序列化结果
+        self.durability = DURABLE    # 持久化级别，见 DURABILITIES
+        self.set_durability(durability if durability is not None else Table.durabilities.get(string, DURABLE))
         from . import tables
         tables[string] = self
     
     @staticmethod
-    def of(string):
+    def of(string, engine=None, durability=None):
+        """获取或创建表；指定 engine 且与当前引擎不同时迁移到新引擎，指定 durability 时修改持久化级别"""
         from . import tables
         if string in tables:
-            return tables[string]
+            table = tables[string]
+            if engine is not None and engine_name(table.inner) != engine:
+                table.set_engine(engine)
+            if durability is not None and table.durability != durability:
+                table.set_durability(durability)
+            return table
         else:
-            return Table(string)
+            return Table(string, engine, durability)
     @staticmethod
     def the(string):
         return Table.of(string)
     
     def get(self, key, otherwise=None):
-        return self.inner.get(key, otherwise)
+        value = self.inner.get(key, otherwise)
+        if type(value) is LazyRecord:
+            value = self.materialize(key, value)
+        return value
+    
+    def materialize(self, key, record):
+        """把延迟加载的记录反序列化并替换到表中（不算作修改）"""
+        value = record.materialize()
+        with self._write_lock:
+            current = self.inner.get(key)
+            if current is record:
+                self.inner[key] = value
+                return value
+        # 期间已被其他线程替换
+        return self.get(key)
+    
+    def _stripe(self, key):
+        """key 所在分片的锁"""
+        return self._stripes[hash(key) % len(self._stripes)]
     
     def set(self, key, value):
-        self.inner[key] = value
-        # 当数据发生变化时，标记需要备份
+        with self._stripe(key):
+            lsn = self._store(key, value)
+        self._commit(lsn)
+    
+    def _store(self, key, value):
+        """写入 inner 并记录变更、写日志；调用方需持有 key 的分片锁"""
+        with self._write_lock:
+            for snapshot in self._snapshots:
+                snapshot._before_write(key, deleting=False)
+            if self._sorted_keys is not None and key not in self.inner:
+                insort(self._sorted_keys, key)
+            self.inner[key] = value
+            self._version += 1
+            self._serial_cache.discard(key)
+            # 当数据发生变化时，标记需要备份
+            self._mark_dirty(key)
+            return self._journal("set", key, value)
+    
+    @staticmethod
+    def _commit(lsn):
+        """等待日志落盘（在释放锁之后调用，多个写入可以共享一次 fsync）"""
+        if lsn and Table.wal is not None:
+            Table.wal.commit(lsn)
+    
+    def set_many(self, items, wait=True):
+        """批量写入 (key, value)：每条照常在分片锁内写入并记日志，但只等待一次日志落盘
+        
+        wait=False 时不等待，返回最后一条记录的日志序号（未记日志时为 None），
+        之后用 Table.wait_durable(lsn) 等待，例如导入多批数据后只落盘一次。
+        """
+        lsn = None
+        for key, value in items:
+            with self._stripe(key):
+                lsn = self._store(key, value) or lsn
+        if wait:
+            self._commit(lsn)
+        return lsn
+    
+    @staticmethod
+    def wait_durable(lsn):
+        """等待 set_many(wait=False) 返回的日志序号及之前的写入落盘"""
+        Table._commit(lsn)
+    
+    def delete(self, key):
+        """删除键，返回键是否存在"""
+        with self._stripe(key):
+            lsn = self._remove(key)
+        if lsn is False:
+            return False
+        self._commit(lsn)
+        return True
+    
+    def _remove(self, key):
+        """从 inner 删除键；键不存在时返回 False。调用方需持有 key 的分片锁"""
+        with self._write_lock:
+            if key not in self.inner:
+                return False
+            for snapshot in self._snapshots:
+                snapshot._before_write(key, deleting=True)
+            del self.inner[key]
+            self._version += 1
+            self._serial_cache.discard(key)
+            if self._sorted_keys is not None:
+                i = bisect_left(self._sorted_keys, key)
+                if i < len(self._sorted_keys) and self._sorted_keys[i] == key:
+                    del self._sorted_keys[i]
+            self._mark_deleted(key)
+            return self._journal("delete", key)
+    
+    # ------------------------------------------------------------------
+    # 原子操作：读取、判断与写入在 key 的分片锁内完成
+    # ------------------------------------------------------------------
+    
+    def compare_and_set(self, key, expected, value):
+        """当前值是 expected（同一对象或相等）时才写入 value
+        
+        expected 为 None 表示要求键不存在。
+        
+        Returns:
+            是否写入成功
+        """
+        with self._stripe(key):
+            current = self.get(key)
+            if current is not expected and current != expected:
+                return False
+            lsn = self._store(key, value)
+        self._commit(lsn)
+        return True
+    
+    def update(self, key, fn, default=None):
+        """原子地把 key 的值替换为 fn(当前值)，键不存在时传入 default
+        
+        fn 在分片锁内执行，应当快速返回且不要原地修改传入的值（复制后返回新值）。
+        
+        Returns:
+            写入的新值
+        """
+        with self._stripe(key):
+            value = fn(self.get(key, default))
+            lsn = self._store(key, value)
+        self._commit(lsn)
+        return value
+    
+    def setdefault(self, key, value):
+        """键不存在时写入 value；返回键当前的值"""
+        with self._stripe(key):
+            current = self.get(key)
+            if current is not None:
+                return current
+            lsn = self._store(key, value)
+        self._commit(lsn)
+        return value
+    
+    @property
+    def engine(self):
+        """当前存储引擎名称"""
+        return engine_name(self.inner)
+    
+    def set_engine(self, engine):
+        """切换存储引擎；新引擎为空时把现有数据迁移过去"""
+        store = create_store(engine, self.name)
+        with self._write_lock:
+            if not len(store):
+                store.update((key, self.get(key)) for key in list(self.inner))
+            old, self.inner = self.inner, store
+            self._sorted_keys = None
+            self._serial_cache.clear()
+        if hasattr(old, "close"):
+            old.close()
+        return self
+    
+    def set_durability(self, durability):
+        """修改持久化级别（见 DURABILITIES）；改为 ephemeral 时丢弃尚未备份的变更记录"""
+        if durability not in DURABILITIES:
+            raise ValueError(f"持久化级别必须是 {', '.join(DURABILITIES)} 之一: {durability}")
+        with self._write_lock:
+            self.durability = durability
+            if durability == EPHEMERAL:
+                self._dirty_keys = set()
+                self._deleted_keys = set()
+                self._needs_full = False
+                self._sync_required = False
+        return self
+    
+    def replace_all(self, data):
+        """用 data 整体替换表内容（加载备份时使用，不记为修改）
+        
+        仍在使用中的快照先复制出打开时刻的数据并与表脱离，之后照常读到替换之前的内容。
+        """
+        with self._write_lock:
+            for snapshot in self._snapshots:
+                snapshot._freeze()
+            self._snapshots = []
+            self._version += 1
+            if isinstance(self.inner, dict):
+                self.inner = dict(data)
+            else:
+                self.inner.clear()
+                self.inner.update(data)
+            self._sorted_keys = None
+            self._serial_cache.clear()
+    
+    def invalidate_index(self):
+        """绕过 set/delete 直接改动 inner 后调用（例如加载备份），下次查询时重建键索引"""
+        self._sorted_keys = None
+    
+    def _key_index(self):
+        """有序键列表；调用方需持有 _write_lock"""
+        # 长度不一致说明 inner 被直接改动过
+        if self._sorted_keys is None or len(self._sorted_keys) != len(self.inner):
+            self._sorted_keys = sorted(self.inner)
+        return self._sorted_keys
+    
+    def scan_keys(self, prefix="", after=None, batch=256):
+        """按键的字典序遍历以 prefix 开头、且大于 after 的键
+        
+        每批只在锁内取 batch 个键，并以上一批最后一个键作为游标，
+        遍历期间的并发写入不会导致重复或遗漏已存在的键。
+        存储引擎自带有序索引（key_range，例如 SQLite 的主键）时直接做范围查询，
+        不在内存中建立整表的键列表。
+        """
+        cursor = after if after is not None and after >= prefix else None
+        key_range = getattr(self.inner, "key_range", None)
+        while True:
+            if key_range is not None:
+                chunk = key_range(cursor, False, batch) if cursor is not None else key_range(prefix, True, batch)
+            else:
+                with self._write_lock:
+                    keys = self._key_index()
+                    start = bisect_right(keys, cursor) if cursor is not None else bisect_left(keys, prefix)
+                    chunk = keys[start:start + batch]
+            for key in chunk:
+                if not key.startswith(prefix):
+                    return
+                yield key
+            if len(chunk) < batch:
+                return
+            cursor = chunk[-1]
+    
+    def snapshot(self):
+        """打开一个写时复制快照，得到此刻数据的一致视图
+        
+        打开快照不复制数据；之后的写入只会为被修改的键额外保存一份旧值。
+        存储引擎自带快照（例如 SQLite 读事务）时直接使用引擎的快照。
+        用完后需调用 close()，或者使用 with 语句：
+        
+            with table.snapshot() as snap:
+                for key, value in snap.items():
+                    ...
+        """
+        with self._write_lock:
+            if hasattr(self.inner, "snapshot"):
+                return self.inner.snapshot(self.name)
+            snapshot = TableSnapshot(self, self._version, len(self.inner))
+            self._snapshots.append(snapshot)
+            return snapshot
+    
+    def _release_snapshot(self, snapshot):
+        with self._write_lock:
+            if snapshot in self._snapshots:
+                self._snapshots.remove(snapshot)
+    
+    def _mark_dirty(self, key):
+        if self.durability == EPHEMERAL:
+            return
+        self._dirty_keys.add(key)
+        self._deleted_keys.discard(key)
         self._sync_required = True
     
+    def _mark_deleted(self, key):
+        if self.durability == EPHEMERAL:
+            return
+        self._deleted_keys.add(key)
+        self._dirty_keys.discard(key)
+        self._sync_required = True
+    
+    def _journal(self, op, key, value=None):
+        """写入预写日志（未启用 WAL 时返回 None）"""
+        wal = Table.wal
+        if wal is None or wal.replaying or self.durability != DURABLE:
+            return None
+        if op == "set":
+            return wal.append(wal.encode_set(self.name, key, value))
+        return wal.append(wal.encode_delete(self.name, key))
+    
     def __getitem__(self, key):
         return self.get(key, None)
     
@@ -32,8 +346,11 @@ class Table:
         self.set(key, value)
     
     def sync(self):
-        """标记此表需要被备份"""
+        """标记此表需要被备份（整表）；ephemeral 表不备份"""
+        if self.durability == EPHEMERAL:
+            return self
         self._sync_required = True
+        self._needs_full = True
         return self
     
     def is_sync_required(self):
@@ -44,11 +361,40 @@ class Table:
         """标记此表已经备份完成"""
         self._sync_required = False
     
+    def take_changes(self):
+        """取出并清空自上次备份以来的变更
+        
+        Returns:
+            (changed, deleted, full)：被修改的键、被删除的键、是否需要整表备份
+        """
+        with self._write_lock:
+            changes = (self._dirty_keys, self._deleted_keys, self._needs_full)
+            self._dirty_keys = set()
+            self._deleted_keys = set()
+            self._needs_full = False
+            self._sync_required = False
+            return changes
+    
+    def restore_changes(self, changes):
+        """备份失败时把 take_changes() 取出的变更放回（不覆盖之后的新变更）"""
+        changed, deleted, full = changes
+        with self._write_lock:
+            self._dirty_keys |= changed - self._deleted_keys
+            self._deleted_keys |= deleted - self._dirty_keys
+            self._needs_full = self._needs_full or full
+            if changed or deleted or full:
+                self._sync_required = True
+    
     def get_all_data(self):
-        """获取表的所有数据，用于备份"""
+        """获取表的所有数据（某一时刻的一致副本）
+        
+        会把整表读入内存；大表（例如 SQLite 引擎）请直接遍历 snapshot().items()。
+        """
+        with self.snapshot() as snap:
+            data = dict(snap.items())
         return {
             "name": self.name,
-            "data": self.inner.copy()
+            "data": data
         }
     
     @staticmethod
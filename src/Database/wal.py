@@ -0,0 +1,271 @@
+"""
+预写日志（WAL）
+- 每次 Table.set / Table.delete 追加一条紧凑记录
+- 组提交：并发写入共享一次 fsync
+- 启动时在最新快照之上重放
+- 快照完成后丢弃已封存的日志段（日志压缩）
+
+记录格式（每行一条）：
+    crc32 ["S", table, key, mime, timestamp] valueline
+    crc32 ["D", table, key]
+
+crc32 为 8 位十六进制，覆盖其后的全部内容，用于识别崩溃时写了一半的尾部记录。
+"""
+
+import json
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from Common.base import entry
+
+
+class WriteAheadLog:
+    """追加式预写日志，按段（segment）滚动"""
+    
+    def __init__(self, directory: str = ".backup", sync_mode: str = "group",
+                 sync_interval: float = 0.05):
+        """
+        初始化预写日志
+        
+        Args:
+            directory: 日志段所在目录（通常与备份目录相同）
+            sync_mode: "group" 写入方等待 fsync 完成（多个写入共享一次 fsync）；
+                       "interval" 后台线程每 sync_interval 秒 fsync 一次，写入方不等待
+            sync_interval: interval 模式下的 fsync 间隔（秒）
+        """
+        if sync_mode not in ("group", "interval"):
+            raise ValueError("sync_mode 必须是 'group' 或 'interval'")
+        
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+        self.sync_mode = sync_mode
+        self.sync_interval = sync_interval
+        
+        # 重放期间不再写日志
+        self.replaying = False
+        
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._syncing = False
+        self._sealing = 0       # 等待关闭当前文件的 rotate / close 数，期间不产生新的 leader
+        self._written_lsn = 0   # 已写入（未必落盘）的最大序号
+        self._durable_lsn = 0   # 已 fsync 的最大序号
+        
+        segments = self.segments()
+        self._seq = self._segment_seq(segments[-1]) + 1 if segments else 1
+        self._file = open(self._segment_path(self._seq), "ab")
+        
+        self._stop_event = threading.Event()
+        self._flusher = None
+        if self.sync_mode == "interval":
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+    
+    # ------------------------------------------------------------------
+    # 段管理
+    # ------------------------------------------------------------------
+    
+    def _segment_path(self, seq: int) -> Path:
+        return self.directory / f"wal_{seq:06d}.log"
+    
+    @staticmethod
+    def _segment_seq(path: Path) -> int:
+        return int(path.stem.split("_")[1])
+    
+    def segments(self) -> List[Path]:
+        """按顺序列出目录中的所有日志段"""
+        return sorted(self.directory.glob("wal_*.log"), key=self._segment_seq)
+    
+    def rotate(self) -> int:
+        """封存当前日志段并开启新段
+        
+        在快照开始收集数据之前调用。返回被封存的最大段序号，
+        快照成功后将其传给 discard()。
+        """
+        with self._sealed():
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._durable_lsn = self._written_lsn
+            self._synced.notify_all()
+            self._file.close()
+            sealed = self._seq
+            self._seq += 1
+            self._file = open(self._segment_path(self._seq), "ab")
+            return sealed
+    
+    def discard(self, upto_seq: int):
+        """删除序号不大于 upto_seq 的已封存日志段"""
+        for path in self.segments():
+            if self._segment_seq(path) <= upto_seq:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+    
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def encode_set(table: str, key: str, value: Any) -> bytes:
+        from .backup import encode_record_value
+        mime, valueline = encode_record_value(value)
+        timestamp = ""
+        if isinstance(value, entry) and isinstance(value.lastModifiedTime, datetime):
+            timestamp = value.lastModifiedTime.strftime("%Y%m%d%H%M%S")
+        header = json.dumps(["S", table, key, mime, timestamp], ensure_ascii=False,
+                            separators=(',', ':'))
+        return f"{header} {valueline}".encode("utf-8")
+    
+    @staticmethod
+    def encode_delete(table: str, key: str) -> bytes:
+        return json.dumps(["D", table, key], ensure_ascii=False,
+                          separators=(',', ':')).encode("utf-8")
+    
+    def append(self, payload: bytes) -> int:
+        """追加一条记录，返回其序号（LSN）；调用 commit(lsn) 等待其落盘"""
+        record = b"%08x " % zlib.crc32(payload) + payload + b"\n"
+        with self._lock:
+            self._file.write(record)
+            self._written_lsn += 1
+            return self._written_lsn
+    
+    def commit(self, lsn: int):
+        """组提交：等待序号 lsn 及之前的记录落盘
+        
+        第一个到达的写入方负责 flush + fsync，其余写入方等待并共享这次 fsync。
+        interval 模式下直接返回，由后台线程负责落盘。
+        """
+        if self.sync_mode != "group":
+            return
+        with self._lock:
+            while self._durable_lsn < lsn and not self._file.closed:
+                if self._syncing or self._sealing:
+                    self._synced.wait()
+                    continue
+                # 成为本轮的 leader
+                self._syncing = True
+                target = self._written_lsn
+                self._file.flush()
+                fd = self._file.fileno()
+                self._lock.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                self._durable_lsn = max(self._durable_lsn, target)
+                self._synced.notify_all()
+    
+    @contextmanager
+    def _sealed(self):
+        """持有 _lock 并等待正在锁外 fsync 的 leader 结束，之后才能关闭它正在使用的文件
+        
+        等待期间不产生新的 leader，否则持续的写入会让 rotate / close 一直等下去。
+        """
+        with self._lock:
+            self._sealing += 1
+            try:
+                while self._syncing:
+                    self._synced.wait()
+                yield
+            finally:
+                self._sealing -= 1
+                self._synced.notify_all()
+    
+    def _flush_loop(self):
+        """interval 模式的后台落盘线程"""
+        while not self._stop_event.wait(self.sync_interval):
+            self.sync()
+    
+    def sync(self):
+        """立即把已写入的记录落盘"""
+        with self._lock:
+            if self._durable_lsn == self._written_lsn or self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._durable_lsn = self._written_lsn
+            self._synced.notify_all()
+    
+    def close(self):
+        """停止后台线程并落盘"""
+        self._stop_event.set()
+        if self._flusher:
+            self._flusher.join(timeout=5)
+        self.sync()
+        with self._sealed():
+            self._file.close()
+    
+    # ------------------------------------------------------------------
+    # 重放
+    # ------------------------------------------------------------------
+    
+    def replay(self, tables_dict: Dict[str, Any]) -> int:
+        """按顺序重放所有日志段到 tables_dict
+        
+        遇到校验失败或不完整的记录时停止重放该段（崩溃时写了一半的尾部）。
+        
+        Returns:
+            重放的记录数
+        """
+        from .backup import decode_record_value
+        from .table import DURABLE, Table
+        
+        replayed = 0
+        self.replaying = True
+        try:
+            for path in self.segments():
+                with open(path, "rb") as f:
+                    for raw in f:
+                        if not raw.endswith(b"\n"):
+                            break
+                        crc, _, payload = raw[:-1].partition(b" ")
+                        try:
+                            if int(crc, 16) != zlib.crc32(payload):
+                                break
+                        except ValueError:
+                            break
+                        
+                        text = payload.decode("utf-8")
+                        header, end = json.JSONDecoder().raw_decode(text)
+                        op, table_name, key = header[0], header[1], header[2]
+                        table = tables_dict.get(table_name) or Table.of(table_name)
+                        if getattr(table, 'durability', DURABLE) != DURABLE:
+                            # 旧版本记下的非 durable 表写入，以快照为准
+                            continue
+                        table.invalidate_index()
+                        
+                        if op == "S":
+                            mime, timestamp = header[3], header[4]
+                            value = decode_record_value(mime, text[end + 1:])
+                            if timestamp and isinstance(value, entry):
+                                try:
+                                    value.lastModifiedTime = datetime.strptime(timestamp, "%Y%m%d%H%M%S")
+                                except ValueError:
+                                    pass
+                            table.inner[key] = value
+                            table._mark_dirty(key)
+                        elif op == "D":
+                            table.inner.pop(key, None)
+                            table._mark_deleted(key)
+                        replayed += 1
+        finally:
+            self.replaying = False
+        return replayed
+    
+    def info(self) -> Dict[str, Any]:
+        """日志状态，用于 get_backup_info()"""
+        segments = self.segments()
+        return {
+            "sync_mode": self.sync_mode,
+            "segments": len(segments),
+            "size": sum(p.stat().st_size for p in segments if p.exists()),
+            "written_lsn": self._written_lsn,
+            "durable_lsn": self._durable_lsn,
+        }
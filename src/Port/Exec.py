@@ -2,25 +2,35 @@ from typing import Dict, Any, Tuple, Optional
 from Common.util import first_valid
 from Database import Table
 from Common.base import FinalVis, entry
-from Common import execute_script
+from Common import execute_script, sandbox, Budget, ScriptResult
+from Common.util import StreamingResponse
 from datetime import datetime
+from . import jobs
+
+# 通过 Exec 执行的脚本的预算；脚本开头的 "# budget: ..." 注释可以进一步收紧
+EXEC_BUDGET = Budget(wall_time=10, output=1 << 20, db_ops=10_000)
+
+# 异步任务（op=submit）的预算：墙钟时间更长，在任务专用的进程池中执行（sandbox.start_job_pool）
+JOB_BUDGET = Budget(wall_time=300, output=1 << 20, db_ops=100_000)
 
 
 class Exec:
     """执行用户脚本的Port - 只能操作数据库entry"""
     
+    # API 请求的异步任务操作，见 Port/jobs.py
+    JOB_OPS = ("submit", "status", "result", "stream")
+    
     @staticmethod
     def access(pack) -> FinalVis:
         """主访问方法"""
+        op = first_valid(pack.query.get("op", None), "run")
+        if getattr(pack, 'by', '') == 'api' and op in Exec.JOB_OPS:
+            return Exec.job_access(pack, op)
         return Exec.run_script(pack)
     
     @staticmethod
-    def run_script(pack) -> FinalVis:
-        """执行用户脚本"""
-        # 判断是否是 API 请求
-        is_api = getattr(pack, 'by', '') == 'api'
-        
-        # 获取脚本内容
+    def load_script(pack) -> str:
+        """脚本内容：query 中的 script，否则为 entry 的文本"""
         script_content = first_valid(pack.query.get('script', None), "")
         if not script_content:
             # 从entry中获取脚本
@@ -30,6 +40,37 @@ class Exec:
                 script_content = script_entry.value.get("text", "")
             else:
                 script_content = str(script_entry or "")
+        return script_content
+    
+    @staticmethod
+    def result_value(result: ScriptResult) -> dict:
+        """API 请求的返回值（同步执行和异步任务的结果相同）"""
+        success, output, operations = result
+        if success:
+            return {
+                "success": True,
+                "output": output,
+                "operations": operations,
+                "operations_count": len(operations)
+            }
+        value = {
+            "success": False,
+            "error": output,
+            "output": "",
+            "operations": operations
+        }
+        if result.budget_exceeded:
+            value["budget_exceeded"] = result.budget_exceeded
+        return value
+    
+    @staticmethod
+    def run_script(pack) -> FinalVis:
+        """执行用户脚本"""
+        # 判断是否是 API 请求
+        is_api = getattr(pack, 'by', '') == 'api'
+        
+        # 获取脚本内容
+        script_content = Exec.load_script(pack)
         
         if not script_content.strip():
             if is_api:
@@ -45,34 +86,54 @@ class Exec:
                 return FinalVis.of("raw", payload={"text": "No script content provided"})
         
         # 使用通用执行函数
-        success, output, operations = execute_script(script_content)
+        result = execute_script(script_content, budget=EXEC_BUDGET)
+        success, output, operations = result
+        
+        if is_api:
+            # API请求：只需要value
+            return FinalVis.of("text", value=Exec.result_value(result), skip=True)
         
+        # Web请求：只需要payload
         if success:
-            if is_api:
-                # API请求：只需要value
-                return FinalVis.of("text", value={
-                    "success": True,
-                    "output": output,
-                    "operations": operations,
-                    "operations_count": len(operations)
-                }, skip=True)
-            else:
-                # Web请求：只需要payload
-                result_text = output if output else "Script executed successfully"
-                return FinalVis.of("raw", payload={"text": result_text})
+            result_text = output if output else "Script executed successfully"
+            return FinalVis.of("raw", payload={"text": result_text})
         else:
-            if is_api:
-                # API请求：只需要value
-                return FinalVis.of("text", value={
-                    "success": False,
-                    "error": output,
-                    "output": "",
-                    "operations": operations
-                }, skip=True)
-            else:
-                # Web请求：只需要payload
-                error_text = f"Script execution error: {output}"
-                return FinalVis.of("raw", payload={"text": error_text})
+            error_text = f"Script execution error: {output}"
+            return FinalVis.of("raw", payload={"text": error_text})
+    
+    @staticmethod
+    def job_access(pack, op: str) -> FinalVis:
+        """异步任务：submit 提交并立即返回任务 id，status / result 轮询，stream 以 SSE 推送进度"""
+        if op == "submit":
+            script_content = Exec.load_script(pack)
+            if not script_content.strip():
+                return FinalVis.of("text", value={"success": False, "error": "No script content provided"}, skip=True)
+            
+            def run(progress):
+                return Exec.result_value(execute_script(script_content, budget=JOB_BUDGET, progress=progress,
+                                                        backend=sandbox.job_pool))
+            
+            try:
+                job = jobs.store.submit(pack.entry, run)
+            except RuntimeError as e:
+                return FinalVis.of("text", value={"success": False, "error": str(e)}, skip=True)
+            if job is None:
+                return FinalVis.of("text", value={"success": False, "error": "Too many pending jobs"}, skip=True)
+            return FinalVis.of("text", value=job.info(), skip=True)
+        
+        job = jobs.store.get(first_valid(pack.query.get("job", None), ""))
+        if job is None:
+            return FinalVis.of("text", value={"success": False, "error": "Job not found or expired"}, skip=True)
+        if op == "stream":
+            return FinalVis.of("text", value=StreamingResponse(
+                jobs.iter_events(job), media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            ), skip=True)
+        value = job.info()
+        if op == "result":
+            # 未结束时 result 为 None，继续轮询
+            value["result"] = job.result
+        return FinalVis.of("text", value=value, skip=True)
 
 # 插件注册函数
 def registry():
@@ -1359,15 +1359,22 @@ class Gen:
     """
     
     @staticmethod
-    def access(pack) -> FinalVis:
-        """主访问方法"""
+    def load(entry_key) -> Optional[GenFile]:
+        """取得 entry_key 解析后的 GenFile：缓存有效时直接返回，否则解析并写入 GEN 表
+        
+        Returns:
+            GenFile；主表中没有该 entry 时返回 None
+        
+        Raises:
+            解析失败时抛出 Parser 的异常
+        """
         main_table = Table.of("main")
         gen_table = Table.of("GEN")
         
         # 1. 从主表获取内容
-        data = main_table.get(pack.entry)
+        data = main_table.get(entry_key)
         if data is None:
-            return FinalVis.of("raw", payload={"text": "(empty)"})
+            return None
         
         # 统一转换为 entry 格式
         if isinstance(data, entry):
@@ -1377,27 +1384,38 @@ class Gen:
         else:
             pub_file = entry(mime="text", value={"text": str(data)})
             # 如果是原始数据，保存为entry对象
-            main_table.set(pack.entry, pub_file)
+            main_table.set(entry_key, pub_file)
         
         pub_timestamp = pub_file.value.get("lastSavedTime")
         
         # 2. 检查 gen 表缓存
-        cached_genfile = gen_table.get(pack.entry)
-        genfile = None
+        cached_genfile = gen_table.get(entry_key)
         
         # 3. 判断缓存是否有效
         if isinstance(cached_genfile, GenFile):
             cached_timestamp = cached_genfile.value.get("sourceTimestamp")
             if cached_timestamp == pub_timestamp and cached_genfile.root is not None:
-                genfile = cached_genfile
+                return cached_genfile
         
-        # 4. 如果需要，重新解析
+        # 4. 重新解析
+        genfile = Parser(pub_file).parse()
+        gen_table.set(entry_key, genfile)
+        return genfile
+    
+    @staticmethod
+    def warm_up(entry_key):
+        """预热：解析 entry_key 并放入 GEN 表缓存（不生成内容）"""
+        Gen.load(entry_key)
+    
+    @staticmethod
+    def access(pack) -> FinalVis:
+        """主访问方法"""
+        try:
+            genfile = Gen.load(pack.entry)
+        except Exception as e:
+            return FinalVis.of("raw", payload={"text": f"Error: {e}"})
         if genfile is None:
-            try:
-                genfile = Parser(pub_file).parse()
-                gen_table.set(pack.entry, genfile)
-            except Exception as e:
-                return FinalVis.of("raw", payload={"text": f"Error: {e}"})
+            return FinalVis.of("raw", payload={"text": "(empty)"})
         
         # 5. 生成内容并输出
         result = genfile.gen()
@@ -1415,6 +1433,7 @@ class Gen:
 def registry():
     return {
         "mime": "gen",
-        "port": Gen
+        "port": Gen,
+        "warm_up": Gen.warm_up
     }
 
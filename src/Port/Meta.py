@@ -1,16 +1,11 @@
 from Common.base import FinalVis, entry
-from Common import execute_script
-from Database import Table, pub_set
+from Common import execute_script, Budget, ScriptResult
+from Database import Table
 from .Text import Text, ShadowPort
 from datetime import datetime
 
-# 脚本模板
-ENHANCED_SCRIPT_TEMPLATE = """# 输入数据
-input_data = '''{input_data}'''
-
-# 用户脚本
-{metaHandler}
-"""
+# 元数据处理脚本的预算；脚本开头的 "# budget: ..." 注释可以进一步收紧
+META_BUDGET = Budget(wall_time=5, output=1 << 20, db_ops=1000)
 
 # 调试信息模板
 DEBUG_INFO_TEMPLATE = """Script executed successfully but produced no output.
@@ -62,10 +57,14 @@ Py Port 用于执行 Python 脚本，专门用于操作数据库。
 数据库 API (db)：
 - db.get("key")           # 获取数据
 - db.set("key", "value")   # 设置数据
-- db.list_keys("pattern*") # 列出匹配的键
+- db.list_keys("pattern*") # 列出匹配的键（按字典序）
+- db.list_keys("log_*", limit=100, after="log_0099")  # 分页列出
 - db.exists("key")         # 检查键是否存在
 - db.delete("key")         # 删除数据
 - db.copy("from", "to")    # 复制数据
+- db.update("counter", lambda t: str(int(t or 0) + 1))  # 原子读改写，返回新文本
+- db.compare_and_set("key", "old", "new")  # 当前文本为 "old" 时才写入
+- db.setdefault("key", "value")  # 键不存在时写入，返回当前文本
 
 使用示例：
 1. 通过 entry 执行脚本：
@@ -238,8 +237,8 @@ class Meta:
             "lastSavedTime": saved_time
         }
         text_file = entry(mime="meta", value=file_data)
-        # 与 Text.set 一致地写入 PUB，并触发 ShadowPort 更新
-        pub_set(getattr(pack, "entry", ""), text_file)
+        # 与 Text.set 一致地写入主表，并触发 ShadowPort 更新
+        Table.of("main").set(getattr(pack, "entry", ""), text_file)
         if getattr(pack, "entry", None):
             try:
                 ShadowPort.update(pack)
@@ -274,20 +273,19 @@ class Meta:
         else:
             input_data = str(source_data or "")
         
-        # 使用原始脚本内容，添加输入数据作为变量
-        enhanced_script = ENHANCED_SCRIPT_TEMPLATE.format(
-            input_data=input_data,
-            metaHandler=metaHandler
-        )
-        
-        # 使用 Common.execute_script 执行脚本
-        # 添加额外的全局变量：request 和 source
+        # 使用 Common.execute_script 执行原始脚本（同一脚本只编译一次）
+        # 输入数据不拼进脚本，和 request、source 一起作为全局变量传入
         extra_globals = {
+            'input_data': input_data,
             'request': pack,
             'source': source_data,
         }
         
-        success, output, operations = execute_script(enhanced_script, extra_globals)
+        if metaHandler.strip():
+            result = execute_script(metaHandler, extra_globals, budget=META_BUDGET)
+        else:
+            result = ScriptResult(True, "", [])
+        success, output, operations = result
         
         if success:
             # 只提取print输出的结果
@@ -304,6 +302,13 @@ class Meta:
                 return FinalVis.of("text", payload={"text": debug_info})
         else:
             error_msg = f"Script execution error: {output}"
+            if result.budget_exceeded and getattr(pack, 'by', '') == 'api':
+                # API 请求：给出结构化的错误
+                return FinalVis.of("text", value={
+                    "success": False,
+                    "error": output,
+                    "budget_exceeded": result.budget_exceeded,
+                }, skip=True)
             return FinalVis.of("text", payload={"text": error_msg})
 
 # 插件注册函数
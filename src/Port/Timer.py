@@ -1,11 +1,15 @@
 from Database import Table
 from Common.base import FinalVis, entry
 from Common.util import first_valid
+from Common.eval import Budget
 from datetime import datetime
 import threading
 import time
 import random
 
+# 定时任务在调度线程中逐个同步执行，预算比请求触发的脚本更紧，避免一个脚本拖住整个调度
+TIMER_BUDGET = Budget(wall_time=5, output=64 * 1024, db_ops=1000)
+
 class TimerEntry(entry, mime="timer"):
     """Timer 专用的 entry 类型，存储脚本列表、内联脚本和注释"""
     
@@ -36,6 +40,18 @@ class TimerEntry(entry, mime="timer"):
         self.lastModifiedTime = lastModifiedTime or datetime.now()
         super().__init__(mime="timer", value=None)
     
+    @classmethod
+    def from_dict(cls, data):
+        """从字典创建 TimerEntry（构造函数不接受 mime/value，需单独处理）"""
+        if not isinstance(data, dict):
+            raise ValueError("数据必须是字典格式")
+        
+        instance = cls()
+        instance.value = data.get("value")
+        if data.get("lastModifiedTime") is not None:
+            instance.lastModifiedTime = data.get("lastModifiedTime")
+        return instance
+    
     @staticmethod
     def _parse_scripts_from_text(text: str) -> dict:
         """从纯文本解析 timer 数据，保持原始位置顺序
@@ -299,7 +315,7 @@ class TimerManager:
         
         # 获取所有.timer entry的名称（从TIMER表）
         timer_entries = []
-        for entry_name, entry_data in timer_table.inner.items():
+        for entry_name in timer_table.scan_keys():
             # 跳过非entry文件的数据
             if entry_name.startswith('_'):
                 continue
@@ -327,11 +343,11 @@ class TimerManager:
         #     existing_content = ""
         #     if history_entry and isinstance(history_entry.value, dict):
         #         existing_content = history_entry.value.get("text", "")
-            
+        
         #     # 追加新的扫描结果
         #     new_content = existing_content + "\n" + scan_result if existing_content else scan_result
         #     db_api.set("timerhistory", new_content, mime="text")
-            
+        
         #     print(scan_result.strip())
         # except Exception as e:
         #     print(f"保存Timer扫描结果失败: {e}")
@@ -376,16 +392,19 @@ class TimerManager:
         for inline_script in inline_scripts:
             self._execute_inline_script(inline_script, entry_name)
         
-        # 更新TIMER表中的触发次数
-        timer_table = Table.of("TIMER")
-        timer_record = timer_table.get(entry_name)
-        if timer_record is None:
-            timer_record = {"count": 0, "last_triggered": None}
-        
-        if isinstance(timer_record, dict):
+        # 更新TIMER表中的触发次数（原子读改写，脚本并发修改同一记录时不会丢失计数）
+        def bump(timer_record):
+            if timer_record is None:
+                timer_record = {"count": 0, "last_triggered": None}
+            if not isinstance(timer_record, dict):
+                return timer_record
+            # 表中的值可能正被备份快照引用，复制后再修改
+            timer_record = dict(timer_record)
             timer_record["count"] = timer_record.get("count", 0) + 1
             timer_record["last_triggered"] = datetime.now().isoformat()
-            timer_table.set(entry_name, timer_record)
+            return timer_record
+        
+        Table.of("TIMER").update(entry_name, bump)
     
     def _execute_script(self, script_path):
         """执行单个脚本路径"""
@@ -409,7 +428,7 @@ class TimerManager:
             return
         
         # 执行脚本
-        success, output, operations = execute_script(script_content)
+        success, output, operations = execute_script(script_content, budget=TIMER_BUDGET)
         
         if not success:
             print(f"脚本 {script_path} 执行失败: {output}")
@@ -424,7 +443,7 @@ class TimerManager:
             return
         
         # 直接执行内联脚本内容
-        success, output, operations = execute_script(script_content)
+        success, output, operations = execute_script(script_content, budget=TIMER_BUDGET)
         
         if not success:
             print(f"内联脚本 (from {entry_name}) 执行失败: {output}")
@@ -531,6 +550,11 @@ class Timer(ShadowPort):
         
         return timer_entry
     
+    @staticmethod
+    def warm_up(entry_key):
+        """预热：把 .timer entry 解析为 TimerEntry，第一次调度时不再解析"""
+        Timer.get_data(entry_key)
+    
     @staticmethod
     def update(pack):
         """当 text 内容变动时更新 timer 的 table"""
@@ -558,17 +582,19 @@ class Timer(ShadowPort):
             main_table.set(entry_key, timer_entry)
             
             # 确保 TIMER 表中有记录，如果不存在则创建，如果存在则更新
-            timer_table = Table.of("TIMER")
-            timer_record = timer_table.get(entry_key)
-            if timer_record is None:
-                # 如果 TIMER 表中没有记录，创建一个新的
-                timer_record = {"count": 0, "last_triggered": None}
-            elif not isinstance(timer_record, dict):
-                timer_record = {"count": 0, "last_triggered": None}
+            def touch(timer_record):
+                if not isinstance(timer_record, dict):
+                    # 如果 TIMER 表中没有记录，创建一个新的
+                    timer_record = {"count": 0, "last_triggered": None}
+                else:
+                    # 不原地修改表中的值（可能正被备份快照引用）
+                    timer_record = dict(timer_record)
+                
+                # 更新时间戳信息（保留 count 和 last_triggered）
+                timer_record["last_updated"] = datetime.now().isoformat() if text_timestamp else None
+                return timer_record
             
-            # 更新时间戳信息（保留 count 和 last_triggered）
-            timer_record["last_updated"] = datetime.now().isoformat() if text_timestamp else None
-            timer_table.set(entry_key, timer_record)
+            Table.of("TIMER").update(entry_key, touch)
 
 # 注册到 ShadowPort
 ShadowPort.set(Timer)
@@ -577,5 +603,6 @@ ShadowPort.set(Timer)
 def registry():
     return {
         "mime": "timer",
-        "port": Timer
+        "port": Timer,
+        "warm_up": Timer.warm_up
     }
\ No newline at end of file
@@ -26,6 +26,9 @@ class DefaultPort:
 # Port 注册表
 ports: Dict[str, type] = {}
 
+# mime -> 预热函数 warm_up(entry_key)：启动后在后台提前构建该类 entry 的派生缓存
+warmers: Dict[str, Callable[[str], Any]] = {}
+
 class PortRegistry:
     def __init__(self, initial: Optional[Dict[str, type]] = None):
         self._ports = ports if initial is None else initial
@@ -91,6 +94,7 @@ def _register_plugin_dict(info: Dict[str, Any]):
     从插件信息字典注册 Port：
     - mime: MIME 类型（字符串或数组）
     - port/handler/class: Port 类或处理函数
+    - warm_up: 可选，预热函数 warm_up(entry_key)
     """
     if not isinstance(info, dict):
         return
@@ -118,6 +122,12 @@ def _register_plugin_dict(info: Dict[str, Any]):
                 register_port(mime, port_class)
     elif isinstance(mime_types, str) and mime_types:
         register_port(mime_types, port_class)
+    
+    warm_up = info.get("warm_up")
+    if callable(warm_up):
+        for mime in (mime_types if isinstance(mime_types, (list, tuple)) else [mime_types]):
+            if isinstance(mime, str) and mime:
+                warmers[mime] = warm_up
 
 def load_plugins():
     """加载所有插件"""
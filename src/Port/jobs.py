@@ -0,0 +1,223 @@
+"""
+Exec 脚本的异步任务
+- GET /api/foo.py?op=submit 立即返回任务 id，脚本在后台线程池中执行（进程池已启动时由工作进程执行）
+- op=status / op=result 轮询，op=stream 以 SSE 推送状态变化和进度（执行中每 HEARTBEAT 秒一次，
+  带有执行中的计量数 ops / db_ops / output / elapsed）
+- 已结束的任务保留 TTL 秒，最多保留 MAX_JOBS 个；满了时先丢弃最早结束的，
+  全部未结束时拒绝提交
+- 停止（服务关闭）时排队中的任务标记为 cancelled，之后拒绝提交
+
+结果与同步执行的 API 返回值相同（Exec.result_value），包括 operations 和 budget_exceeded。
+脚本的输出在执行结束后一并返回，执行过程中不推送。
+"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from Common.eval import Progress
+from Common.logger import get_logger
+
+logger = get_logger("jobs")
+
+# 同时执行的任务数
+WORKERS = 2
+
+# 最多保留的任务数（包括未结束的）
+MAX_JOBS = 256
+
+# 已结束的任务保留的秒数
+TTL = 600
+
+# SSE 在执行中推送进度的间隔（秒）
+HEARTBEAT = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+    """一个异步任务：状态变化时唤醒等待者"""
+    
+    def __init__(self, entry: str):
+        self.id = uuid.uuid4().hex
+        self.entry = entry
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result: Optional[Dict[str, Any]] = None
+        # 执行中的计量数
+        self.progress = Progress()
+        # 每次状态变化加一，SSE 据此判断是否有新状态
+        self.version = 0
+        self._changed = threading.Condition()
+    
+    @property
+    def done(self) -> bool:
+        return self.state in FINISHED
+    
+    def _set(self, state: str, result: Dict[str, Any] = None, only_from: str = None) -> bool:
+        """切换状态；指定 only_from 时只在当前状态为它时切换，返回是否切换"""
+        with self._changed:
+            if only_from is not None and self.state != only_from:
+                return False
+            self.state = state
+            if state == RUNNING:
+                self.started = time.time()
+            elif state in FINISHED:
+                self.finished = time.time()
+                self.result = result
+            self.version += 1
+            self._changed.notify_all()
+            return True
+    
+    def wait(self, version: int, timeout: float) -> int:
+        """等待状态版本超过 version 或超时，返回当前版本"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > version, timeout)
+            return self.version
+    
+    def info(self) -> Dict[str, Any]:
+        end = self.finished or time.time()
+        return {
+            "job": self.id,
+            "entry": self.entry,
+            "state": self.state,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed": None if self.started is None else round(end - self.started, 3),
+            "progress": None if self.started is None else self.progress.snapshot(),
+        }
+
+
+class JobStore:
+    """有上限、有过期时间的任务表，任务在线程池中执行"""
+    
+    def __init__(self, workers: int = WORKERS, max_jobs: int = MAX_JOBS, ttl: float = TTL):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stopped = False
+        self.submitted = 0
+        self.expired = 0
+        self.rejected = 0
+        self.cancelled = 0
+    
+    def _prune(self):
+        """丢弃过期的任务；仍然满时丢弃最早结束的任务（调用方持有锁）"""
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.done and now - job.finished > self.ttl]:
+            del self._jobs[job_id]
+            self.expired += 1
+        if len(self._jobs) < self.max_jobs:
+            return
+        finished = sorted((job for job in self._jobs.values() if job.done), key=lambda job: job.finished)
+        for job in finished[:len(self._jobs) - self.max_jobs + 1]:
+            del self._jobs[job.id]
+            self.expired += 1
+    
+    def submit(self, entry: str, run: Callable[[Progress], Dict[str, Any]]) -> Optional[Job]:
+        """提交任务，run(progress) 返回结果（执行中更新 progress）；任务表已满且都未结束时返回 None
+        
+        Raises:
+            RuntimeError: 任务表已停止
+        """
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("任务队列已停止")
+            self._prune()
+            if len(self._jobs) >= self.max_jobs:
+                self.rejected += 1
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="exec-job")
+            job = Job(entry)
+            self._jobs[job.id] = job
+            self.submitted += 1
+            self._executor.submit(self._run, job, run)
+        return job
+    
+    @staticmethod
+    def _run(job: Job, run: Callable[[Progress], Dict[str, Any]]):
+        if not job._set(RUNNING, only_from=QUEUED):
+            # 已取消
+            return
+        try:
+            result = run(job.progress)
+        except Exception as e:
+            logger.error(f"任务 {job.id} ({job.entry}) 执行失败: {e}")
+            job._set(FAILED, {"success": False, "error": str(e), "output": "", "operations": []})
+            return
+        job._set(DONE if result.get("success") else FAILED, result)
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+    
+    def stop(self):
+        """不再接受新任务，排队中的任务标记为 cancelled（执行中的任务照常结束）"""
+        with self._lock:
+            self._stopped = True
+            executor, self._executor = self._executor, None
+            queued = [job for job in self._jobs.values() if job.state == QUEUED]
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for job in queued:
+            if job._set(CANCELLED, {"success": False, "error": "任务已取消（服务停止）", "output": "", "operations": []},
+                        only_from=QUEUED):
+                self.cancelled += 1
+    
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            states: Dict[str, int] = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {
+                "jobs": len(self._jobs),
+                "states": states,
+                "max_jobs": self.max_jobs,
+                "ttl": self.ttl,
+                "submitted": self.submitted,
+                "expired": self.expired,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "stopped": self._stopped,
+            }
+
+
+def _event(name: str, data: Dict[str, Any]) -> bytes:
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode("utf-8")
+
+
+def iter_events(job: Job, heartbeat: float = HEARTBEAT) -> Iterator[bytes]:
+    """SSE 事件流：状态变化时推送 state，执行中每 heartbeat 秒推送 progress（含计量数），结束时推送 result"""
+    version = -1
+    while True:
+        current = job.wait(version, heartbeat)
+        info = job.info()
+        if current != version:
+            version = current
+            yield _event("state", info)
+        elif not job.done:
+            yield _event("progress", info)
+        if job.done:
+            yield _event("result", {"job": job.id, "state": job.state, "result": job.result})
+            return
+
+
+# 模块级的任务表
+store = JobStore()
@@ -0,0 +1,139 @@
+"""
+启动后的缓存预热
+- 备份加载完成后，在后台线程中对主表里每个注册了预热函数的 entry（见 registry() 的 "warm_up"，
+  目前是 .gen 和 .timer）调用一次预热函数，把解析结果提前放入各自的缓存（GEN 表、TimerEntry）
+- 每条之间让出 GIL，不阻塞请求处理；某条失败只记录错误，继续下一条
+- 进度见 status()，/api/_ready 在预热完成前返回 503
+
+解析结果（Generator 树、TimerEntry）要留在本进程的缓存中使用，而且包含无法 pickle 的闭包，
+因此在线程中预热，不使用进程池。
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from Database import Table
+from Common.logger import get_logger
+
+logger = get_logger("warmup")
+
+# 最多保留的错误信息条数
+MAX_ERRORS = 20
+
+
+class WarmUp:
+    """一次预热：扫描主表、逐条调用预热函数，并记录进度"""
+    
+    def __init__(self, warmers: Dict[str, Any], table: str = "main"):
+        self.warmers = dict(warmers)
+        self.table = table
+        self.state = "pending"        # pending -> scanning -> running -> done
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.errors: List[str] = []
+        self.by_mime: Dict[str, int] = {}
+        self.started = None
+        self.finished = None
+        self._thread = None
+        self._stop = threading.Event()
+    
+    def _targets(self) -> List[Tuple[str, str]]:
+        """在写时复制快照上找出需要预热的 (mime, key)；延迟加载的记录只读 mime，不反序列化"""
+        targets = []
+        with Table.of(self.table).snapshot() as snapshot:
+            for key, value in snapshot.items():
+                mime = getattr(value, "mime", None)
+                if mime in self.warmers:
+                    targets.append((mime, key))
+        return targets
+    
+    def start(self) -> "WarmUp":
+        self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self._thread.start()
+        return self
+    
+    def run(self):
+        self.started = time.time()
+        self.state = "scanning"
+        try:
+            targets = self._targets()
+        except Exception as e:
+            logger.warning(f"预热扫描失败: {e}")
+            targets = []
+        self.total = len(targets)
+        self.state = "running"
+        logger.info(f"开始预热 {self.total} 个 entry")
+        
+        for mime, key in targets:
+            if self._stop.is_set():
+                break
+            try:
+                self.warmers[mime](key)
+                self.by_mime[mime] = self.by_mime.get(mime, 0) + 1
+            except Exception as e:
+                self.failed += 1
+                if len(self.errors) < MAX_ERRORS:
+                    self.errors.append(f"{key}: {e}")
+            self.done += 1
+            # 让出 GIL，避免拖慢请求处理
+            time.sleep(0)
+        
+        self.finished = time.time()
+        self.state = "done"
+        logger.info(f"预热完成: {self.done - self.failed}/{self.total}，失败 {self.failed}，"
+                    f"耗时 {self.finished - self.started:.2f}s")
+    
+    def stop(self):
+        self._stop.set()
+    
+    def wait(self, timeout: float = None) -> bool:
+        """等待预热结束，返回是否已结束"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.state == "done"
+    
+    @property
+    def ready(self) -> bool:
+        return self.state == "done"
+    
+    def info(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+        return {
+            "state": self.state,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "progress": self.done / self.total if self.total else (1.0 if self.ready else 0.0),
+            "by_mime": dict(self.by_mime),
+            "errors": list(self.errors),
+            "elapsed": elapsed,
+        }
+
+
+# 当前的预热（未启动时为 None）
+current: Optional[WarmUp] = None
+
+
+def start_warm_up(table: str = "main") -> WarmUp:
+    """在后台开始预热（应在备份加载之后调用）；已有未完成的预热时直接返回它"""
+    global current
+    from . import warmers
+    if current is not None and not current.ready:
+        return current
+    current = WarmUp(warmers, table).start()
+    return current
+
+
+def stop_warm_up():
+    if current is not None:
+        current.stop()
+
+
+def status() -> Dict[str, Any]:
+    """就绪状态：未启动预热时视为就绪"""
+    if current is None:
+        return {"ready": True, "warm_up": None}
+    return {"ready": current.ready, "warm_up": current.info()}
@@ -1,10 +1,14 @@
 from Common.util import Request, FileResponse, HTMLResponse, JSONResponse, FastAPI, Query, Cookie, CORSMiddleware
 from Common.logger import setup_logging, get_logger
-from Database import getmime, init_backup_system, stop_backup_system
+from Common import sandbox
+from starlette.concurrency import run_in_threadpool
+from Database import getmime, init_backup_system, stop_backup_system, SNAPSHOT, EPHEMERAL
 from Express import wrap
 import Port
+from Port import jobs, warmup
 from server.assets_support import scan_assets_directories, serve
 from server.translate import replaceByBody, request2access
+from server import admin
 
 # 初始化日志系统（在创建 FastAPI app 之前）
 setup_logging()
@@ -24,9 +28,25 @@ async def startup_event():
         backup_dir=".backup",
         max_backups=15,
         backup_interval=10,
-        format="line"
+        format="line",
+        delta_every=30,
+        lazy_load=True,
+        # GEN 只缓存解析结果，重启后按需重新解析；TIMER 的触发计数只随定期快照保存，不写 WAL
+        durabilities={"GEN": EPHEMERAL, "TIMER": SNAPSHOT}
     )
     
+    # 后台预热 .gen / .timer 的解析结果，完成前 /api/_ready 返回 503
+    logger.info("开始后台预热...")
+    warmup.start_warm_up()
+    
+    # 用户脚本交给预先启动的工作进程执行（工作进程由 forkserver 创建，不继承本进程的线程和锁）
+    logger.info("启动脚本进程池...")
+    # 同步执行和定时任务共用的进程池：工作进程都被占用时最多等待 10 秒
+    sandbox.start_pool(workers=2, timeout=10, cpu_time=5, acquire_timeout=10)
+    # 异步任务专用的进程池，墙钟时间更长
+    from Port.Exec import JOB_BUDGET
+    sandbox.start_job_pool(workers=jobs.WORKERS, timeout=JOB_BUDGET.wall_time)
+    
     # 初始化定时任务管理器（模块级单例）
     logger.info("启动定时任务管理器...")
     from Port.Timer import timer_manager
@@ -41,11 +61,20 @@ async def shutdown_event():
     logger.info("=" * 60)
     logger.info("应用关闭中...")
     
+    warmup.stop_warm_up()
+    
+    # 不再执行排队中的异步任务
+    jobs.store.stop()
+    
     # 停止定时任务管理器（模块级单例）
     logger.info("停止定时任务管理器...")
     from Port.Timer import timer_manager
     timer_manager.stop()
     
+    logger.info("停止脚本进程池...")
+    sandbox.stop_pool()
+    sandbox.stop_job_pool()
+    
     logger.info("停止备份系统...")
     stop_backup_system()
     
@@ -68,6 +97,33 @@ async def serve_assets(path: str):
     """提供 assets 文件"""
     return serve(path)
 #------------
+# 管理接口（需在 /api/{path:path} 之前注册）
+@app.get("/api/_admin/backups")
+async def admin_backups(request: Request):
+    return await admin.list_backups(request)
+
+@app.post("/api/_admin/restore")
+async def admin_restore(request: Request):
+    return await admin.restore(request)
+
+@app.get("/api/_admin/code_cache")
+async def admin_code_cache(request: Request):
+    return await admin.code_cache(request)
+
+@app.get("/api/_export/{table}")
+async def export_table(table: str, request: Request):
+    return await admin.export_table(request, table)
+
+@app.post("/api/_import/{table}")
+async def import_table(table: str, request: Request):
+    return await admin.import_table(request, table)
+
+# 就绪检查（不需要管理权限）：预热完成前返回 503
+@app.get("/api/_ready")
+async def ready():
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+#------------
 @app.get("/api/{path:path}")
 async def api_get(path: str, request: Request):
     pack = request2access(request, path=path, by="api")
@@ -90,7 +146,8 @@ async def visit_post(request: Request):
 async def visit(pack):
     if pack.entry == "mock":
         return pack
-    return visit_internal(pack)
+    # 脚本执行会阻塞等待进程池中的工作进程，放到线程池里，事件循环可以同时处理其他请求
+    return await run_in_threadpool(visit_internal, pack)
 from Common.util import first_avail
 def visit_internal(pack):
     which = first_avail(getattr(pack, "suffix", None), getmime(pack.entry), "text")
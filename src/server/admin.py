@@ -0,0 +1,128 @@
+"""
+管理接口：备份列表、按时间点恢复、表数据的 NDJSON 导入 / 导出、脚本编译缓存统计
+- 设置了环境变量 TEXUS_ADMIN_TOKEN 时，请求需带相同的 X-Admin-Token 头
+- 否则只接受本机发出的请求
+"""
+import hmac
+import os
+import re
+
+from starlette.concurrency import run_in_threadpool
+
+from Common import code_cache_info
+from Common.util import Request, JSONResponse, StreamingResponse
+from Database import Table, get_backup_manager, ndjson, restore_backup, tables
+
+_LOCAL_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+def admin_allowed(request: Request) -> bool:
+    """请求是否有权访问管理接口"""
+    token = os.getenv("TEXUS_ADMIN_TOKEN")
+    if token:
+        return hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+    return request.client is not None and request.client.host in _LOCAL_HOSTS
+
+def _error(message, status_code):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+async def list_backups(request: Request):
+    """GET：清单中的全部备份，最新的在前"""
+    if not admin_allowed(request):
+        return _error("forbidden", 403)
+    manager = get_backup_manager()
+    if manager is None:
+        return _error("备份系统未初始化", 503)
+    return JSONResponse({"backups": manager.list_backups()})
+
+async def restore(request: Request):
+    """POST {"backup": 文件名, "at": 时间点, "deltas": true}：恢复到指定备份或时间点
+    
+    加载在线程池中进行，事件循环照常处理其他请求。
+    """
+    if not admin_allowed(request):
+        return _error("forbidden", 403)
+    if get_backup_manager() is None:
+        return _error("备份系统未初始化", 503)
+    try:
+        body = await request.json() if await request.body() else {}
+    except ValueError:
+        return _error("请求体不是有效的 JSON", 400)
+    if not isinstance(body, dict):
+        return _error("请求体必须是 JSON 对象", 400)
+    
+    try:
+        result = await run_in_threadpool(
+            restore_backup, body.get("backup"), body.get("at"), bool(body.get("deltas", True))
+        )
+    except ValueError as e:
+        return _error(str(e), 404)
+    except RuntimeError as e:
+        return _error(str(e), 409)
+    if result is None:
+        return _error("加载备份失败", 500)
+    return JSONResponse(result)
+
+async def code_cache(request: Request):
+    """GET：脚本编译缓存的条目数、命中率和淘汰次数"""
+    if not admin_allowed(request):
+        return _error("forbidden", 403)
+    return JSONResponse(code_cache_info())
+
+# 表名会写进 line 格式的表头，不能包含空白
+_TABLE_NAME = re.compile(r"[\w.-]+")
+
+async def export_table(request: Request, table_name: str):
+    """GET：以 NDJSON 流式导出整个表（写时复制快照，按键的字典序）"""
+    if not admin_allowed(request):
+        return _error("forbidden", 403)
+    table = tables.get(table_name)
+    if table is None:
+        return _error(f"表不存在: {table_name}", 404)
+    # 同步生成器由 StreamingResponse 放到线程池中迭代
+    return StreamingResponse(ndjson.iter_export(table), media_type="application/x-ndjson")
+
+async def import_table(request: Request, table_name: str):
+    """POST：逐块读取 NDJSON 请求体，每 ndjson.BATCH 行写入一批，最后只等待一次日志落盘
+    
+    表不存在时创建。某一行无法解析时停止，之前的批次已经写入。
+    """
+    if not admin_allowed(request):
+        return _error("forbidden", 403)
+    if not _TABLE_NAME.fullmatch(table_name):
+        return _error(f"无效的表名: {table_name}", 400)
+    table = Table.of(table_name)
+    
+    imported = 0
+    lsn = None
+    next_line = 1
+    pending = []
+    remainder = b""
+    
+    async def flush():
+        nonlocal imported, lsn, next_line, pending
+        batch, pending = pending, []
+        count, batch_lsn = await run_in_threadpool(ndjson.import_lines, table, batch, next_line)
+        imported += count
+        lsn = batch_lsn or lsn
+        next_line += len(batch)
+    
+    try:
+        async for chunk in request.stream():
+            lines = (remainder + chunk).split(b"\n")
+            remainder = lines.pop()
+            pending.extend(lines)
+            if len(pending) >= ndjson.BATCH:
+                await flush()
+        if remainder:
+            pending.append(remainder)
+        if pending:
+            await flush()
+    except ValueError as e:
+        return JSONResponse({"error": str(e), "table": table_name, "imported": imported}, status_code=400)
+    finally:
+        # 已写入的批次：等待日志落盘，并让下次备份整表保存
+        await run_in_threadpool(Table.wait_durable, lsn)
+        if imported:
+            table.sync()
+    
+    return JSONResponse({"table": table_name, "imported": imported})
@@ -0,0 +1,44 @@
+"""测试共用的夹具：每个测试使用独立命名的表和临时的备份目录"""
+import itertools
+
+import pytest
+
+import Database
+from Database import BackupManager, Table
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def make_table():
+    """创建新表（名字不与其他测试重复），测试结束后从全局表字典中移除"""
+    created = []
+    
+    def make(prefix="t", **kwargs):
+        table = Table(f"test_{prefix}_{next(_names)}", **kwargs)
+        created.append(table)
+        return table
+    
+    yield make
+    for table in created:
+        Database.tables.pop(table.name, None)
+        if hasattr(table.inner, "close"):
+            table.inner.close()
+
+
+@pytest.fixture
+def make_manager(tmp_path):
+    """在临时目录中创建 BackupManager，测试结束后停止自动备份并关闭 WAL"""
+    managers = []
+    
+    def make(**kwargs):
+        kwargs.setdefault("backup_dir", str(tmp_path / "backup"))
+        manager = BackupManager(**kwargs)
+        managers.append(manager)
+        return manager
+    
+    yield make
+    for manager in managers:
+        manager.stop_auto_backup()
+        manager.close_wal()
+    Table.wal = None
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+from starlette.testclient import TestClient
+
+import Database
+from Common.base import entry
+
+TOKEN = "test-admin-token"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("TEXUS_ADMIN_TOKEN", TOKEN)
+    from app import app
+    return TestClient(app)
+
+
+def _auth():
+    return {"X-Admin-Token": TOKEN}
+
+
+def test_admin_requires_token(client, make_table):
+    table = make_table("admin")
+    assert client.get(f"/api/_export/{table.name}").status_code == 403
+    assert client.get(f"/api/_export/{table.name}", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+
+def test_test_client_is_not_a_local_host(monkeypatch, make_table):
+    monkeypatch.delenv("TEXUS_ADMIN_TOKEN", raising=False)
+    from app import app
+    table = make_table("admin")
+    assert TestClient(app).get(f"/api/_export/{table.name}").status_code == 403
+
+
+def test_ndjson_export_import_round_trip(client, make_table):
+    source = make_table("ndjson")
+    text = entry("text", {"text": "hello\n世界", "lastSavedTime": datetime(2025, 1, 2, 3, 4, 5)})
+    text.lastModifiedTime = datetime(2025, 1, 2, 3, 4, 6)
+    source.set("doc", text)
+    source.set("raw", {"n": 1, "list": [1, 2, "三"]})
+    for i in range(50):
+        source.set(f"k{i:03d}", i)
+    
+    exported = client.get(f"/api/_export/{source.name}", headers=_auth())
+    assert exported.status_code == 200
+    lines = exported.content.splitlines()
+    assert len(lines) == 52
+    
+    target = make_table("ndjson")
+    response = client.post(f"/api/_import/{target.name}", content=exported.content, headers=_auth())
+    assert response.json() == {"table": target.name, "imported": 52}
+    assert list(target.scan_keys()) == list(source.scan_keys())
+    doc = target.get("doc")
+    assert doc.mime == "text" and doc.value == text.value
+    assert doc.lastModifiedTime == text.lastModifiedTime
+    assert target.get("raw") == {"n": 1, "list": [1, 2, "三"]}
+    assert target.get("k049") == 49
+
+
+def test_ndjson_import_stops_at_bad_line(client, make_table):
+    target = make_table("ndjson")
+    body = b'{"key":"a","mime":"raw","value":1}\n{"key":"b"\n{"key":"c","mime":"raw","value":3}\n'
+    response = client.post(f"/api/_import/{target.name}", content=body, headers=_auth())
+    assert response.status_code == 400
+    assert response.json()["imported"] == 0
+    assert target.get("a") is None and target.get("c") is None
+
+
+def test_ndjson_import_rejects_bad_table_name(client):
+    response = client.post("/api/_import/bad name", content=b"", headers=_auth())
+    assert response.status_code == 400
+    assert "bad name" not in Database.tables
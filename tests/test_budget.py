@@ -0,0 +1,77 @@
+"""执行预算：墙钟时间由看门狗负责，指令数只在指定时跟踪"""
+import sys
+import time
+
+from Common import sandbox
+from Common.eval import Budget, execute_script
+
+
+def test_wall_time_stops_loop_without_tracing(monkeypatch):
+    calls = []
+    real_settrace = sys.settrace
+    monkeypatch.setattr(sys, "settrace", lambda fn: (calls.append(fn), real_settrace(fn)))
+    started = time.monotonic()
+    result = execute_script("while True:\n    pass", budget=Budget(wall_time=0.2))
+    assert not result.success
+    assert result.budget_exceeded["budget"] == "wall_time"
+    assert time.monotonic() - started < 2
+    assert calls == []
+
+
+def test_wall_time_cannot_be_swallowed():
+    script = "while True:\n    try:\n        while True:\n            pass\n    except:\n        pass"
+    result = execute_script(script, budget=Budget(wall_time=0.2))
+    assert result.budget_exceeded["budget"] == "wall_time"
+
+
+def test_watchdog_never_fires_after_script_returns():
+    # 预算与脚本耗时相当：注入可能发生在脚本结束的前后
+    for i in range(1000):
+        script = "x = 0\nfor i in range(300):\n    x += i"
+        result = execute_script(script, budget=Budget(wall_time=0.00001 + 0.00002 * (i % 10)))
+        assert result.success or result.budget_exceeded["budget"] == "wall_time"
+        for _ in range(100):
+            pass
+    # 之后的代码不会再收到注入的异常
+    time.sleep(0.2)
+
+
+def test_ops_tracing_still_works_after_watchdog():
+    assert execute_script("while True:\n    pass", budget=Budget(wall_time=0.05)).budget_exceeded
+    result = execute_script("while True:\n    pass", budget=Budget(ops=1000))
+    assert result.budget_exceeded == {"budget": "ops", "limit": 1000, "used": 1001}
+
+
+def test_ops_budget_is_sticky():
+    script = "try:\n    while True:\n        pass\nexcept Exception:\n    pass\nprint('after')"
+    result = execute_script(script, budget=Budget(ops=10_000))
+    assert not result.success
+    assert result.budget_exceeded["budget"] == "ops"
+    assert "after" not in result.output
+
+
+def test_db_ops_and_output_budgets():
+    result = execute_script("for i in range(10):\n    db.exists('k')", budget=Budget(db_ops=5))
+    assert result.budget_exceeded == {"budget": "db_ops", "limit": 5, "used": 6}
+    result = execute_script("print('x' * 100)", budget=Budget(output=10))
+    assert result.budget_exceeded["budget"] == "output"
+
+
+def test_script_header_only_tightens():
+    script = "# budget: db_ops=2\nfor i in range(3):\n    db.exists('k')"
+    assert execute_script(script, budget=Budget(db_ops=100)).budget_exceeded["limit"] == 2
+    script = "# budget: db_ops=100\nfor i in range(3):\n    db.exists('k')"
+    assert execute_script(script, budget=Budget(db_ops=2)).budget_exceeded["limit"] == 2
+
+
+def test_pool_kills_worker_stuck_in_builtin():
+    pool = sandbox.ScriptPool(workers=1, timeout=5).start()
+    try:
+        started = time.monotonic()
+        result = pool.run("print(sum(range(10**12)))", budget=Budget(wall_time=0.3))
+        assert result.budget_exceeded["budget"] == "wall_time"
+        assert time.monotonic() - started < 0.3 + sandbox.KILL_GRACE + 2
+        assert pool.info()["restarts"] == 1
+        assert pool.run("print(1)").output.strip() == "1"
+    finally:
+        pool.stop()
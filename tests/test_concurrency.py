@@ -0,0 +1,108 @@
+"""并发的读-改-写：update / compare_and_set / setdefault 不丢失更新"""
+import sys
+import threading
+import time
+
+import pytest
+
+THREADS = 8
+ROUNDS = 200
+
+
+@pytest.fixture(autouse=True)
+def frequent_switches():
+    """缩短线程切换间隔，让竞争窗口更容易被命中"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+class _YieldingStore(dict):
+    """读取后主动让出 CPU 的存储引擎：读和写之间总有其他线程插进来"""
+    
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        time.sleep(0)
+        return value
+
+
+@pytest.fixture
+def table(make_table):
+    return make_table("cas", engine=_YieldingStore())
+
+
+def _race(target):
+    start = threading.Barrier(THREADS)
+    errors = []
+    
+    def run(index):
+        start.wait()
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
+
+
+def test_update_increments_are_not_lost(table):
+
+    def work(index):
+        for _ in range(ROUNDS):
+            table.update("counter", lambda value: value + 1, default=0)
+            table.update(f"own{index % 2}", lambda value: value + 1, default=0)
+    
+    _race(work)
+    assert table.get("counter") == THREADS * ROUNDS
+    assert table.get("own0") + table.get("own1") == THREADS * ROUNDS
+
+
+def test_compare_and_set_retry_loop(table):
+    table.set("counter", 0)
+    failures = []
+    
+    def work(index):
+        failed = 0
+        for _ in range(ROUNDS):
+            while True:
+                current = table.get("counter")
+                if table.compare_and_set("counter", current, current + 1):
+                    break
+                failed += 1
+        failures.append(failed)
+    
+    _race(work)
+    assert table.get("counter") == THREADS * ROUNDS
+    assert len(failures) == THREADS
+
+
+def test_compare_and_set_expected_none_requires_missing_key(table):
+    winners = []
+    
+    def work(index):
+        if table.compare_and_set("lock", None, f"owner{index}"):
+            winners.append(index)
+    
+    _race(work)
+    assert len(winners) == 1
+    assert table.get("lock") == f"owner{winners[0]}"
+    assert not table.compare_and_set("lock", None, "late")
+
+
+def test_setdefault_has_single_winner(table):
+    results = {}
+    
+    def work(index):
+        results[index] = table.setdefault("config", {"owner": index})
+    
+    _race(work)
+    winner = table.get("config")
+    assert len(results) == THREADS
+    assert all(value is winner for value in results.values())
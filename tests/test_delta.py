@@ -0,0 +1,67 @@
+"""增量链：全量快照之后的增量按顺序应用（包括删除）"""
+from pathlib import Path
+
+import pytest
+
+from Common.base import entry
+
+
+def _text(text):
+    return entry(mime="text", value={"text": text})
+
+
+def _contents(table):
+    # 逐个 get：延迟加载的记录在 get 时反序列化
+    contents = {}
+    for key in list(table.scan_keys()):
+        value = table.get(key)
+        contents[key] = value.value if isinstance(value, entry) else value
+    return contents
+
+
+@pytest.mark.parametrize("lazy_load", [False, True])
+def test_load_applies_delta_chain(make_table, make_manager, lazy_load):
+    manager = make_manager(format="line", delta_every=5, lazy_load=lazy_load)
+    table = make_table("delta")
+    table.set_many((f"k{i:02d}", _text(f"v{i}")) for i in range(10))
+    full = Path(manager.create_backup({table.name: table}))
+    assert full.name.startswith("backup_")
+    
+    table.set("k01", _text("changed"))
+    table.delete("k02")
+    table.set("raw", [1, 2, 3])
+    first = Path(manager.create_backup({table.name: table}))
+    assert first.name.startswith("delta_") and first.name.endswith("_0001.txt")
+    
+    table.set("k03", _text("changed then deleted"))
+    table.delete("k03")
+    table.set("k02", _text("back again"))
+    table.set("key with spaces", _text("x"))
+    second = Path(manager.create_backup({table.name: table}))
+    assert second.name.endswith("_0002.txt")
+    expected = _contents(table)
+    
+    target = make_table("delta")
+    loader = make_manager(format="line", delta_every=5, lazy_load=lazy_load)
+    assert loader.load_latest_backup({table.name: target})
+    assert _contents(target) == expected
+    assert "k03" not in expected and expected["k02"] == {"text": "back again"}
+    
+    # 加载之后继续这条增量链，而不是重新写全量快照
+    target.set("k04", _text("after load"))
+    third = Path(loader.create_backup({table.name: target}))
+    assert third.name.endswith("_0003.txt")
+
+
+def test_delta_only_contains_changed_keys(make_table, make_manager):
+    manager = make_manager(format="line", delta_every=5)
+    table = make_table("delta")
+    table.set_many((f"k{i:03d}", _text(f"v{i}")) for i in range(100))
+    manager.create_backup({table.name: table})
+    table.set("k050", _text("changed"))
+    table.delete("k051")
+    delta = Path(manager.create_backup({table.name: table})).read_text(encoding="utf-8").splitlines()
+    records = [line for line in delta if line.startswith(("- ", "x "))]
+    assert len(records) == 2
+    assert records[0].split(" ")[3] == "k050"
+    assert records[1] == "x k051"
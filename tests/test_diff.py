@@ -0,0 +1,45 @@
+"""快照比较与 apply_delta：差异经由 Table 的写入路径应用"""
+from Common.base import entry
+
+
+def _text(text):
+    return entry(mime="text", value={"text": text})
+
+
+def _contents(table):
+    return {key: (value.value if isinstance(value, entry) else value) for key, value in table.get_all_data()["data"].items()}
+
+
+def test_apply_delta_goes_through_write_path(tmp_path, make_table, make_manager):
+    table = make_table("diff")
+    table.set_many((f"k{i:02d}", _text(f"v{i}")) for i in range(20))
+    old = make_manager(backup_dir=str(tmp_path / "a"), format="line").create_backup({table.name: table})
+    before = _contents(table)
+    
+    table.set("k03", _text("changed"))
+    table.delete("k05")
+    table.set("new key", {"raw": True})
+    new = make_manager(backup_dir=str(tmp_path / "b"), format="line").create_backup({table.name: table})
+    after = _contents(table)
+    
+    manager = make_manager(backup_dir=str(tmp_path / "a"), format="line")
+    delta = tmp_path / "a_to_b.txt"
+    result = manager.diff(old, new, delta_path=str(delta))
+    assert (result["added"], result["removed"], result["changed"]) == (1, 1, 1)
+    
+    target = make_table("diff")
+    target.set_many((f"k{i:02d}", _text(f"v{i}")) for i in range(20))
+    list(target.scan_keys())                 # 建立有序键索引
+    target._dirty_keys.clear()
+    version = target._version
+    with target.snapshot() as snapshot:
+        assert manager.apply_delta({table.name: target}, str(delta)) == 3
+        # 打开中的快照仍是应用之前的内容
+        assert snapshot.get("k05").value == before["k05"]
+        assert snapshot.get("new key") is None
+    
+    assert _contents(target) == after
+    assert list(target.scan_keys()) == sorted(after)
+    assert target._version == version + 3
+    assert target._dirty_keys == {"k03", "new key"}
+    assert target._deleted_keys == {"k05"}
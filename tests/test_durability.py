@@ -0,0 +1,24 @@
+import Database
+from Database import EPHEMERAL, SNAPSHOT, Table, init_backup_system, stop_backup_system
+
+
+def test_init_backup_system_declares_durability_before_load(tmp_path, make_manager):
+    backup_dir = str(tmp_path / "backup")
+    keep, cache = Table("test_dur_keep"), Table("test_dur_cache")
+    try:
+        keep.set("count", 3)
+        cache.set("parsed", "stale")
+        make_manager(backup_dir=backup_dir, format="line").create_backup({t.name: t for t in (keep, cache)})
+        del Database.tables[keep.name], Database.tables[cache.name]
+        
+        init_backup_system(backup_dir=backup_dir, format="line", backup_interval=600,
+                           durabilities={keep.name: SNAPSHOT, cache.name: EPHEMERAL})
+        keep, cache = Database.tables[keep.name], Database.tables[cache.name]
+        assert keep.durability == SNAPSHOT
+        assert keep.get("count") == 3
+        assert cache.durability == EPHEMERAL
+        assert cache.get("parsed") is None
+    finally:
+        stop_backup_system()
+        Database.tables.pop("test_dur_keep", None)
+        Database.tables.pop("test_dur_cache", None)
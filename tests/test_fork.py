@@ -0,0 +1,69 @@
+"""fork 备份：只用于内存表，子进程不输出日志，卡住的子进程会被强制结束"""
+import os
+import time
+
+import pytest
+
+from Common.base import entry
+from Database import backup, storage
+from Database.backup import BackupManager
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 fork")
+
+
+def _fill(table):
+    table.set_many((f"k{i}", entry(mime="text", value={"text": str(i)})) for i in range(100))
+
+
+def test_fork_backup_round_trip_without_child_logging(make_table, make_manager, tmp_path, monkeypatch):
+    table = make_table("fork")
+    _fill(table)
+    manager = make_manager(format="line", mode="fork")
+    manager.verbose = True
+    # 记录每次输出所在的进程（子进程用 os._exit 退出，stdout 中的输出看不到）
+    printed = tmp_path / "printed"
+    
+    def record(*args, **kwargs):
+        with open(printed, "a") as f:
+            f.write(f"{os.getpid()}\n")
+    
+    monkeypatch.setattr(backup, "print", record, raising=False)
+    assert manager.create_backup({table.name: table})
+    assert manager._fork_stats["exit_code"] == 0
+    assert set(printed.read_text().split()) == {str(os.getpid())}
+    
+    target = make_table("fork")
+    assert make_manager(format="line").load_latest_backup({table.name: target})
+    assert target.get("k42").value == {"text": "42"}
+
+
+def test_fork_refuses_other_engines(make_table, make_manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_DIR", str(tmp_path / "storage"))
+    table = make_table("fork", engine="sqlite")
+    _fill(table)
+    manager = make_manager(format="line", mode="fork")
+    with pytest.raises(ValueError):
+        manager.create_backup_forked({table.name: table})
+    # 自动选择时退回线程内备份
+    assert manager.create_backup({table.name: table})
+    assert manager._fork_stats is None
+
+
+def test_hung_child_is_killed(make_table, make_manager, monkeypatch):
+    table = make_table("fork")
+    _fill(table)
+    manager = make_manager(format="line", mode="fork")
+    monkeypatch.setattr(backup, "FORK_TIMEOUT", 0.5)
+    
+    def hang(*args, **kwargs):
+        time.sleep(60)
+    
+    monkeypatch.setattr(BackupManager, "_write_full_backup", hang)
+    started = time.monotonic()
+    assert manager.create_backup({table.name: table}) is None
+    assert time.monotonic() - started < 10
+    assert not list(manager.backup_dir.glob("backup_*"))
+    
+    # 失败后备份锁已释放，修改仍记为未备份，下一次备份照常进行
+    monkeypatch.undo()
+    assert manager.create_backup({table.name: table})
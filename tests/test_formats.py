@@ -0,0 +1,120 @@
+"""全量快照的往返：每种格式 × 压缩方式写出后重新加载，内容与时间戳不变"""
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from Common.base import entry
+from Database import sharded
+from Database.backup import TOML_AVAILABLE
+
+FORMATS = ["line", "json", "bin",
+           pytest.param("toml", marks=pytest.mark.skipif(not TOML_AVAILABLE, reason="未安装 toml"))]
+COMPRESSIONS = [None, "gzip", "lzma"]
+
+MODIFIED = datetime(2024, 5, 6, 7, 8, 9)
+
+
+def _fill(table):
+    values = {
+        "plain": entry(mime="text", value={"text": "hello"}),
+        "multiline": entry(mime="text", value={"text": "第一行\n第二行\t\"引号\" \\ 反斜杠"}),
+        "key with spaces": entry(mime="text", value={"text": ""}),
+        # toml 不支持混合类型的数组和 None，这里只用各格式都能表示的值
+        "nested": entry(mime="json", value={"words": ["one", "two"], "numbers": [1, 2, 3], "ratio": 2.5, "flag": True}),
+    }
+    values.update((f"k{i:04d}", entry(mime="text", value={"text": f"v{i}"})) for i in range(200))
+    for value in values.values():
+        value.lastModifiedTime = MODIFIED
+    table.set_many(values.items())
+    return values
+
+
+def _assert_same(target, expected):
+    assert sorted(target.scan_keys()) == sorted(expected)
+    for key, value in expected.items():
+        loaded = target.get(key)
+        assert isinstance(loaded, entry), key
+        assert (loaded.mime, loaded.value) == (value.mime, value.value), key
+        assert loaded.lastModifiedTime == MODIFIED, key
+
+
+def _round_trip(make_table, make_manager, **options):
+    table = make_table("fmt")
+    expected = _fill(table)
+    make_manager(**options).create_backup({table.name: table})
+    target = make_table("fmt")
+    assert make_manager(**options).load_latest_backup({table.name: target})
+    _assert_same(target, expected)
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("format", FORMATS)
+def test_round_trip(make_table, make_manager, format, compression):
+    _round_trip(make_table, make_manager, format=format, compression=compression)
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_round_trip_fork(make_table, make_manager, compression):
+    _round_trip(make_table, make_manager, format="line", compression=compression, mode="fork")
+
+
+@pytest.mark.parametrize("format", ["line", "bin"])
+def test_round_trip_sharded(make_table, make_manager, format):
+    _round_trip(make_table, make_manager, format=format, workers=2, shard_size=50)
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_corrupt_snapshot_falls_back_without_leftovers(make_table, make_manager, compression):
+    table = make_table("fmt")
+    table.set_many((f"k{i:04d}", entry(mime="text", value={"text": f"old {i}" * 8})) for i in range(2000))
+    manager = make_manager(format="line", compression=compression)
+    manager.create_backup({table.name: table})
+    older = {key: table.get(key).value for key in table.scan_keys()}
+    
+    # 文件名精确到秒，第二个快照需要新的时间戳
+    time.sleep(1.1)
+    table.set("a_new_only_in_corrupt_snapshot", entry(mime="text", value={"text": "new"}))
+    table.set_many((f"k{i:04d}", entry(mime="text", value={"text": f"new {i}" * 8})) for i in range(2000))
+    newest = Path(manager.create_backup({table.name: table}))
+    data = bytearray(newest.read_bytes())
+    middle = len(data) // 2
+    data[middle:middle + 64] = b"\xff" * 64
+    newest.write_bytes(bytes(data))
+    
+    target = make_table("fmt")
+    assert make_manager(format="line", compression=compression).load_latest_backup({table.name: target})
+    assert {key: target.get(key).value for key in target.scan_keys()} == older
+
+
+class NoteEntry(entry, mime="test_note"):
+    """注册到备份系统的 entry 子类：分片工作进程需要导入本模块才能按 mime 还原它"""
+
+
+def test_sharded_load_restores_registered_subclass(make_table, make_manager):
+    table = make_table("fmt")
+    table.set_many((f"k{i:03d}", NoteEntry(mime="test_note", value={"text": str(i)})) for i in range(120))
+    make_manager(format="line", workers=2, shard_size=50).create_backup({table.name: table})
+    target = make_table("fmt")
+    assert make_manager(format="line", workers=2, shard_size=50).load_latest_backup({table.name: target})
+    assert type(target.get("k007")) is NoteEntry
+    assert target.get("k007").value == {"text": "7"}
+
+
+class _Unpicklable(entry):
+    def __reduce_ex__(self, protocol):
+        raise TypeError("不能 pickle")
+
+
+def test_iter_chunks_checks_picklability_once_per_type(monkeypatch):
+    monkeypatch.setattr(sharded, "_picklable_types", {})
+    calls = []
+    dumps = sharded.pickle.dumps
+    monkeypatch.setattr(sharded.pickle, "dumps", lambda *args, **kwargs: calls.append(1) or dumps(*args, **kwargs))
+    records = {f"n{i}": NoteEntry(mime="test_note", value={"text": "x"}) for i in range(50)}
+    records.update((f"u{i}", _Unpicklable(mime="text", value={"text": "y"})) for i in range(50))
+    chunks = list(sharded.iter_chunks(records, 30, "line"))
+    assert len(calls) == 2
+    values = [value for chunk in chunks for value in chunk.values()]
+    assert sum(isinstance(value, sharded.FrozenEntry) for value in values) == 50
@@ -0,0 +1,132 @@
+"""异步任务：生命周期、进度、停止时取消排队中的任务、进程池的容量"""
+import json
+import threading
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+from Common import sandbox
+from Common.eval import Budget, Progress, execute_script
+from Port import jobs
+
+
+def _wait(job, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not job.done and time.monotonic() < deadline:
+        job.wait(job.version, 0.1)
+    assert job.done, job.info()
+
+
+def test_job_lifecycle_reports_meter_counters():
+    store = jobs.JobStore(workers=1)
+    try:
+        job = store.submit("t", lambda progress: {"success": execute_script(
+            "for i in range(5):\n    db.exists('k')\nprint('ok')", progress=progress).success})
+        _wait(job)
+        assert job.state == jobs.DONE
+        info = job.info()
+        assert info["progress"]["db_ops"] == 5
+        assert info["progress"]["output"] == 3
+        assert store.get(job.id) is job
+    finally:
+        store.stop()
+
+
+def test_stream_forwards_progress():
+    store = jobs.JobStore(workers=1)
+    release = threading.Event()
+    
+    def run(progress):
+        progress.update({"ops": 0, "db_ops": 7, "output": 0, "elapsed": 0.1})
+        release.wait(5)
+        return {"success": True}
+    
+    try:
+        job = store.submit("t", run)
+        events = jobs.iter_events(job, heartbeat=0.05)
+        seen = []
+        for raw in events:
+            name, data = raw.decode().split("\n")[:2]
+            seen.append((name[len("event: "):], json.loads(data[len("data: "):])))
+            if seen[-1][0] == "progress":
+                release.set()
+        names = [name for name, _ in seen]
+        assert names[0] == "state" and names[-1] == "result"
+        progress = [data for name, data in seen if name == "progress"]
+        assert progress and progress[0]["progress"]["db_ops"] == 7
+    finally:
+        release.set()
+        store.stop()
+
+
+def test_stop_cancels_queued_jobs_and_refuses_submits():
+    store = jobs.JobStore(workers=1)
+    release = threading.Event()
+    running = store.submit("a", lambda progress: release.wait(5) and {"success": True})
+    queued = store.submit("b", lambda progress: {"success": True})
+    while running.state == jobs.QUEUED:
+        time.sleep(0.01)
+    
+    store.stop()
+    assert queued.state == jobs.CANCELLED
+    assert queued.done and queued.result["success"] is False
+    with pytest.raises(RuntimeError):
+        store.submit("c", lambda progress: {"success": True})
+    
+    release.set()
+    _wait(running)
+    assert running.state == jobs.DONE
+    assert store.info()["cancelled"] == 1
+
+
+def test_pool_forwards_progress_from_worker(monkeypatch):
+    # 缩短上报间隔，脚本执行期间一定能收到几次部分计量数
+    monkeypatch.setattr(sandbox, "PROGRESS_EVERY", 0.02)
+    pool = sandbox.ScriptPool(workers=1, timeout=10).start()
+    try:
+        progress = Progress()
+        seen = []
+        result = []
+        script = "for i in range(400):\n    db.exists('k')\n    for j in range(20000):\n        pass"
+        thread = threading.Thread(target=lambda: result.append(pool.run(script, progress=progress)))
+        thread.start()
+        while thread.is_alive():
+            seen.append(progress.snapshot().get("db_ops", 0))
+            time.sleep(0.05)
+        thread.join()
+        assert result[0].success, result[0].output
+        assert progress.snapshot()["db_ops"] == 400
+        # 执行中就收到过部分计量数
+        assert any(0 < count < 400 for count in seen)
+    finally:
+        pool.stop()
+
+
+def test_pool_acquire_timeout():
+    pool = sandbox.ScriptPool(workers=1, timeout=5, acquire_timeout=0.2).start()
+    try:
+        busy = threading.Thread(target=pool.run, args=("while True:\n    pass",),
+                                kwargs={"budget": Budget(wall_time=1)})
+        busy.start()
+        time.sleep(0.2)
+        started = time.monotonic()
+        result = pool.run("print(1)")
+        assert not result.success
+        assert time.monotonic() - started < 1
+        assert pool.info()["busy"] == 1
+        busy.join()
+        assert pool.run("print(1)").success
+    finally:
+        pool.stop()
+
+
+def test_submit_through_api():
+    from app import app
+    client = TestClient(app)
+    submitted = client.get("/api/job_test.py", params={"op": "submit", "script": "print(1 + 1)"}).json()
+    assert submitted["state"] in (jobs.QUEUED, jobs.RUNNING, jobs.DONE)
+    _wait(jobs.store.get(submitted["job"]))
+    value = client.get("/api/job_test.py", params={"op": "result", "job": submitted["job"]}).json()
+    assert value["state"] == jobs.DONE
+    assert value["result"]["output"] == "2\n"
@@ -0,0 +1,161 @@
+"""在线恢复：与并发写入、打开中的快照和 fork 备份同时进行"""
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from Common.base import entry
+from Database.table import ordered_write_locks
+
+
+def _text(text):
+    return entry(mime="text", value={"text": text})
+
+
+@pytest.fixture
+def pair(make_table):
+    # 名字的字典序与插入顺序相反：按插入顺序加锁就会与按表名加锁的顺序冲突
+    b = make_table("b")
+    a = make_table("a")
+    return {b.name: b, a.name: a}
+
+
+def test_restore_with_concurrent_writes(pair, make_manager):
+    manager = make_manager(format="line")
+    a, b = list(pair.values())
+    for i in range(200):
+        a.set(f"k{i:03d}", _text("old"))
+        b.set(f"k{i:03d}", _text("old"))
+    backup = Path(manager.create_backup(pair)).name
+    for i in range(200):
+        a.set(f"k{i:03d}", _text("new"))
+    
+    errors = []
+    stop = threading.Event()
+    
+    def writer():
+        i = 0
+        while not stop.is_set():
+            try:
+                b.set(f"w{i}", _text("w"))
+                b.update("counter", lambda value: (value or 0) + 1)
+            except Exception as e:
+                errors.append(e)
+                return
+            i += 1
+    
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        result = manager.restore(pair, backup=backup)
+    finally:
+        stop.set()
+        thread.join()
+    
+    assert errors == []
+    assert result["backup"] == backup and sorted(result["tables"]) == sorted(pair)
+    assert all(a.get(f"k{i:03d}").value["text"] == "old" for i in range(200))
+    # 恢复之后的写入照常进行
+    b.set("after", _text("x"))
+    assert b.get("after").value["text"] == "x"
+
+
+def test_snapshot_open_during_restore_keeps_old_contents(pair, make_manager):
+    manager = make_manager(format="line")
+    a = next(iter(pair.values()))
+    for i in range(100):
+        a.set(f"k{i:03d}", _text("backup"))
+    backup = Path(manager.create_backup(pair)).name
+    for i in range(100):
+        a.set(f"k{i:03d}", _text("live"))
+    a.set("extra", _text("live"))
+    
+    with a.snapshot() as snap:
+        a.set("k000", _text("after-snapshot"))
+        first = list(zip(range(10), snap.items(batch=8)))
+        manager.restore(pair, backup=backup)
+        a.set("k050", _text("after-restore"))
+        rest = list(snap.items(batch=8))
+    
+    seen = dict(rest)
+    assert len(seen) == 101 and [key for _, (key, _) in first] == sorted(seen)[:10]
+    assert {value.value["text"] for value in seen.values()} == {"live"}
+    assert a.get("extra") is None and a.get("k001").value["text"] == "backup"
+
+
+def test_replace_all_bumps_version_and_detaches_snapshots(make_table):
+    table = make_table()
+    table.set("a", 1)
+    table.set("b", 2)
+    snap = table.snapshot()
+    table.delete("a")
+    version = table._version
+    table.replace_all({"z": 26})
+    assert table._version > version and table._snapshots == []
+    table.set("b", 3)
+    assert dict(snap.items()) == {"a": 1, "b": 2} and snap.get("z") is None
+    snap.close()
+
+
+def test_lock_order_is_by_table_name(pair):
+    tables = list(pair.values())
+    ordered = sorted(tables, key=lambda table: table.name)
+    assert ordered_write_locks(tables) == [table._write_lock for table in ordered]
+
+
+class _SlowLock:
+    """拿到锁之后稍等片刻，放大两个线程各持有一部分表锁的时间窗口"""
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+    
+    def acquire(self, blocking=True, timeout=-1):
+        acquired = self._lock.acquire(blocking, timeout)
+        time.sleep(0.002)
+        return acquired
+    
+    def release(self):
+        self._lock.release()
+    
+    def __enter__(self):
+        return self.acquire()
+    
+    def __exit__(self, *exc):
+        self.release()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 fork")
+def test_fork_backup_and_restore_do_not_deadlock(pair, make_manager):
+    manager = make_manager(format="line", mode="fork", max_backups=100)
+    for table in pair.values():
+        table._write_lock = _SlowLock()
+    for table in pair.values():
+        table.set("k", _text("v"))
+    backup = Path(manager.create_backup(pair)).name
+    # 快照按秒命名：之后的 fork 备份不能覆盖要恢复的这一个
+    time.sleep(1.1)
+    errors = []
+    
+    def backups():
+        for _ in range(10):
+            for table in pair.values():
+                table.sync()
+            if manager.create_backup(pair) is None:
+                errors.append("fork 备份失败")
+    
+    def restores():
+        for _ in range(10):
+            try:
+                manager.restore(pair, backup=backup)
+            except RuntimeError:
+                pass
+    
+    threads = [threading.Thread(target=backups, daemon=True), threading.Thread(target=restores, daemon=True)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert not any(thread.is_alive() for thread in threads), "fork 备份与恢复互相等待"
+    assert errors == []
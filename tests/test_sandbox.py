@@ -0,0 +1,146 @@
+"""脚本进程池：工作进程由 forkserver / spawn 创建"""
+import threading
+
+import pytest
+
+from Common import eval as script_eval
+from Common import sandbox
+from Database import Table
+
+
+@pytest.fixture
+def pool():
+    pool = sandbox.ScriptPool(workers=1, timeout=5).start()
+    yield pool
+    pool.stop()
+
+
+def test_workers_are_not_forked_from_the_server():
+    # 另一个线程持有编译缓存的锁时启动工作进程：直接 fork 的子进程会带着这把已持有的锁，
+    # 编译脚本时永远等待
+    held, release = threading.Event(), threading.Event()
+    
+    def holder():
+        with script_eval.code_cache._lock:
+            held.set()
+            release.wait(30)
+    
+    thread = threading.Thread(target=holder)
+    thread.start()
+    held.wait(5)
+    try:
+        pool = sandbox.ScriptPool(workers=1, timeout=5).start()
+        try:
+            assert pool._context.get_start_method() in ("forkserver", "spawn")
+            result = pool.run("print(sum(range(10)))")
+        finally:
+            pool.stop()
+    finally:
+        release.set()
+        thread.join()
+    assert result.success and result.output.strip() == "45"
+
+
+def test_pool_runs_scripts_with_db_proxy(pool):
+    main = Table.of("main")
+    try:
+        result = pool.run('db.set("test_pool_key", "hello")\nprint(db.get("test_pool_key").value["text"])')
+        assert result.success, result.output
+        assert result.output.strip() == "hello"
+        assert main.get("test_pool_key").value["text"] == "hello"
+        assert result.operations
+    finally:
+        main.delete("test_pool_key")
+
+
+def test_hung_worker_is_replaced(pool):
+    result = pool.run("while True:\n    pass", budget=script_eval.Budget(wall_time=0.5))
+    assert not result.success
+    assert result.budget_exceeded["budget"] == "wall_time"
+    assert pool.run("print(1)").output.strip() == "1"
+    assert pool.info()["alive"] == 1
+
+
+def test_requests_run_scripts_concurrently(monkeypatch):
+    # 两个请求都在 visit_internal 中等待对方：在事件循环线程里同步执行时第二个请求进不来
+    import anyio
+    import httpx
+    
+    import app as server
+    
+    both = threading.Barrier(2, timeout=5)
+    
+    def visit_internal(pack):
+        both.wait()
+        return {"entry": pack.entry}
+    
+    monkeypatch.setattr(server, "visit_internal", visit_internal)
+    
+    async def requests():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = []
+            
+            async def get(path):
+                responses.append(await client.get(path))
+            
+            async with anyio.create_task_group() as group:
+                group.start_soon(get, "/api/first")
+                group.start_soon(get, "/api/second")
+            return responses
+    
+    responses = anyio.run(requests)
+    assert sorted(response.json()["entry"] for response in responses) == ["first", "second"]
+
+
+@pytest.fixture
+def failing_set(monkeypatch):
+    """父进程中写入以 bad 开头的键时 vmAPI.set 返回 False"""
+    from Database import vmAPI
+    original = vmAPI.set
+    
+    def set(self, key, content, mime="text"):
+        if key.startswith("bad"):
+            return False
+        return original(self, key, content, mime)
+    
+    monkeypatch.setattr(vmAPI, "set", set)
+
+
+def test_failed_batched_set_is_reported(pool, failing_set):
+    main = Table.of("main")
+    try:
+        # 攒满一批时由发出这一批的 set 返回 False
+        script = ('results = [db.set("bad_0" if i == 3 else f"test_batch_{i}", i) for i in range(%d)]\n'
+                  'print(results[:-1].count(False), results[-1])' % sandbox.DB_BATCH)
+        result = pool.run(script)
+        assert result.success, result.output
+        assert result.output.strip() == "0 False"
+        
+        # 之后的第一个 db 调用报告之前攒下的失败
+        result = pool.run('db.set("bad_1", "x")\ndb.exists("a")\nprint("unreachable")')
+        assert not result.success
+        assert "bad_1" in result.output and "unreachable" not in result.output
+        
+        # 脚本结束时的最后一批
+        result = pool.run('db.set("test_batch_ok", "x")\ndb.set("bad_2", "x")\nprint("done")')
+        assert not result.success
+        assert "bad_2" in result.output and "done" in result.output
+        assert main.get("test_batch_ok").value["text"] == "x"
+    finally:
+        for key in [f"test_batch_{i}" for i in range(sandbox.DB_BATCH)] + ["test_batch_ok"]:
+            main.delete(key)
+
+
+def test_update_reads_the_key_once(pool):
+    main = Table.of("main")
+    try:
+        result = pool.run('print(db.update("test_update_key", lambda text: "0" if text is None else text + "1"))\n'
+                          'print(db.update("test_update_key", lambda text: "0" if text is None else text + "1"))')
+        assert result.success, result.output
+        assert result.output.split() == ["0", "01"]
+        # 每次更新只有一次读取（另外一次 CAS），没有先 exists 再 get 的竞争窗口
+        reads = [operation for operation in result.operations if not operation.startswith("CAS")]
+        assert reads == ["GET test_update_key", "GET test_update_key"]
+    finally:
+        main.delete("test_update_key")
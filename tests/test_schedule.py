@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+from Database.schedule import BackupScheduler
+
+
+def _tables(version=1, dirty=()):
+    return {"t": SimpleNamespace(_sync_required=True, _version=version, _dirty_keys=set(dirty), _deleted_keys=set())}
+
+
+def test_fixed_interval_is_default():
+    scheduler = BackupScheduler(10)
+    assert not scheduler.adaptive
+    assert scheduler.target_interval("full") == 10
+    scheduler.record("full", 0.0, 0.1)
+    assert scheduler.due(_tables(), 5.0) is None
+    assert scheduler.due(_tables(), 10.2) == "interval"
+
+
+def test_adaptive_never_exceeds_data_loss_window():
+    # 不指定 max_interval 时以 backup_interval 为上限，即使快照很慢、脏键很少
+    scheduler = BackupScheduler(10, adaptive=True)
+    assert scheduler.max_interval == 10
+    scheduler.record("full", 0.0, 5.0)
+    assert scheduler.floor("full") == 10
+    assert scheduler.target_interval("full") == 10
+    assert scheduler.due(_tables(), 15.1) == "interval"
+
+
+def test_debounce_flushes_after_burst():
+    scheduler = BackupScheduler(60, debounce=1, debounce_keys=3, min_interval=0)
+    scheduler.record("full", 0.0, 0.0)
+    burst = _tables(5, dirty="abcd")
+    assert scheduler.due(burst, 1.0) is None
+    assert scheduler.due(burst, 2.5) == "debounce"
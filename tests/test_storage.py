@@ -0,0 +1,79 @@
+"""SQLite 存储引擎：读写、范围扫描不依赖内存中的键列表"""
+import pytest
+
+from Common.base import entry
+from Database import storage, vmAPI
+from Database.storage import SQLiteStore
+
+
+@pytest.fixture
+def sqlite_table(make_table, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_DIR", str(tmp_path / "storage"))
+    return make_table("sqlite", engine="sqlite")
+
+
+def _fill(table, n):
+    for i in range(n):
+        table.set(f"k{i:04d}", entry(mime="text", value={"text": str(i)}))
+
+
+def test_round_trip(sqlite_table):
+    _fill(sqlite_table, 10)
+    sqlite_table.set("raw", [1, 2])
+    assert len(sqlite_table.inner) == 11
+    assert sqlite_table.get("k0003").value["text"] == "3"
+    assert sqlite_table.get("raw") == [1, 2]
+    assert sqlite_table.delete("k0003") and not sqlite_table.delete("k0003")
+    assert sqlite_table.get("k0003") is None and len(sqlite_table.inner) == 10
+
+
+def test_scan_keys_uses_range_queries(sqlite_table, monkeypatch):
+    _fill(sqlite_table, 700)
+    for key in ("a", "k", "k1", "l"):
+        sqlite_table.set(key, "x")
+    
+    def no_full_iteration(self):
+        raise AssertionError("scan_keys 不应遍历整表")
+    
+    monkeypatch.setattr(SQLiteStore, "__iter__", no_full_iteration)
+    keys = list(sqlite_table.scan_keys("k", batch=64))
+    assert keys == sorted(["k", "k1"] + [f"k{i:04d}" for i in range(700)])
+    assert list(sqlite_table.scan_keys("k0", after="k0597")) == [f"k{i:04d}" for i in range(598, 700)]
+    assert list(sqlite_table.scan_keys("z")) == []
+    assert sqlite_table._sorted_keys is None
+
+
+def test_list_keys_pages_on_sqlite(sqlite_table, monkeypatch):
+    _fill(sqlite_table, 50)
+    api = vmAPI()
+    monkeypatch.setattr(api, "main", sqlite_table)
+    first = api.list_keys("k00*", limit=4)
+    assert first == ["k0000", "k0001", "k0002", "k0003"]
+    assert api.list_keys("k00*", limit=4, after=first[-1]) == ["k0004", "k0005", "k0006", "k0007"]
+    assert api.list_keys("k00?5") == ["k0005", "k0015", "k0025", "k0035", "k0045"]
+
+
+def test_iteration_is_batched(sqlite_table, monkeypatch):
+    monkeypatch.setattr(storage, "ITER_BATCH", 16)
+    _fill(sqlite_table, 100)
+    calls = []
+    key_range = sqlite_table.inner.key_range
+    
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return key_range(*args, **kwargs)
+    
+    monkeypatch.setattr(sqlite_table.inner, "key_range", counting)
+    assert list(sqlite_table.inner) == [f"k{i:04d}" for i in range(100)]
+    assert len(calls) == 7
+
+
+def test_snapshot_is_point_in_time(sqlite_table):
+    _fill(sqlite_table, 20)
+    with sqlite_table.snapshot() as snap:
+        sqlite_table.set("k0000", "changed")
+        sqlite_table.delete("k0001")
+        sqlite_table.set("new", "x")
+        items = dict(snap.items())
+    assert len(items) == 20
+    assert items["k0000"].value["text"] == "0" and "k0001" in items and "new" not in items
@@ -0,0 +1,116 @@
+"""预写日志：崩溃后重放，以及组提交与段滚动 / 关闭的并发"""
+import os
+import threading
+import time
+
+from Common.base import entry
+from Database import Table, tables
+from Database import wal as wal_module
+from Database.wal import WriteAheadLog
+
+
+def _text(text):
+    return entry(mime="text", value={"text": text})
+
+
+def test_replay_after_crash_skips_torn_tail(tmp_path, make_table):
+    wal = WriteAheadLog(tmp_path)
+    Table.wal = wal
+    try:
+        table = make_table("wal")
+        for i in range(50):
+            table.set(f"k{i:02d}", _text(f"v{i}"))
+        table.delete("k07")
+        table.set("raw", {"n": 1})
+    finally:
+        Table.wal = None
+    # 模拟崩溃：最后一条记录只写了一半，没有正常关闭
+    segment = wal.segments()[-1]
+    with open(segment, "ab") as f:
+        f.write(b'deadbeef ["S","' + table.name.encode() + b'","k99"')
+    
+    tables.pop(table.name)
+    fresh = Table(table.name)
+    replayed = WriteAheadLog(tmp_path).replay({table.name: fresh})
+    
+    assert replayed == 52
+    assert sorted(fresh.inner) == sorted(table.inner)
+    assert fresh.get("k07") is None and fresh.get("k99") is None
+    assert fresh.get("k49").value["text"] == "v49"
+    assert fresh.get("raw") == {"n": 1}
+
+
+def test_replay_ignores_corrupted_record(tmp_path, make_table):
+    wal = WriteAheadLog(tmp_path)
+    Table.wal = wal
+    try:
+        table = make_table("wal")
+        table.set("a", _text("1"))
+        table.set("b", _text("2"))
+    finally:
+        Table.wal = None
+    wal.close()
+    segment = wal.segments()[-1]
+    data = segment.read_bytes().replace(b'"2"', b'"3"')
+    segment.write_bytes(data)
+    
+    tables.pop(table.name)
+    fresh = Table(table.name)
+    assert WriteAheadLog(tmp_path).replay({table.name: fresh}) == 1
+    assert fresh.get("a").value["text"] == "1" and fresh.get("b") is None
+
+
+def test_rotate_and_close_wait_for_group_commit_leader(tmp_path, make_table, monkeypatch):
+    """leader 在锁外 fsync 时，rotate / close 不能关闭它正在使用的文件"""
+    real_fsync = os.fsync
+    reused = []
+    
+    def slow_fsync(fd):
+        if threading.current_thread() is threading.main_thread():
+            # rotate 自己的 fsync 不放慢，让它在 leader fsync 期间尝试关闭文件
+            return real_fsync(fd)
+        # 文件被关闭后 fd 可能立即被新段复用，fsync 不报错却落在了别的文件上
+        inode = os.fstat(fd).st_ino
+        time.sleep(0.005)
+        if os.fstat(fd).st_ino != inode:
+            reused.append(fd)
+        real_fsync(fd)
+    
+    monkeypatch.setattr(wal_module.os, "fsync", slow_fsync)
+    wal = WriteAheadLog(tmp_path, sync_mode="group")
+    Table.wal = wal
+    table = make_table("wal")
+    errors = []
+    stop = threading.Event()
+    
+    def writer(n):
+        i = 0
+        while not stop.is_set():
+            try:
+                table.set(f"w{n}-{i}", _text(str(i)))
+            except Exception as e:
+                errors.append(e)
+                return
+            i += 1
+    
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for _ in range(30):
+            wal.rotate()
+            time.sleep(0.002)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        Table.wal = None
+    wal.close()
+    
+    assert errors == [] and reused == []
+    assert wal._durable_lsn == wal._written_lsn
+    # 所有写入都能从日志中重放
+    tables.pop(table.name)
+    fresh = Table(table.name)
+    WriteAheadLog(tmp_path).replay({table.name: fresh})
+    assert sorted(fresh.inner) == sorted(table.inner)